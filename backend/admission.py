@@ -0,0 +1,215 @@
+"""
+Admission control for expensive endpoints.
+
+Routes decorated with @admit('<cost class>') are rate limited by two token
+buckets per class, one per user (JWT identity, or client IP for the
+unauthenticated proxies) and one for the whole process, answered with 429 and
+Retry-After when empty. They are also shed with 503 and Retry-After when the
+database is saturated: when requests are already queueing for a pooled
+connection of any server (primary, read replicas or post shards), when their
+recent average wait for one is too long, or when fewer than
+ADMISSION_RESERVED_CONNECTIONS primary connections are free, so login, health
+checks and other cheap endpoints always find one. Each class additionally has
+a cap on concurrently running requests.
+
+Limits are per process; with N gunicorn workers the effective global limit is N times higher.
+"""
+
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import jsonify, make_response, request
+
+from db import pool_stats
+
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+# Pooled connections kept free for endpoints without admission control
+ADMISSION_RESERVED_CONNECTIONS = int(os.getenv('ADMISSION_RESERVED_CONNECTIONS', '2'))
+# Shed when the average wait for a pooled connection exceeds this (seconds)
+ADMISSION_MAX_POOL_WAIT = float(os.getenv('ADMISSION_MAX_POOL_WAIT', '0.25'))
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', '2'))
+# Per-user buckets kept in memory (least recently used are dropped first)
+ADMISSION_MAX_TRACKED_USERS = 10000
+# Reverse proxies in front of the backend whose X-Forwarded-For is trusted
+# (1 behind the bundled nginx); 0 uses the connecting address
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '0'))
+
+
+def _class_config(name, user_rate, user_burst, global_rate, global_burst, max_inflight):
+    """Defaults for a cost class, overridable as ADMISSION_<CLASS>_<SETTING>"""
+    def env(setting, default):
+        return type(default)(os.getenv(f"ADMISSION_{name.upper()}_{setting}", str(default)))
+    return {
+        'user_rate': env('USER_RATE', user_rate),
+        'user_burst': env('USER_BURST', user_burst),
+        'global_rate': env('GLOBAL_RATE', global_rate),
+        'global_burst': env('GLOBAL_BURST', global_burst),
+        'max_inflight': env('MAX_INFLIGHT', max_inflight),
+    }
+
+
+# Rates are requests per second
+COST_CLASSES = {
+    'export': _class_config('export', 0.05, 3, 0.5, 5, 2),
+    'listing': _class_config('listing', 5.0, 20, 50.0, 100, 16),
+    'stats': _class_config('stats', 1.0, 5, 20.0, 40, 8),
+    'proxy': _class_config('proxy', 20.0, 60, 200.0, 400, 32),
+}
+
+
+class TokenBucket:
+    """Non-blocking token bucket"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Consume a token; returns 0 on success or the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    def __init__(self, classes=COST_CLASSES):
+        self._classes = classes
+        self._lock = threading.Lock()
+        self._global = {name: TokenBucket(c['global_rate'], c['global_burst']) for name, c in classes.items()}
+        self._users = OrderedDict()
+        self._inflight = {name: 0 for name in classes}
+        self.rejected = {name: {'rate_limited': 0, 'overloaded': 0} for name in classes}
+
+    def _user_bucket(self, cost_class, user):
+        key = (cost_class, user)
+        bucket = self._users.get(key)
+        if bucket is None:
+            config = self._classes[cost_class]
+            bucket = self._users[key] = TokenBucket(config['user_rate'], config['user_burst'])
+            while len(self._users) > ADMISSION_MAX_TRACKED_USERS:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(key)
+        return bucket
+
+    def _overloaded(self):
+        # Listing reads may go to a replica or every shard, so any saturated pool counts
+        for name, pool in pool_stats().items():
+            if pool['waiting'] > 0 or pool['avg_wait_ms'] > ADMISSION_MAX_POOL_WAIT * 1000:
+                return True
+            # Login and health checks use the primary
+            if name == 'primary' and pool['size'] - pool['in_use'] <= ADMISSION_RESERVED_CONNECTIONS:
+                return True
+        return False
+
+    def try_admit(self, cost_class, user):
+        """Returns (None, 0) when admitted, else (429 or 503, retry-after seconds)"""
+        with self._lock:
+            if self._inflight[cost_class] >= self._classes[cost_class]['max_inflight'] or self._overloaded():
+                self.rejected[cost_class]['overloaded'] += 1
+                return 503, ADMISSION_RETRY_AFTER
+            wait = self._user_bucket(cost_class, user).take()
+            if not wait:
+                wait = self._global[cost_class].take()
+            if wait:
+                self.rejected[cost_class]['rate_limited'] += 1
+                return 429, max(1, int(wait + 0.999))
+            self._inflight[cost_class] += 1
+            return None, 0
+
+    def release(self, cost_class):
+        with self._lock:
+            self._inflight[cost_class] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'inflight': dict(self._inflight),
+                'rejected': {name: dict(counts) for name, counts in self.rejected.items()},
+                'pools': pool_stats(),
+            }
+
+
+controller = AdmissionController()
+
+
+def _client_key():
+    """JWT identity when the route is authenticated, otherwise the client address"""
+    try:
+        from flask_jwt_extended import get_jwt_identity
+        identity = get_jwt_identity()
+        if identity:
+            return f"user:{identity}"
+    except RuntimeError:
+        pass
+    # Behind TRUSTED_PROXY_HOPS proxies ProxyFix has already set remote_addr to the client
+    return f"ip:{request.remote_addr}"
+
+
+def overloaded_response(retry_after=ADMISSION_RETRY_AFTER):
+    response = jsonify({'error': 'Service is busy, please retry shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def admit(cost_class):
+    """Route decorator applying the cost class limits (place it below @jwt_required)"""
+    if cost_class not in COST_CLASSES:
+        raise ValueError(f"Unknown cost class '{cost_class}'")
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ADMISSION_ENABLED:
+                return fn(*args, **kwargs)
+            status, retry_after = controller.try_admit(cost_class, _client_key())
+            if status == 503:
+                return overloaded_response(retry_after)
+            if status == 429:
+                response = jsonify({'error': 'Too many requests'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+
+            released = []
+
+            def release():
+                if not released:
+                    released.append(True)
+                    controller.release(cost_class)
+
+            try:
+                response = make_response(fn(*args, **kwargs))
+            except BaseException:
+                release()
+                raise
+            # Streaming responses stay in flight until the body has been sent
+            response.call_on_close(release)
+            return response
+        return wrapper
+    return decorator
+
+
+def init_admission(app):
+    """Take client addresses from trusted proxies and turn handler errors caused by an exhausted connection pool into 503s"""
+    from db import consume_pool_exhausted
+
+    if TRUSTED_PROXY_HOPS > 0:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+    @app.after_request
+    def _pool_exhausted_to_503(response):
+        if consume_pool_exhausted() and response.status_code == 500:
+            return overloaded_response()
+        return response
@@ -0,0 +1,224 @@
+"""
+Engagement trend analytics computed with NumPy.
+
+All posts in the requested window are fetched in one round trip as column
+arrays (array_agg per column) and aggregated per (series, time bucket) with
+bincount, instead of looping over rows in Python.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BUCKET_SECONDS = {'day': 86400, 'week': 7 * 86400}
+# Lag (in buckets) used for the week-over-week growth series
+WOW_LAG = {'day': 7, 'week': 1}
+PERCENTILES = (50, 75, 90, 99)
+
+# Results are cached per parameter set for one TRENDS_CACHE_SECONDS time bucket
+TRENDS_CACHE_SECONDS = int(os.getenv('TRENDS_CACHE_SECONDS', '300'))
+TRENDS_CACHE_MAX_ENTRIES = int(os.getenv('TRENDS_CACHE_MAX_ENTRIES', '128'))
+
+GROUP_KEY_SQL = "COALESCE(NULLIF(fp.group_id, ''), (regexp_match(fp.post_url, '/groups/([^/?]+)'))[1])"
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def fetch_trend_columns(cursor, since_epoch, group_id=None):
+    """Fetch the window's posts as column arrays in a single query"""
+    where = "fp.created_at >= %s"
+    params = [since_epoch]
+    if group_id:
+        where += f" AND {GROUP_KEY_SQL} = %s"
+        params.append(group_id)
+    cursor.execute(f"""
+        SELECT
+            COALESCE(array_agg(fp.created_at), '{{}}') AS created_at,
+            COALESCE(array_agg(COALESCE(fp.reaction_count, 0)), '{{}}') AS reactions,
+            COALESCE(array_agg(COALESCE(fp.comment_count, 0)), '{{}}') AS comments,
+            COALESCE(array_agg(COALESCE(fp.share_count, 0)), '{{}}') AS shares,
+            COALESCE(array_agg({GROUP_KEY_SQL}), '{{}}') AS group_id,
+            COALESCE(array_agg(fp.author_name), '{{}}') AS author
+        FROM facebook_posts fp
+        WHERE {where}
+    """, params)
+    row = cursor.fetchone()
+    return {
+        'created_at': np.asarray(row['created_at'], dtype=np.int64),
+        'reactions': np.asarray(row['reactions'], dtype=np.int64),
+        'comments': np.asarray(row['comments'], dtype=np.int64),
+        'shares': np.asarray(row['shares'], dtype=np.int64),
+        'group_id': np.asarray([g or '' for g in row['group_id']], dtype=object),
+        'author': np.asarray([a or '' for a in row['author']], dtype=object),
+    }
+
+
+def concat_trend_columns(parts):
+    """Join the fetch_trend_columns() results of several shards"""
+    if len(parts) == 1:
+        return parts[0]
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def _rolling_mean(values, window):
+    """Trailing mean along the last axis; the first window-1 points average what exists"""
+    cumsum = np.cumsum(values, axis=-1, dtype=np.float64)
+    shifted = np.zeros_like(cumsum)
+    shifted[..., window:] = cumsum[..., :-window]
+    counts = np.minimum(np.arange(1, values.shape[-1] + 1), window)
+    return (cumsum - shifted) / counts
+
+
+def _growth(values, lag):
+    """Relative change of a lag-bucket trailing sum vs the previous lag buckets (NaN if undefined)"""
+    cumsum = np.cumsum(values, axis=-1, dtype=np.float64)
+    trailing = cumsum.copy()
+    trailing[..., lag:] -= cumsum[..., :-lag]
+    growth = np.full(values.shape, np.nan)
+    current = trailing[..., lag:]
+    previous = trailing[..., :-lag]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth[..., lag:] = np.where(previous > 0, (current - previous) / previous, np.nan)
+    # Windows at the start don't cover a full previous period yet
+    growth[..., :2 * lag - 1] = np.nan
+    return growth
+
+
+def _series_percentiles(codes, engagement, n_series):
+    """Engagement-per-post percentiles for each series code"""
+    result = np.full((n_series, len(PERCENTILES)), np.nan)
+    if codes.size == 0:
+        return result
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    sorted_values = engagement[order]
+    bounds = np.searchsorted(sorted_codes, np.arange(n_series + 1))
+    for code in range(n_series):
+        chunk = sorted_values[bounds[code]:bounds[code + 1]]
+        if chunk.size:
+            result[code] = np.percentile(chunk, PERCENTILES)
+    return result
+
+
+def _to_list(values, digits=4):
+    """NaN-safe rounding for JSON"""
+    return [None if np.isnan(v) else round(float(v), digits) for v in values]
+
+
+def _build_series(keys, codes, bucket_idx, n_buckets, columns, mask, rolling_window, wow_lag):
+    """Aggregate the masked posts into per-key time series"""
+    n_series = len(keys)
+    codes = codes[mask]
+    flat = codes * n_buckets + bucket_idx[mask]
+    size = n_series * n_buckets
+
+    def per_bucket(weights=None):
+        return np.bincount(flat, weights=weights, minlength=size).reshape(n_series, n_buckets)
+
+    posts = per_bucket()
+    reactions = per_bucket(columns['reactions'][mask])
+    comments = per_bucket(columns['comments'][mask])
+    shares = per_bucket(columns['shares'][mask])
+    engagement = reactions + comments + shares
+
+    posts_avg = _rolling_mean(posts, rolling_window)
+    engagement_avg = _rolling_mean(engagement, rolling_window)
+    posts_wow = _growth(posts, wow_lag)
+    engagement_wow = _growth(engagement, wow_lag)
+
+    post_engagement = (columns['reactions'][mask] + columns['comments'][mask] + columns['shares'][mask])
+    percentiles = _series_percentiles(codes, post_engagement.astype(np.float64), n_series)
+
+    series = []
+    for i, key in enumerate(keys):
+        series.append({
+            'key': key,
+            'total_posts': int(posts[i].sum()),
+            'total_engagement': int(engagement[i].sum()),
+            'posts': posts[i].astype(np.int64).tolist(),
+            'reactions': reactions[i].astype(np.int64).tolist(),
+            'comments': comments[i].astype(np.int64).tolist(),
+            'shares': shares[i].astype(np.int64).tolist(),
+            'posts_rolling_avg': _to_list(posts_avg[i]),
+            'engagement_rolling_avg': _to_list(engagement_avg[i]),
+            'posts_wow_growth': _to_list(posts_wow[i]),
+            'engagement_wow_growth': _to_list(engagement_wow[i]),
+            'engagement_per_post_percentiles': {
+                f"p{p}": (None if np.isnan(v) else round(float(v), 2))
+                for p, v in zip(PERCENTILES, percentiles[i])
+            },
+        })
+    return series
+
+
+def _top_keys(values, top):
+    """Factorize non-empty keys, keeping the `top` most frequent"""
+    present = values != ''
+    keys, inverse, counts = np.unique(values[present], return_inverse=True, return_counts=True)
+    keep = np.argsort(-counts, kind='stable')[:top]
+    # Map original key index -> rank in the kept list (-1 when dropped)
+    remap = np.full(len(keys), -1, dtype=np.int64)
+    remap[keep] = np.arange(len(keep))
+    codes = np.full(values.shape, -1, dtype=np.int64)
+    codes[present] = remap[inverse]
+    return [str(k) for k in keys[keep]], codes
+
+
+def compute_trends(columns, now, days, bucket, top, rolling_window):
+    """Compute overall, per-group and per-author series from fetch_trend_columns output"""
+    bucket_seconds = BUCKET_SECONDS[bucket]
+    end_bucket = int(now) // bucket_seconds
+    start_bucket = end_bucket - max(1, (days * 86400) // bucket_seconds) + 1
+    n_buckets = end_bucket - start_bucket + 1
+
+    bucket_idx = columns['created_at'] // bucket_seconds - start_bucket
+    in_range = (bucket_idx >= 0) & (bucket_idx < n_buckets)
+    bucket_idx = np.clip(bucket_idx, 0, n_buckets - 1)
+    wow_lag = WOW_LAG[bucket]
+
+    overall = _build_series(['all'], np.zeros(bucket_idx.shape, dtype=np.int64), bucket_idx, n_buckets,
+                            columns, in_range, rolling_window, wow_lag)[0]
+
+    group_keys, group_codes = _top_keys(columns['group_id'], top)
+    groups = _build_series(group_keys, group_codes, bucket_idx, n_buckets, columns,
+                           in_range & (group_codes >= 0), rolling_window, wow_lag)
+
+    author_keys, author_codes = _top_keys(columns['author'], top)
+    authors = _build_series(author_keys, author_codes, bucket_idx, n_buckets, columns,
+                            in_range & (author_codes >= 0), rolling_window, wow_lag)
+
+    buckets = [
+        datetime.fromtimestamp((start_bucket + i) * bucket_seconds, tz=timezone.utc).date().isoformat()
+        for i in range(n_buckets)
+    ]
+    return {
+        'bucket': bucket,
+        'buckets': buckets,
+        'rolling_window': rolling_window,
+        'overall': overall,
+        'groups': groups,
+        'authors': authors,
+    }
+
+
+def cached_trends(params, compute):
+    """Return compute() for params, cached for the current TRENDS_CACHE_SECONDS bucket"""
+    key = (tuple(sorted(params.items())), int(time.time() // TRENDS_CACHE_SECONDS))
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key], True
+    result = compute()
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > TRENDS_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return result, False
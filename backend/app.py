@@ -4,16 +4,39 @@ from flask_cors import CORS
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 import logging
 from werkzeug.security import check_password_hash, generate_password_hash
 import json
+import queue
+import time
 
 # Load environment variables (check current dir and parent dir)
 load_dotenv()
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 
+from admission import admit, controller as admission, init_admission
+from authors import AuthorIndex
+from compression import init_compression
+from db import get_db_connection, run_concurrently
+import engagement
+from events import PostEventBroker, format_sse
+import facets
+import statements
+import profiling
+import shards
+from image_cache import CLUSTER_LOOKUP_SQL, ImageCache, cluster_cache_key, fetch_image, url_cache_key
+from media_store import DIGEST_RE, get_media_store
+from video_proxy import (
+    PASSTHROUGH_HEADERS, VIDEO_CACHE_ENABLED, SegmentCache, iter_upstream, open_upstream, parse_range,
+    upstream_extent
+)
+from exports import (
+    COLUMNAR_FORMATS, EXPORT_BATCH_SIZE, EXPORT_FORMATS, EXPORT_QUERY, STREAMED_FORMATS, ExportJobManager,
+    attachment_urls, get_job_status, iter_export, result_path, write_export
+)
+
 app = Flask(__name__)
 
 # Configuration
@@ -24,15 +47,11 @@ app.config['JWT_ALGORITHM'] = 'HS256'
 # Initialize extensions
 jwt = JWTManager(app)
 CORS(app, origins="*")  # In production, specify your frontend URL
+init_compression(app)
+init_admission(app)
 
-# Database configuration
-DB_CONFIG = {
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'port': os.getenv('DB_PORT', '5432'),
-    'user': os.getenv('DB_USER', 'postgres'),
-    'password': os.getenv('DB_PASS', ''),
-    'database': os.getenv('DB_NAME', 'facebook_aggregator')
-}
+# Compact JSON responses (Flask would pretty-print in debug mode)
+app.json.compact = True
 
 # Password hashing is now handled via database
 
@@ -41,14 +60,18 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def get_db_connection():
-    """Create and return a database connection"""
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
-    except psycopg2.Error as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+def _is_admin(email):
+    """Whether the user behind a JWT identity is an active admin"""
+    conn = get_db_connection(readonly=True)
+    cursor = conn.cursor()
+    cursor.execute("SELECT is_admin AND is_active FROM users WHERE email = %s", (email,))
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return bool(row and row[0])
+
+
+profiling.init_profiling(app, _is_admin)
 
 
 def extract_group_id_from_url(post_url):
@@ -77,6 +100,125 @@ def extract_group_id_from_url(post_url):
     return None
 
 
+def _date_to_epoch(value, days=0):
+    """Epoch seconds of midnight UTC on a YYYY-MM-DD date, plus `days`"""
+    day = datetime.strptime(str(value).strip()[:10], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    return int((day + timedelta(days=days)).timestamp())
+
+
+def _author_name(author_id):
+    """Name of an author by /api/authors id, or None if there is no such author"""
+    shard, row_id = shards.split_global_id(author_id)
+    row, = run_concurrently([("SELECT author_name FROM authors WHERE id = %s", (row_id,), 'one', 'author_name', shard)])
+    return row[0] if row else None
+
+
+# Query parameters read by build_post_filters
+POST_FILTER_KEYS = (
+    'author', 'author_id', 'keyword', 'group_id', 'date_from', 'date_to', 'content_type', 'has_media', 'dedupe'
+)
+
+CONTENT_TYPES = ('video', 'image', 'text')
+
+
+def build_post_filters(args):
+    """Build the WHERE clause and params for the post filters shared by listing and export.
+
+    Reads author, author_id, keyword, group_id, date_from, date_to, content_type, has_media and dedupe
+    from a request.args-like mapping.
+    """
+    author = args.get('author', '')
+    author_id = str(args.get('author_id', '')).strip()
+    keyword = args.get('keyword', '')
+    group_id = args.get('group_id', '')
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
+    content_types = [t.strip().lower() for t in str(args.get('content_type', '')).split(',') if t.strip()]
+    has_media = str(args.get('has_media', '')).strip().lower()
+
+    # Build WHERE clause - use facebook_posts column names
+    where_conditions = []
+    params = []
+
+    if author:
+        where_conditions.append("fp.author_name ILIKE %s")
+        params.append(f"%{author}%")
+
+    if author_id:
+        # Exact match against the author directory (see /api/authors)
+        if not author_id.isdigit():
+            where_conditions.append("FALSE")
+        elif shards.SHARDING_ENABLED:
+            # Author ids are per shard: look the author up by name on each one
+            author_name = _author_name(int(author_id))
+            if author_name is None:
+                where_conditions.append("FALSE")
+            else:
+                where_conditions.append("fp.author_id = (SELECT id FROM authors WHERE author_name = %s)")
+                params.append(author_name)
+        else:
+            where_conditions.append("fp.author_id = %s")
+            params.append(int(author_id))
+
+    if keyword:
+        where_conditions.append("fp.post_text ILIKE %s")
+        params.append(f"%{keyword}%")
+
+    if group_id:
+        # Handle group filtering: check both group_id column and extract from post_url
+        # Use COALESCE to get group_id from column or extract from URL
+        # Improved regex to handle URLs with or without trailing slash and query parameters
+        where_conditions.append("""
+            (COALESCE(NULLIF(fp.group_id, ''), 
+                CASE 
+                    WHEN fp.post_url ~ '/groups/([^/?]+)' 
+                    THEN (regexp_match(fp.post_url, '/groups/([^/?]+)'))[1]
+                    ELSE NULL 
+                END
+            ) = %s)
+        """)
+        params.append(group_id)
+
+    # Stored media summary columns (see init_db.sql), indexed with created_at
+    if content_types:
+        if all(t in CONTENT_TYPES for t in content_types):
+            where_conditions.append("fp.content_type = ANY(%s)")
+            params.append(content_types)
+        else:
+            where_conditions.append("FALSE")
+
+    if has_media in ('true', 'false'):
+        where_conditions.append("fp.content_type IN ('video', 'image')" if has_media == 'true' else "fp.content_type = 'text'")
+
+    # Compare the BIGINT created_at against epoch constants (not to_timestamp(created_at))
+    # so indexes on created_at apply and the planner can prune monthly partitions
+    if date_from:
+        # Start of day (00:00:00 UTC) for date_from
+        where_conditions.append("fp.created_at >= %s")
+        params.append(_date_to_epoch(date_from))
+
+    if date_to:
+        # Exclusive end of day for date_to to include the entire day
+        where_conditions.append("fp.created_at < %s")
+        params.append(_date_to_epoch(date_to, days=1))
+
+    where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
+
+    if str(args.get('dedupe', '')).lower() == 'true':
+        # Collapse near-duplicates (see dedupe_worker.py): keep the newest matching post per cluster
+        where_clause = f"""
+            fp.id IN (
+                SELECT DISTINCT ON (COALESCE(pm.cluster_id, fp.id)) fp.id
+                FROM facebook_posts fp
+                LEFT JOIN post_minhash pm ON pm.post_id = fp.id
+                WHERE {where_clause}
+                ORDER BY COALESCE(pm.cluster_id, fp.id), fp.created_at DESC, fp.id
+            )
+        """
+
+    return where_clause, params
+
+
 @app.route('/api/login', methods=['POST'])
 def login():
     """Authenticate user and return JWT token"""
@@ -132,19 +274,15 @@ def login():
 
 @app.route('/api/posts', methods=['GET'])
 @jwt_required()
+@admit('listing')
 def get_posts():
     """Get paginated list of posts with optional filters"""
     try:
         # Get query parameters
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 20))
-        author = request.args.get('author', '')
-        keyword = request.args.get('keyword', '')
-        group_id = request.args.get('group_id', '')
         sort_by = request.args.get('sort_by', 'created_at')  # created_at, reactions, comments, shares
         order = request.args.get('order', 'desc')  # asc, desc
-        date_from = request.args.get('date_from', '')
-        date_to = request.args.get('date_to', '')
 
         # Validate sort_by and order - map to facebook_posts column names
         sort_field_map = {
@@ -163,62 +301,20 @@ def get_posts():
 
         offset = (page - 1) * per_page
 
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-        # Build WHERE clause - use facebook_posts column names
-        where_conditions = []
-        params = []
+        # Cards only need one image or video: skip the attachment aggregation
+        thumbnails_only = str(request.args.get('thumbnails_only', '')).lower() == 'true'
 
-        if author:
-            where_conditions.append("fp.author_name ILIKE %s")
-            params.append(f"%{author}%")
+        where_clause, params = build_post_filters(request.args)
 
-        if keyword:
-            where_conditions.append("fp.post_text ILIKE %s")
-            params.append(f"%{keyword}%")
-
-        if group_id:
-            # Handle group filtering: check both group_id column and extract from post_url
-            # Use COALESCE to get group_id from column or extract from URL
-            # Improved regex to handle URLs with or without trailing slash and query parameters
-            where_conditions.append("""
-                (COALESCE(NULLIF(fp.group_id, ''), 
-                    CASE 
-                        WHEN fp.post_url ~ '/groups/([^/?]+)' 
-                        THEN (regexp_match(fp.post_url, '/groups/([^/?]+)'))[1]
-                        ELSE NULL 
-                    END
-                ) = %s)
-            """)
-            params.append(group_id)
-
-        if date_from:
-            # Convert date string to timestamp for comparison with BIGINT created_at
-            # Use start of day (00:00:00) for date_from
-            where_conditions.append("to_timestamp(fp.created_at) >= %s::date")
-            params.append(date_from)
-
-        if date_to:
-            # Convert date string to timestamp for comparison with BIGINT created_at
-            # Use end of day (23:59:59) for date_to to include the entire day
-            where_conditions.append("to_timestamp(fp.created_at) < (%s::date + INTERVAL '1 day')")
-            params.append(date_to)
-
-        where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
-
-        # Get total count from facebook_posts
+        # Total count from facebook_posts (runs concurrently with the page query below)
         count_query = f"SELECT COUNT(*) as total FROM facebook_posts fp WHERE {where_clause}"
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
 
-        # Get posts with attachments aggregated
-        # Convert BIGINT created_at to TIMESTAMP, aggregate attachments
+        # Convert BIGINT created_at to TIMESTAMP
         # Extract group_id from post_url if group_id column is empty
-        query = f"""
-            SELECT 
+        columns = """
                 fp.id,
                 fp.post_url,
+                fp.author_id,
                 fp.author_name as author_name,
                 fp.author_url as author_url,
                 fp.post_text as text_content,
@@ -234,40 +330,84 @@ def get_posts():
                 fp.comment_count as comments,
                 fp.share_count as shares,
                 to_timestamp(fp.created_at) as created_at,
-                COALESCE(
-                    json_agg(
-                        DISTINCT jsonb_build_object(
-                            'url', fa.attachment_url,
-                            'type', fa.attachment_type
-                        )
-                    ) FILTER (WHERE fa.attachment_type = 'image'),
-                    '[]'::json
-                ) as image_attachments,
-                COALESCE(
-                    json_agg(
-                        DISTINCT jsonb_build_object(
-                            'url', fa.attachment_url,
-                            'type', fa.attachment_type
-                        )
-                    ) FILTER (WHERE fa.attachment_type = 'video'),
-                    '[]'::json
-                ) as video_attachments
-            FROM facebook_posts fp
-            LEFT JOIN facebook_attachments fa ON fp.post_url = fa.post_url
-            WHERE {where_clause}
-            GROUP BY fp.id, fp.post_url, fp.group_id, fp.reaction_count, fp.comment_count, fp.share_count, fp.created_at,
-                     (fp.author_name), (fp.author_url), (fp.post_text)
-            ORDER BY {sort_field} {order.upper()}
-            LIMIT %s OFFSET %s
+                fp.content_type,
+                fp.image_count,
+                fp.video_count
         """
-        params.extend([per_page, offset])
-        cursor.execute(query, params)
-        posts = cursor.fetchall()
+        if thumbnails_only:
+            # Only the stored first image/video (see the media summary in init_db.sql):
+            # no aggregation over facebook_attachments
+            query = f"""
+                SELECT {columns},
+                    fp.first_image_url,
+                    '/api/media/' || ami.sha256 as first_image_media_url,
+                    fp.first_video_url,
+                    '/api/media/' || amv.sha256 as first_video_media_url
+                FROM facebook_posts fp
+                LEFT JOIN attachment_media ami ON ami.attachment_url = fp.first_image_url
+                LEFT JOIN attachment_media amv ON amv.attachment_url = fp.first_video_url
+                WHERE {where_clause}
+                ORDER BY {sort_field} {order.upper()}
+                LIMIT %s OFFSET %s
+            """
+        else:
+            # Get posts with attachments aggregated
+            query = f"""
+                SELECT {columns},
+                    COALESCE(
+                        json_agg(
+                            DISTINCT jsonb_build_object(
+                                'url', fa.attachment_url,
+                                'type', fa.attachment_type,
+                                'media_url', '/api/media/' || am.sha256
+                            )
+                        ) FILTER (WHERE fa.attachment_type = 'image'),
+                        '[]'::json
+                    ) as image_attachments,
+                    COALESCE(
+                        json_agg(
+                            DISTINCT jsonb_build_object(
+                                'url', fa.attachment_url,
+                                'type', fa.attachment_type,
+                                'media_url', '/api/media/' || am.sha256
+                            )
+                        ) FILTER (WHERE fa.attachment_type = 'video'),
+                        '[]'::json
+                    ) as video_attachments
+                FROM facebook_posts fp
+                LEFT JOIN facebook_attachments fa ON fp.post_url = fa.post_url
+                LEFT JOIN attachment_media am ON am.attachment_url = fa.attachment_url
+                WHERE {where_clause}
+                GROUP BY fp.id, fp.post_url, fp.author_id, fp.group_id, fp.reaction_count, fp.comment_count, fp.share_count, fp.created_at,
+                         (fp.author_name), (fp.author_url), (fp.post_text), fp.content_type, fp.image_count, fp.video_count
+                ORDER BY {sort_field} {order.upper()}
+                LIMIT %s OFFSET %s
+            """
+        page_label = 'posts.thumbnails' if thumbnails_only else 'posts.page'
+        targets = shards.route(request.args.get('group_id', ''))
+        if len(targets) == 1:
+            count_row, posts = run_concurrently([
+                (count_query, params, 'one', 'posts.count', targets[0]),
+                (query, params + [per_page, offset], 'all', page_label, targets[0]),
+            ], cursor_factory=RealDictCursor)
+            total = count_row['total']
+        else:
+            # Scatter to every shard: each returns its first offset + per_page rows,
+            # the page is cut from their k-way merge on the sort key
+            results = run_concurrently(
+                [(count_query, params, 'one', 'posts.count', shard) for shard in targets]
+                + [(query, params + [offset + per_page, 0], 'all', page_label, shard) for shard in targets],
+                cursor_factory=RealDictCursor)
+            total = sum(row['total'] for row in results[:len(targets)])
+            posts = shards.merge_page(list(zip(targets, results[len(targets):])), shards.sort_key(sort_by),
+                                      order == 'desc', offset, per_page)
 
         # Convert to list of dicts and format dates
         posts_list = []
+        post_shards = []
         for post in posts:
             post_dict = dict(post)
+            post_shards.append(post_dict.pop('_shard', targets[0]))
             # Convert post_url to post_id for frontend compatibility
             post_dict['post_id'] = post_dict.pop('post_url')
             # Convert author_name to author for frontend compatibility
@@ -275,35 +415,46 @@ def get_posts():
             # Convert text_content to content for frontend compatibility
             post_dict['content'] = post_dict.pop('text_content')
             
-            # Extract image URLs from image_attachments JSON array
-            image_urls = []
-            if post_dict.get('image_attachments'):
-                if isinstance(post_dict['image_attachments'], str):
-                    try:
-                        image_attachments = json.loads(post_dict['image_attachments'])
-                    except:
-                        image_attachments = []
-                else:
-                    image_attachments = post_dict['image_attachments']
+            if thumbnails_only:
+                # Prefer the archived copy (stable /api/media URL) over the expiring CDN URL
+                first_image = post_dict.pop('first_image_media_url') or post_dict.get('first_image_url')
+                first_video = post_dict.pop('first_video_media_url') or post_dict.get('first_video_url')
+                post_dict.pop('first_image_url')
+                post_dict.pop('first_video_url')
+                image_urls = [first_image] if first_image else []
+                video_urls = [first_video] if first_video else []
+            else:
+                # Extract image URLs from image_attachments JSON array
+                image_urls = []
+                if post_dict.get('image_attachments'):
+                    if isinstance(post_dict['image_attachments'], str):
+                        try:
+                            image_attachments = json.loads(post_dict['image_attachments'])
+                        except:
+                            image_attachments = []
+                    else:
+                        image_attachments = post_dict['image_attachments']
                 
-                # Extract URLs from attachment objects
-                if isinstance(image_attachments, list):
-                    image_urls = [att.get('url') for att in image_attachments if att and att.get('url')]
+                    # Extract URLs from attachment objects
+                    if isinstance(image_attachments, list):
+                        # Prefer the archived copy (stable /api/media URL) over the expiring CDN URL
+                        image_urls = [att.get('media_url') or att.get('url') for att in image_attachments if att and att.get('url')]
             
-            # Extract video URLs from video_attachments JSON array
-            video_urls = []
-            if post_dict.get('video_attachments'):
-                if isinstance(post_dict['video_attachments'], str):
-                    try:
-                        video_attachments = json.loads(post_dict['video_attachments'])
-                    except:
-                        video_attachments = []
-                else:
-                    video_attachments = post_dict['video_attachments']
+                # Extract video URLs from video_attachments JSON array
+                video_urls = []
+                if post_dict.get('video_attachments'):
+                    if isinstance(post_dict['video_attachments'], str):
+                        try:
+                            video_attachments = json.loads(post_dict['video_attachments'])
+                        except:
+                            video_attachments = []
+                    else:
+                        video_attachments = post_dict['video_attachments']
                 
-                # Extract URLs from attachment objects
-                if isinstance(video_attachments, list):
-                    video_urls = [att.get('url') for att in video_attachments if att and att.get('url')]
+                    # Extract URLs from attachment objects
+                    if isinstance(video_attachments, list):
+                        # Prefer the archived copy (stable /api/media URL) over the expiring CDN URL
+                        video_urls = [att.get('media_url') or att.get('url') for att in video_attachments if att and att.get('url')]
             
             # Set image_urls and media_url
             post_dict['image_urls'] = image_urls
@@ -316,14 +467,6 @@ def get_posts():
             post_dict.pop('image_attachments', None)
             post_dict.pop('video_attachments', None)
             
-            # Set content_type based on attachments
-            if video_urls and len(video_urls) > 0:
-                post_dict['content_type'] = 'video'
-            elif image_urls and len(image_urls) > 0:
-                post_dict['content_type'] = 'image'
-            else:
-                post_dict['content_type'] = 'text'
-            
             # Format date
             if post_dict.get('created_at'):
                 post_dict['created_at'] = post_dict['created_at'].isoformat()
@@ -334,8 +477,26 @@ def get_posts():
             
             posts_list.append(post_dict)
 
-        cursor.close()
-        conn.close()
+        if str(request.args.get('dedupe', '')).lower() == 'true' and posts_list:
+            # How many other posts share each shown post's near-duplicate cluster
+            # (clusters and post ids are per shard)
+            posts_by_shard = {}
+            for shard, post_dict in zip(post_shards, posts_list):
+                posts_by_shard.setdefault(shard, []).append(post_dict)
+            for shard, shard_posts in posts_by_shard.items():
+                conn = get_db_connection(readonly=True, shard=shard)
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                cursor.execute("""
+                    SELECT pm.post_id,
+                           (SELECT COUNT(*) - 1 FROM post_minhash c WHERE c.cluster_id = pm.cluster_id) AS duplicate_count
+                    FROM post_minhash pm
+                    WHERE pm.post_id = ANY(%s)
+                """, ([post_dict['id'] for post_dict in shard_posts],))
+                duplicate_counts = {row['post_id']: row['duplicate_count'] for row in cursor.fetchall()}
+                for post_dict in shard_posts:
+                    post_dict['duplicate_count'] = duplicate_counts.get(post_dict['id'], 0)
+                cursor.close()
+                conn.close()
 
         return jsonify({
             'posts': posts_list,
@@ -352,14 +513,60 @@ def get_posts():
         return jsonify({'error': 'Failed to fetch posts'}), 500
 
 
+@app.route('/api/posts/facets', methods=['GET'])
+@jwt_required()
+@admit('listing')
+def get_post_facets():
+    """Counts per group, content type, day and top authors for the current filters.
+
+    Accepts the /api/posts filters plus top_authors (default 10). All facets come
+    from a single GROUPING SETS scan and are cached per normalized filter set.
+    """
+    try:
+        try:
+            top_authors = max(1, min(int(request.args.get('top_authors', 10)), 100))
+        except ValueError:
+            return jsonify({'error': 'top_authors must be an integer'}), 400
+
+        filters = facets.normalize_filters(request.args, POST_FILTER_KEYS)
+
+        def compute():
+            where_clause, params = build_post_filters(filters)
+            excluding = {
+                facet: build_post_filters({key: value for key, value in filters.items() if key != own})
+                for facet, own in facets.SELF_EXCLUDING.items() if filters.get(own)
+            }
+            query, query_params = facets.facet_query(where_clause, params, top_authors, excluding)
+            # Every shard: the group facet ignores the group_id filter
+            targets = shards.route()
+            results = run_concurrently(
+                [(query, query_params, 'all', 'posts.facets', shard) for shard in targets],
+                cursor_factory=RealDictCursor)
+            if len(targets) == 1:
+                return facets.build_facets(results[0])
+            per_shard = []
+            for shard, rows in zip(targets, results):
+                result = facets.build_facets(rows)
+                # The ids /api/authors returns and author_id filters on
+                for author in result['authors']:
+                    author['id'] = shards.global_id(author['id'], shard)
+                per_shard.append(result)
+            return facets.merge_facets(per_shard, top_authors)
+
+        result, cached = facets.cached_facets(dict(filters, top_authors=top_authors), compute)
+        return jsonify(dict(result, cached=cached)), 200
+
+    except Exception as e:
+        logger.error(f"Get facets error: {e}")
+        return jsonify({'error': 'Failed to compute facets'}), 500
+
+
 @app.route('/api/posts/<post_id>', methods=['GET'])
 @jwt_required()
+@admit('listing')
 def get_post(post_id):
     """Get detailed information about a specific post"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
         query = """
             SELECT 
                 fp.id,
@@ -372,11 +579,15 @@ def get_post(post_id):
                 fp.comment_count as comments,
                 fp.share_count as shares,
                 to_timestamp(fp.created_at) as created_at,
+                fp.content_type,
+                fp.image_count,
+                fp.video_count,
                 COALESCE(
                     json_agg(
                         DISTINCT jsonb_build_object(
                             'url', fa.attachment_url,
-                            'type', fa.attachment_type
+                            'type', fa.attachment_type,
+                            'media_url', '/api/media/' || am.sha256
                         )
                     ) FILTER (WHERE fa.attachment_type = 'image'),
                     '[]'::json
@@ -385,22 +596,25 @@ def get_post(post_id):
                     json_agg(
                         DISTINCT jsonb_build_object(
                             'url', fa.attachment_url,
-                            'type', fa.attachment_type
+                            'type', fa.attachment_type,
+                            'media_url', '/api/media/' || am.sha256
                         )
                     ) FILTER (WHERE fa.attachment_type = 'video'),
                     '[]'::json
                 ) as video_attachments
             FROM facebook_posts fp
             LEFT JOIN facebook_attachments fa ON fp.post_url = fa.post_url
+            LEFT JOIN attachment_media am ON am.attachment_url = fa.attachment_url
             WHERE fp.post_url = %s
 GROUP BY fp.id, fp.post_url, fp.author_name, fp.author_url, fp.post_text,
-                     fp.group_id, fp.reaction_count, fp.comment_count, fp.share_count, fp.created_at
+                     fp.group_id, fp.reaction_count, fp.comment_count, fp.share_count, fp.created_at,
+                     fp.content_type, fp.image_count, fp.video_count
         """
-        cursor.execute(query, (post_id,))
-        post = cursor.fetchone()
-
-        cursor.close()
-        conn.close()
+        # The post's group (and so its shard) isn't known from the URL alone
+        # when group_id is set; ask every shard
+        results = run_concurrently([(query, (post_id,), 'one', 'posts.detail', shard) for shard in shards.route()],
+                                   cursor_factory=RealDictCursor)
+        post = next((row for row in results if row), None)
 
         if post:
             post_dict = dict(post)
@@ -421,7 +635,8 @@ GROUP BY fp.id, fp.post_url, fp.author_name, fp.author_url, fp.post_text,
                     image_attachments = post_dict['image_attachments']
                 
                 if isinstance(image_attachments, list):
-                    image_urls = [att.get('url') for att in image_attachments if att and att.get('url')]
+                    # Prefer the archived copy (stable /api/media URL) over the expiring CDN URL
+                    image_urls = [att.get('media_url') or att.get('url') for att in image_attachments if att and att.get('url')]
             
             # Extract video URLs from video_attachments JSON array
             video_urls = []
@@ -435,7 +650,8 @@ GROUP BY fp.id, fp.post_url, fp.author_name, fp.author_url, fp.post_text,
                     video_attachments = post_dict['video_attachments']
                 
                 if isinstance(video_attachments, list):
-                    video_urls = [att.get('url') for att in video_attachments if att and att.get('url')]
+                    # Prefer the archived copy (stable /api/media URL) over the expiring CDN URL
+                    video_urls = [att.get('media_url') or att.get('url') for att in video_attachments if att and att.get('url')]
             
             # Set image_urls and media_url
             post_dict['image_urls'] = image_urls
@@ -448,14 +664,6 @@ GROUP BY fp.id, fp.post_url, fp.author_name, fp.author_url, fp.post_text,
             post_dict.pop('image_attachments', None)
             post_dict.pop('video_attachments', None)
             
-            # Set content_type based on attachments
-            if video_urls and len(video_urls) > 0:
-                post_dict['content_type'] = 'video'
-            elif image_urls and len(image_urls) > 0:
-                post_dict['content_type'] = 'image'
-            else:
-                post_dict['content_type'] = 'text'
-            
             # shares is already in the data from share_count
             if post_dict.get('shares') is None:
                 post_dict['shares'] = 0
@@ -471,70 +679,88 @@ GROUP BY fp.id, fp.post_url, fp.author_name, fp.author_url, fp.post_text,
         return jsonify({'error': 'Failed to fetch post'}), 500
 
 
+# Debug samples logged by get_groups
+GROUPS_EMPTY_ID_SAMPLE_QUERY = """
+    SELECT post_url, group_id 
+    FROM facebook_posts 
+    WHERE (group_id IS NULL OR group_id = '') 
+    AND post_url LIKE '%/groups/%'
+    LIMIT 10
+"""
+
+GROUPS_TARGET_SAMPLE_QUERY = """
+    SELECT COUNT(*) as count, post_url
+    FROM facebook_posts 
+    WHERE post_url LIKE '%/groups/pardodbiznesupardoduznemumu%'
+       OR post_url LIKE '%/groups/grasis.lt%'
+    GROUP BY post_url
+    LIMIT 5
+"""
+
+# Groups from both the group_id column and the post_url (when group_id is empty),
+# with post counts. Improved regex handles URLs with or without trailing slash and query parameters
+GROUPS_QUERY = """
+    WITH extracted_groups AS (
+        SELECT 
+            COALESCE(
+                NULLIF(fp.group_id, ''),
+                CASE 
+                    WHEN fp.post_url ~ '/groups/([^/?]+)' 
+                    THEN (regexp_match(fp.post_url, '/groups/([^/?]+)'))[1]
+                    ELSE NULL 
+                END
+            ) as group_id
+        FROM facebook_posts fp
+    )
+    SELECT 
+        group_id,
+        COUNT(*) as post_count
+    FROM extracted_groups
+    WHERE group_id IS NOT NULL 
+    AND group_id != ''
+    GROUP BY group_id
+    ORDER BY post_count DESC
+"""
+
+
 @app.route('/api/groups', methods=['GET'])
 @jwt_required()
+@admit('listing')
 def get_groups():
     """Get list of all groups with post counts, including groups extracted from post_url"""
     try:
         import re
         from urllib.parse import urlparse
         
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        targets = shards.route()
+        # Every query of every shard runs on its own pooled connection; the
+        # request thread holds none while they run
+        results = run_concurrently(
+            [(sql, None, 'all', label, shard)
+             for shard in targets
+             for sql, label in ((GROUPS_EMPTY_ID_SAMPLE_QUERY, 'groups_sample'),
+                                (GROUPS_TARGET_SAMPLE_QUERY, 'groups_sample'),
+                                (GROUPS_QUERY, 'groups'))],
+            cursor_factory=RealDictCursor)
 
         # Get groups from both group_id column and extract from post_url when group_id is empty
         # First, let's check for posts with empty group_id to see what URLs we have
-        cursor.execute("""
-            SELECT post_url, group_id 
-            FROM facebook_posts 
-            WHERE (group_id IS NULL OR group_id = '') 
-            AND post_url LIKE '%/groups/%'
-            LIMIT 10
-        """)
-        sample_empty_groups = cursor.fetchall()
+        sample_empty_groups = [row for rows in results[0::3] for row in rows][:10]
         if sample_empty_groups:
             logger.info(f"Sample posts with empty group_id: {[(r['post_url'][:100] if r['post_url'] else 'None', r['group_id']) for r in sample_empty_groups]}")
         
         # Check specifically for the target groups
-        cursor.execute("""
-            SELECT COUNT(*) as count, post_url
-            FROM facebook_posts 
-            WHERE post_url LIKE '%/groups/pardodbiznesupardoduznemumu%'
-               OR post_url LIKE '%/groups/grasis.lt%'
-            GROUP BY post_url
-            LIMIT 5
-        """)
-        target_posts = cursor.fetchall()
+        target_posts = [row for rows in results[1::3] for row in rows][:5]
         if target_posts:
             logger.info(f"Found {len(target_posts)} posts from target groups")
             for tp in target_posts:
                 logger.info(f"  Post URL sample: {tp['post_url'][:100] if tp['post_url'] else 'None'}")
         
-        # Get groups from both group_id column and extract from post_url when group_id is empty
-        # Improved regex to handle URLs with or without trailing slash, and with query parameters
-        cursor.execute("""
-            WITH extracted_groups AS (
-                SELECT 
-                    COALESCE(
-                        NULLIF(fp.group_id, ''),
-                        CASE 
-                            WHEN fp.post_url ~ '/groups/([^/?]+)' 
-                            THEN (regexp_match(fp.post_url, '/groups/([^/?]+)'))[1]
-                            ELSE NULL 
-                        END
-                    ) as group_id
-                FROM facebook_posts fp
-            )
-            SELECT 
-                group_id,
-                COUNT(*) as post_count
-            FROM extracted_groups
-            WHERE group_id IS NOT NULL 
-            AND group_id != ''
-            GROUP BY group_id
-            ORDER BY post_count DESC
-        """)
-        groups = cursor.fetchall()
+        if len(targets) > 1:
+            # Each group lives on one shard; add up counts anyway for posts written to the wrong one
+            groups = shards.merge_counts(list(zip(targets, results[2::3])), 'group_id', 'post_count')
+        else:
+            groups = results[2]
         
         # Log for debugging
         logger.info(f"Found {len(groups)} groups in database")
@@ -550,9 +776,6 @@ def get_groups():
             else:
                 logger.warning(f"Target groups {target_groups} not found in results")
 
-        cursor.close()
-        conn.close()
-
         # Format groups with readable names
         groups_list = []
         for row in groups:
@@ -586,293 +809,600 @@ def get_groups():
 
 @app.route('/api/posts/export', methods=['GET'])
 @jwt_required()
+@admit('export')
 def export_posts():
-    """Export posts in various formats (CSV, JSON, XLS)"""
+    """Export posts in various formats (CSV, JSON, XLS, Parquet, Arrow)"""
     try:
-        import csv
         import io
         from datetime import datetime
 
         format_type = request.args.get('format', 'json').lower()
-        
-        # Get all filters (same as get_posts)
-        author = request.args.get('author', '')
-        keyword = request.args.get('keyword', '')
-        group_id = request.args.get('group_id', '')
-        date_from = request.args.get('date_from', '')
-        date_to = request.args.get('date_to', '')
+        if format_type not in EXPORT_FORMATS:
+            format_type = 'json'
+        mimetype, extension = EXPORT_FORMATS[format_type]
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        headers = {'Content-Disposition': f'attachment; filename=posts_export_{timestamp}.{extension}'}
+
+        where_clause, params = build_post_filters(request.args)
+        query = EXPORT_QUERY.format(where_clause=where_clause)
+        targets = shards.route(request.args.get('group_id', ''))
+
+        # Compact JSON by default; ?pretty=true for human-readable output
+        pretty = request.args.get('pretty', 'false').lower() == 'true'
+
+        if format_type in STREAMED_FORMATS:
+            if format_type in COLUMNAR_FORMATS:
+                try:
+                    import pyarrow  # noqa: F401
+                except ImportError:
+                    return jsonify({'error': 'Parquet/Arrow export requires pyarrow. Install with: pip install pyarrow'}), 500
+            # Connect before streaming starts so connection errors still produce a 500
+            conns = shards.connect(targets)
+            response = app.response_class(_stream_export(conns, format_type, query, params, pretty),
+                                          mimetype=mimetype, headers=headers)
+            # The generator's cleanup never runs if it is never started (HEAD, client gone)
+            response.call_on_close(lambda: [conn.close() for conn in conns])
+            return response
 
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        # XLSX: openpyxl only writes the workbook once it has every row
+        output = io.BytesIO()
 
-        # Build WHERE clause (same logic as get_posts) - use facebook_posts column names
-        where_conditions = []
-        params = []
+        if len(targets) > 1:
+            # Every shard's rows, k-way merged in the export order (created_at DESC)
+            conns = shards.connect(targets)
+            try:
+                rows = shards.iter_merged(conns, query, params, EXPORT_SORT_KEY, reverse=True,
+                                          batch_size=EXPORT_BATCH_SIZE)
+                write_export(format_type, rows, output)
+            except ImportError:
+                return jsonify({'error': 'XLSX export requires openpyxl. Install with: pip install openpyxl'}), 500
+            finally:
+                for conn in conns:
+                    conn.close()
+        else:
+            conn = get_db_connection(readonly=True, shard=targets[0])
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        if author:
-            where_conditions.append("fp.author_name ILIKE %s")
-            params.append(f"%{author}%")
+            # Get all posts (no pagination for export) with attachments
+            statements.execute(cursor, query, params, 'posts.export')
+            posts = cursor.fetchall()
 
-        if keyword:
-            where_conditions.append("fp.post_text ILIKE %s")
-            params.append(f"%{keyword}%")
+            cursor.close()
+            conn.close()
 
-        if group_id:
-            # Handle group filtering: check both group_id column and extract from post_url
-            # Use COALESCE to get group_id from column or extract from URL
-            # Improved regex to handle URLs with or without trailing slash and query parameters
-            where_conditions.append("""
-                (COALESCE(NULLIF(fp.group_id, ''), 
-                    CASE 
-                        WHEN fp.post_url ~ '/groups/([^/?]+)' 
-                        THEN (regexp_match(fp.post_url, '/groups/([^/?]+)'))[1]
-                        ELSE NULL 
-                    END
-                ) = %s)
-            """)
-            params.append(group_id)
+            try:
+                write_export(format_type, posts, output)
+            except ImportError:
+                return jsonify({'error': 'XLSX export requires openpyxl. Install with: pip install openpyxl'}), 500
 
-        if date_from:
-            # Use start of day (00:00:00) for date_from
-            where_conditions.append("to_timestamp(fp.created_at) >= %s::date")
-            params.append(date_from)
+        response = app.response_class(
+            output.getvalue(),
+            mimetype=mimetype,
+            headers=headers
+        )
+        return response
 
-        if date_to:
-            # Use end of day (23:59:59) for date_to to include the entire day
-            where_conditions.append("to_timestamp(fp.created_at) < (%s::date + INTERVAL '1 day')")
-            params.append(date_to)
+    except Exception as e:
+        logger.error(f"Export posts error: {e}")
+        return jsonify({'error': 'Failed to export posts'}), 500
 
-        where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
 
-        # Get all posts (no pagination for export) with attachments
-        query = f"""
-            SELECT 
-                fp.id,
-                fp.post_url,
-                fp.author_name as author_name,
-                fp.author_url as author_url,
-                fp.post_text as text_content,
-                fp.group_id,
-                fp.reaction_count as reactions,
-                fp.comment_count as comments,
-                fp.share_count as shares,
-                to_timestamp(fp.created_at) as created_at,
+# Merge key of EXPORT_QUERY rows across shards (the query orders by created_at DESC)
+EXPORT_SORT_KEY = shards.sort_key('created_at')
+
+
+def _stream_export(conns, format_type, query, params, pretty=False):
+    """Stream a CSV, JSON, Parquet or Arrow export from server-side cursors, one batch at a time.
+
+    conns holds one connection per shard (just one without sharding); their rows are merged in export order.
+    The chunks go through compression.py's streaming compressor when the client accepts gzip or brotli.
+    """
+    try:
+        rows = shards.iter_merged(conns, query, params, EXPORT_SORT_KEY, reverse=True, batch_size=EXPORT_BATCH_SIZE)
+        yield from iter_export(format_type, rows, pretty=pretty)
+    except Exception as e:
+        # Headers are already sent; log and cut the stream short
+        logger.error(f"Streamed export error: {e}")
+        raise
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+export_jobs = ExportJobManager()
+
+
+@app.route('/api/exports', methods=['POST'])
+@jwt_required()
+@admit('export')
+def create_export_job():
+    """Start a background export; identical filter sets reuse a recent result.
+
+    Accepts the same format/filter parameters as /api/posts/export, as a JSON body
+    or query string. Returns 202 while the job is pending, 200 when a finished
+    export was reused.
+    """
+    try:
+        args = request.get_json(silent=True) or request.args
+        format_type = str(args.get('format', 'json')).lower()
+        if format_type not in EXPORT_FORMATS:
+            return jsonify({'error': f"Unsupported format '{format_type}'"}), 400
+        pretty = str(args.get('pretty', 'false')).lower() == 'true'
+
+        filters = {key: args.get(key, '') for key in POST_FILTER_KEYS}
+        where_clause, params = build_post_filters(filters)
+
+        status, reused = export_jobs.submit(format_type, filters, where_clause, params, pretty=pretty,
+                                            targets=shards.route(str(filters['group_id'] or '').strip()))
+        return jsonify(_export_job_response(status)), (200 if status['status'] == 'done' else 202)
+
+    except Exception as e:
+        logger.error(f"Create export job error: {e}")
+        return jsonify({'error': 'Failed to start export'}), 500
+
+
+@app.route('/api/exports/<job_id>', methods=['GET'])
+@jwt_required()
+def get_export_job(job_id):
+    """Get the status and progress of an export job"""
+    status = get_job_status(job_id)
+    if not status:
+        return jsonify({'error': 'Export job not found'}), 404
+    return jsonify(_export_job_response(status)), 200
+
+
+@app.route('/api/exports/<job_id>/download', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def download_export_job(job_id):
+    """Download a finished export; supports Range requests for resuming.
+
+    The JWT may be passed as ?jwt=<token> so plain links and download managers work.
+    """
+    from flask import send_file
+
+    status = get_job_status(job_id)
+    if not status:
+        return jsonify({'error': 'Export job not found'}), 404
+    if status['status'] != 'done':
+        return jsonify({'error': 'Export is not ready', 'status': status['status']}), 409
+
+    path = result_path(job_id, status['format'])
+    if not os.path.exists(path):
+        return jsonify({'error': 'Export has expired'}), 410
+
+    mimetype, extension = EXPORT_FORMATS[status['format']]
+    timestamp = datetime.fromtimestamp(status['finished_at']).strftime('%Y%m%d_%H%M%S')
+    # conditional=True answers Range/If-Range with 206 Partial Content
+    return send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=f"posts_export_{timestamp}.{extension}",
+        conditional=True,
+        max_age=0
+    )
+
+
+def _export_job_response(status):
+    total = status.get('total_rows')
+    written = status.get('rows_written', 0)
+    response = {
+        'id': status['id'],
+        'format': status['format'],
+        'status': status['status'],
+        'rows_written': written,
+        'total_rows': total,
+        'progress': round(written / total, 4) if total else (1.0 if status['status'] == 'done' else 0.0),
+        'status_url': f"/api/exports/{status['id']}",
+    }
+    if status['status'] == 'done':
+        response['download_url'] = f"/api/exports/{status['id']}/download"
+        response['size'] = status.get('size')
+    if status['status'] == 'failed':
+        response['error'] = 'Export failed'
+    return response
+
+
+# Page size limits for /api/posts/changes
+CHANGES_DEFAULT_LIMIT = 1000
+CHANGES_MAX_LIMIT = 10000
+
+
+def _parse_watermark(value):
+    """Parse a '<change_xid>-<id>' watermark; empty or '0' means from the beginning"""
+    if not value or value == '0':
+        return 0, 0
+    xid, _, post_id = value.partition('-')
+    return int(xid), int(post_id or 0)
+
+
+@app.route('/api/posts/changes', methods=['GET'])
+@jwt_required()
+@admit('listing')
+def get_post_changes():
+    """Incremental sync: posts inserted or whose engagement counts changed after a watermark.
+
+    Rows are ordered by (change_xid, id). Only changes from transactions older than
+    the oldest in-flight transaction are returned, so a watermark never skips a
+    change that commits later. Call again with next_watermark until has_more is false.
+    """
+    if shards.SHARDING_ENABLED:
+        # Watermarks are transaction ids of one server
+        return jsonify({'error': 'Incremental sync is not available with sharded posts'}), 501
+    try:
+        try:
+            since_xid, since_id = _parse_watermark(request.args.get('since', ''))
+            limit = int(request.args.get('limit', CHANGES_DEFAULT_LIMIT))
+        except ValueError:
+            return jsonify({'error': 'Invalid since or limit parameter'}), 400
+        limit = max(1, min(limit, CHANGES_MAX_LIMIT))
+
+        conn = get_db_connection(readonly=True)
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+        # Page of changed posts first (index range scan on change_xid, id), then attachments
+        cursor.execute("""
+            WITH changed AS (
+                SELECT fp.*
+                FROM facebook_posts fp
+                WHERE (fp.change_xid, fp.id) > (%s::text::xid8, %s)
+                  AND fp.change_xid < pg_snapshot_xmin(pg_current_snapshot())
+                ORDER BY fp.change_xid, fp.id
+                LIMIT %s
+            )
+            SELECT
+                c.id,
+                c.post_url,
+                c.author_name,
+                c.author_url,
+                c.post_text as text_content,
                 COALESCE(
-                    json_agg(
-                        DISTINCT jsonb_build_object(
-                            'url', fa.attachment_url,
-                            'type', fa.attachment_type
-                        )
-                    ) FILTER (WHERE fa.attachment_type = 'image'),
+                    NULLIF(c.group_id, ''),
+                    (regexp_match(c.post_url, '/groups/([^/?]+)'))[1]
+                ) as group_id,
+                c.reaction_count as reactions,
+                c.comment_count as comments,
+                c.share_count as shares,
+                to_timestamp(c.created_at) as created_at,
+                c.updated_at,
+                c.change_xid::text as change_xid,
+                COALESCE(
+                    json_agg(DISTINCT jsonb_build_object('url', fa.attachment_url))
+                        FILTER (WHERE fa.attachment_type = 'image'),
                     '[]'::json
                 ) as image_attachments,
                 COALESCE(
-                    json_agg(
-                        DISTINCT jsonb_build_object(
-                            'url', fa.attachment_url,
-                            'type', fa.attachment_type
-                        )
-                    ) FILTER (WHERE fa.attachment_type = 'video'),
+                    json_agg(DISTINCT jsonb_build_object('url', fa.attachment_url))
+                        FILTER (WHERE fa.attachment_type = 'video'),
                     '[]'::json
                 ) as video_attachments
-            FROM facebook_posts fp
-            LEFT JOIN facebook_attachments fa ON fp.post_url = fa.post_url
-            WHERE {where_clause}
-GROUP BY fp.id, fp.post_url, fp.author_name, fp.author_url, fp.post_text,
-                     fp.group_id, fp.reaction_count, fp.comment_count, fp.share_count, fp.created_at
-            ORDER BY fp.created_at DESC
-        """
-        cursor.execute(query, params)
-        posts = cursor.fetchall()
+            FROM changed c
+            LEFT JOIN facebook_attachments fa ON c.post_url = fa.post_url
+            GROUP BY c.id, c.post_url, c.author_name, c.author_url, c.post_text, c.group_id,
+                     c.reaction_count, c.comment_count, c.share_count, c.created_at,
+                     c.updated_at, c.change_xid
+            ORDER BY c.change_xid, c.id
+        """, (str(since_xid), since_id, limit))
+        rows = cursor.fetchall()
 
         cursor.close()
         conn.close()
 
-        # Format posts for export
-        posts_list = []
-        for post in posts:
-            post_dict = dict(post)
-            
-            # Extract image URLs from image_attachments JSON array
-            image_urls = []
-            if post_dict.get('image_attachments'):
-                if isinstance(post_dict['image_attachments'], str):
-                    try:
-                        image_attachments = json.loads(post_dict['image_attachments'])
-                    except:
-                        image_attachments = []
-                else:
-                    image_attachments = post_dict['image_attachments']
-                
-                if isinstance(image_attachments, list):
-                    image_urls = [att.get('url') for att in image_attachments if att and att.get('url')]
-            
-            # Extract video URLs from video_attachments JSON array
-            video_urls = []
-            if post_dict.get('video_attachments'):
-                if isinstance(post_dict['video_attachments'], str):
-                    try:
-                        video_attachments = json.loads(post_dict['video_attachments'])
-                    except:
-                        video_attachments = []
-                else:
-                    video_attachments = post_dict['video_attachments']
-                
-                if isinstance(video_attachments, list):
-                    video_urls = [att.get('url') for att in video_attachments if att and att.get('url')]
-            
-            post_dict['image_urls'] = image_urls
-            post_dict['video_urls'] = video_urls
-            
-            # Remove attachment fields
-            post_dict.pop('image_attachments', None)
-            post_dict.pop('video_attachments', None)
-            
+        changes = []
+        for row in rows:
+            post_dict = dict(row)
+            post_dict['image_urls'] = attachment_urls(post_dict.pop('image_attachments'))
+            post_dict['video_urls'] = attachment_urls(post_dict.pop('video_attachments'))
+            post_dict.pop('change_xid')
             if post_dict.get('created_at'):
                 post_dict['created_at'] = post_dict['created_at'].isoformat()
-            posts_list.append(post_dict)
+            if post_dict.get('updated_at'):
+                post_dict['updated_at'] = post_dict['updated_at'].isoformat()
+            changes.append(post_dict)
 
-        # Generate export based on format
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        if format_type == 'csv':
-            output = io.StringIO()
-            if posts_list:
-                writer = csv.DictWriter(output, fieldnames=[
-                    'id', 'post_url', 'author_name', 'author_url', 'text_content', 
-                    'reactions', 'comments', 'created_at', 'group_id', 'content_type',
-                    'image_urls', 'video_urls'
-                ])
-                writer.writeheader()
-                for post in posts_list:
-                    row = post.copy()
-                    # Convert arrays to strings for CSV
-                    row['image_urls'] = ', '.join(row.get('image_urls', []))
-                    row['video_urls'] = ', '.join(row.get('video_urls', []))
-                    writer.writerow(row)
-            
-            response = app.response_class(
-                output.getvalue(),
-                mimetype='text/csv',
-                headers={'Content-Disposition': f'attachment; filename=posts_export_{timestamp}.csv'}
-            )
-            return response
-
-        elif format_type == 'xls' or format_type == 'xlsx':
-            try:
-                import openpyxl
-                from openpyxl import Workbook
-                
-                wb = Workbook()
-                ws = wb.active
-                ws.title = "Posts"
-                
-                # Headers
-                headers = ['Post URL', 'Author Name', 'Author URL', 'Text Content', 
-                          'Reactions', 'Comments', 'Created At', 'Group ID', 'Content Type',
-                          'Image URLs', 'Video URLs']
-                ws.append(headers)
-                
-                # Data rows
-                for post in posts_list:
-                    row = [
-                        post.get('post_url', ''),
-                        post.get('author_name', ''),
-                        post.get('author_url', ''),
-                        post.get('text_content', ''),
-                        post.get('reactions', 0),
-                        post.get('comments', 0),
-                        post.get('created_at', ''),
-                        post.get('group_id', ''),
-                        post.get('content_type', 'text'),
-                        ', '.join(post.get('image_urls', [])),
-                        ', '.join(post.get('video_urls', []))
-                    ]
-                    ws.append(row)
-                
-                # Save to BytesIO
-                output = io.BytesIO()
-                wb.save(output)
-                output.seek(0)
-                
-                response = app.response_class(
-                    output.read(),
-                    mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    headers={'Content-Disposition': f'attachment; filename=posts_export_{timestamp}.xlsx'}
-                )
-                return response
-            except ImportError:
-                return jsonify({'error': 'XLSX export requires openpyxl. Install with: pip install openpyxl'}), 500
+        if rows:
+            next_watermark = f"{rows[-1]['change_xid']}-{rows[-1]['id']}"
+        else:
+            next_watermark = f"{since_xid}-{since_id}" if since_xid else '0'
 
-        else:  # Default to JSON
-            response = app.response_class(
-                json.dumps(posts_list, indent=2),
-                mimetype='application/json',
-                headers={'Content-Disposition': f'attachment; filename=posts_export_{timestamp}.json'}
-            )
-            return response
+        return jsonify({
+            'changes': changes,
+            'next_watermark': next_watermark,
+            'has_more': len(rows) == limit
+        }), 200
 
     except Exception as e:
-        logger.error(f"Export posts error: {e}")
-        return jsonify({'error': 'Failed to export posts'}), 500
+        logger.error(f"Get post changes error: {e}")
+        return jsonify({'error': 'Failed to fetch post changes'}), 500
 
 
-@app.route('/api/stats', methods=['GET'])
+LEADERBOARD_PERIODS = {'24h': 86400, '7d': 7 * 86400, '30d': 30 * 86400, 'all': None}
+LEADERBOARD_METRICS = ('reactions', 'comments', 'engagement')
+# Entries kept per board (fb_leaderboard_size() in init_db.sql)
+LEADERBOARD_SIZE = 100
+
+
+@app.route('/api/leaderboards', methods=['GET'])
 @jwt_required()
-def get_stats():
-    """Get dashboard statistics"""
+@admit('listing')
+def get_leaderboards():
+    """Top posts overall, for one group or for every group, read from the maintained boards.
+
+    Query params: period (24h|7d|30d|all, default 24h), metric (reactions|comments|engagement,
+    default engagement), limit (default 10, max 100), group_id, by_group=true.
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        period = request.args.get('period', '24h')
+        metric = request.args.get('metric', 'engagement')
+        if period not in LEADERBOARD_PERIODS or metric not in LEADERBOARD_METRICS:
+            return jsonify({'error': f"period must be one of {', '.join(LEADERBOARD_PERIODS)} "
+                                     f"and metric one of {', '.join(LEADERBOARD_METRICS)}"}), 400
+        try:
+            limit = max(1, min(int(request.args.get('limit', 10)), LEADERBOARD_SIZE))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        group_id = request.args.get('group_id', '')
+        by_group = str(request.args.get('by_group', '')).lower() == 'true'
 
-        # Get total posts
-        cursor.execute("SELECT COUNT(*) as total FROM facebook_posts")
-        total_posts = cursor.fetchone()['total']
+        # Entries older than the period are dropped by leaderboard_job.py; skip them until then
+        seconds = LEADERBOARD_PERIODS[period]
+        since = int(time.time()) - seconds if seconds else 0
+        scope_clause = "pl.scope <> ''" if by_group and not group_id else "pl.scope = %s"
+        params = [period, metric, since] + ([] if by_group and not group_id else [group_id])
 
-        # Get total reactions, comments, and shares
-        cursor.execute("""
-            SELECT 
-                SUM(reaction_count) as total_reactions,
-                SUM(comment_count) as total_comments,
-                SUM(share_count) as total_shares
-            FROM facebook_posts
-        """)
-        engagement = cursor.fetchone()
+        query = f"""
+            SELECT
+                pl.scope,
+                pl.rank,
+                pl.score,
+                fp.id,
+                fp.post_url,
+                fp.author_id,
+                fp.author_name,
+                fp.post_text,
+                fp.reaction_count as reactions,
+                fp.comment_count as comments,
+                fp.share_count as shares,
+                to_timestamp(fp.created_at) as created_at,
+                fp.content_type,
+                COALESCE('/api/media/' || am.sha256, fp.first_image_url) as media_url
+            FROM (
+                SELECT pl.*, ROW_NUMBER() OVER (PARTITION BY pl.scope ORDER BY pl.score DESC, pl.post_id) as rank
+                FROM post_leaderboard pl
+                WHERE pl.period = %s AND pl.metric = %s AND pl.created_at >= %s AND {scope_clause}
+            ) pl
+            JOIN facebook_posts fp ON fp.id = pl.post_id AND fp.created_at = pl.created_at
+            LEFT JOIN attachment_media am ON am.attachment_url = fp.first_image_url
+            WHERE pl.rank <= %s
+            ORDER BY pl.scope, pl.rank
+        """
+        # Every shard keeps its own boards; the overall top posts are among the shards' top posts
+        targets = shards.route(group_id)
+        results = run_concurrently([(query, params + [limit], 'all', 'leaderboards', shard) for shard in targets],
+                                   cursor_factory=RealDictCursor)
+
+        boards = {}
+        for row in (row for rows in results for row in rows):
+            post = dict(row)
+            scope = post.pop('scope')
+            post['post_id'] = post.pop('post_url')
+            post['author'] = post.pop('author_name')
+            post['content'] = post.pop('post_text')
+            if post.get('created_at'):
+                post['created_at'] = post['created_at'].isoformat()
+            boards.setdefault(scope, []).append(post)
+        if len(targets) > 1:
+            for scope, posts in boards.items():
+                posts.sort(key=lambda post: -post['score'])
+                del posts[limit:]
+                for rank, post in enumerate(posts, 1):
+                    post['rank'] = rank
+
+        result = {'period': period, 'metric': metric}
+        if by_group and not group_id:
+            result['groups'] = [{'group_id': scope, 'posts': posts} for scope, posts in sorted(boards.items())]
+        else:
+            if group_id:
+                result['group_id'] = group_id
+            result['posts'] = boards.get(group_id, [])
+        return jsonify(result), 200
 
-        # Get unique authors count
-        cursor.execute("""
-            SELECT COUNT(DISTINCT author_name) as total_authors 
-            FROM facebook_posts 
-            WHERE author_name IS NOT NULL
-        """)
-        total_authors = cursor.fetchone()['total_authors']
+    except Exception as e:
+        logger.error(f"Get leaderboards error: {e}")
+        return jsonify({'error': 'Failed to fetch leaderboards'}), 500
 
-        # Get posts by date (last 7 days) - convert BIGINT timestamp to date
-        cursor.execute("""
-            SELECT DATE(to_timestamp(created_at)) as date, COUNT(*) as count
-            FROM facebook_posts
-            WHERE to_timestamp(created_at) >= NOW() - INTERVAL '7 days'
-            GROUP BY DATE(to_timestamp(created_at))
-            ORDER BY date ASC
-        """)
-        posts_by_date = cursor.fetchall()
 
+@app.route('/api/posts/<int:post_id>/engagement', methods=['GET'])
+@jwt_required()
+@admit('listing')
+def get_post_engagement(post_id):
+    """Engagement curve of a post (by numeric id) from its recorded history.
+
+    Query params: days (how far back, default 30, max 365).
+    """
+    if shards.SHARDING_ENABLED:
+        # Post ids are only unique within a shard
+        return jsonify({'error': 'Engagement history by post id is not available with sharded posts'}), 501
+    try:
+        try:
+            days = max(1, min(int(request.args.get('days', 30)), 365))
+        except ValueError:
+            return jsonify({'error': 'days must be an integer'}), 400
+        since = int(time.time()) - days * 86400
+
+        conn = get_db_connection(readonly=True)
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            SELECT fp.reaction_count as reactions, fp.comment_count as comments, fp.share_count as shares,
+                   v.velocity, v.sampled_at
+            FROM facebook_posts fp
+            LEFT JOIN post_engagement_velocity v ON v.post_id = fp.id
+            WHERE fp.id = %s
+        """, (post_id,))
+        current = cursor.fetchone()
+        rows = []
+        if current:
+            # Whole buckets that overlap the range; the curve trims samples before since
+            cursor.execute("""
+                SELECT bucket, offsets, d_reactions, d_comments, d_shares
+                FROM post_engagement_history
+                WHERE post_id = %s AND bucket >= %s
+                ORDER BY bucket
+            """, (post_id, since - since % 86400))
+            rows = cursor.fetchall()
         cursor.close()
         conn.close()
 
-        # Format posts_by_date with ISO date strings
+        if not current:
+            return jsonify({'error': 'Post not found'}), 404
+
+        return jsonify({
+            'id': post_id,
+            'points': engagement.engagement_curve(current, rows, since=since),
+            'velocity': round(current['velocity'], 3) if current['velocity'] is not None else None,
+            'sampled_at': (datetime.utcfromtimestamp(current['sampled_at']).isoformat() + 'Z'
+                           if current['sampled_at'] else None),
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Get post engagement error: {e}")
+        return jsonify({'error': 'Failed to fetch engagement history'}), 500
+
+
+@app.route('/api/posts/fastest-growing', methods=['GET'])
+@jwt_required()
+@admit('listing')
+def get_fastest_growing():
+    """Posts gaining engagement fastest, from the precomputed velocities.
+
+    Query params: hours (only posts whose counts changed in the last N hours, default 6),
+    limit (default 20, max 100), group_id.
+    """
+    try:
+        try:
+            hours = max(1, min(int(request.args.get('hours', 6)), 24 * 30))
+            limit = max(1, min(int(request.args.get('limit', 20)), 100))
+        except ValueError:
+            return jsonify({'error': 'hours and limit must be integers'}), 400
+        group_id = request.args.get('group_id', '')
+
+        where = "v.sampled_at >= %s"
+        params = [int(time.time()) - hours * 3600]
+        if group_id:
+            where += " AND COALESCE(NULLIF(fp.group_id, ''), (regexp_match(fp.post_url, '/groups/([^/?]+)'))[1]) = %s"
+            params.append(group_id)
+
+        query = f"""
+            SELECT
+                v.velocity,
+                v.sampled_at,
+                fp.id,
+                fp.post_url,
+                fp.author_id,
+                fp.author_name,
+                fp.post_text,
+                COALESCE(NULLIF(fp.group_id, ''), (regexp_match(fp.post_url, '/groups/([^/?]+)'))[1]) as group_id,
+                fp.reaction_count as reactions,
+                fp.comment_count as comments,
+                fp.share_count as shares,
+                to_timestamp(fp.created_at) as created_at,
+                fp.content_type,
+                COALESCE('/api/media/' || am.sha256, fp.first_image_url) as media_url
+            FROM post_engagement_velocity v
+            JOIN facebook_posts fp ON fp.id = v.post_id
+            LEFT JOIN attachment_media am ON am.attachment_url = fp.first_image_url
+            WHERE {where}
+            ORDER BY v.velocity DESC, v.post_id
+            LIMIT %s
+        """
+        targets = shards.route(group_id)
+        results = run_concurrently(
+            [(query, params + [limit], 'all', 'posts.fastest_growing', shard) for shard in targets],
+            cursor_factory=RealDictCursor)
+        if len(targets) == 1:
+            rows = results[0]
+        else:
+            rows = shards.merge_page(list(zip(targets, results)), shards.sort_key('velocity'), True, 0, limit)
+
+        posts = []
+        for row in rows:
+            post = dict(row)
+            post.pop('_shard', None)
+            post['post_id'] = post.pop('post_url')
+            post['author'] = post.pop('author_name')
+            post['content'] = post.pop('post_text')
+            post['velocity'] = round(post['velocity'], 3)
+            post['sampled_at'] = datetime.utcfromtimestamp(post['sampled_at']).isoformat() + 'Z'
+            if post.get('created_at'):
+                post['created_at'] = post['created_at'].isoformat()
+            posts.append(post)
+        return jsonify({'hours': hours, 'posts': posts}), 200
+
+    except Exception as e:
+        logger.error(f"Get fastest growing error: {e}")
+        return jsonify({'error': 'Failed to fetch fastest-growing posts'}), 500
+
+
+@app.route('/api/stats', methods=['GET'])
+@jwt_required()
+@admit('stats')
+def get_stats():
+    """Get dashboard statistics"""
+    try:
+        # The four queries are independent; run them concurrently (on every shard when sharded)
+        targets = shards.route()
+        queries = [
+            # Total posts
+            ("SELECT COUNT(*) as total FROM facebook_posts", None, 'one'),
+            # Total reactions, comments, and shares
+            ("""
+                SELECT 
+                    SUM(reaction_count) as total_reactions,
+                    SUM(comment_count) as total_comments,
+                    SUM(share_count) as total_shares
+                FROM facebook_posts
+            """, None, 'one'),
+            # Posts by date (last 7 days) - convert BIGINT timestamp to date
+            ("""
+                SELECT DATE(to_timestamp(created_at)) as date, COUNT(*) as count
+                FROM facebook_posts
+                WHERE created_at >= %s
+                GROUP BY DATE(to_timestamp(created_at))
+                ORDER BY date ASC
+            """, (int(time.time()) - 7 * 86400,), 'all'),
+        ]
+        if not shards.SHARDING_ENABLED:
+            # Unique authors, maintained incrementally in the authors table
+            queries.append(("SELECT COUNT(*) as total_authors FROM authors WHERE post_count > 0", None, 'one'))
+        results = run_concurrently([query + (None, shard) for shard in targets for query in queries],
+                                   cursor_factory=RealDictCursor)
+        per_shard = [results[i:i + len(queries)] for i in range(0, len(results), len(queries))]
+
+        total_posts = sum(rows[0]['total'] for rows in per_shard)
+        engagement = {
+            field: sum(rows[1][field] or 0 for rows in per_shard)
+            for field in ('total_reactions', 'total_comments', 'total_shares')
+        }
+        if shards.SHARDING_ENABLED:
+            # Every shard has its own authors table; the index counts each name once
+            total_authors = author_index.count()
+        else:
+            total_authors = per_shard[0][3]['total_authors']
+
+        # Format posts_by_date with ISO date strings (adding up the shards' counts per date)
+        posts_per_date = {}
+        for _, _, posts_by_date, *_ in per_shard:
+            for row in posts_by_date:
+                posts_per_date[row['date']] = posts_per_date.get(row['date'], 0) + row['count']
         posts_by_date_formatted = []
-        for row in posts_by_date:
-            row_dict = dict(row)
-            if row_dict['date']:
-                row_dict['date'] = row_dict['date'].isoformat()
-            posts_by_date_formatted.append(row_dict)
+        for date, count in sorted(posts_per_date.items()):
+            posts_by_date_formatted.append({'date': date.isoformat(), 'count': count})
 
         return jsonify({
             'total_posts': total_posts,
-            'total_reactions': engagement['total_reactions'] or 0,
-            'total_comments': engagement['total_comments'] or 0,
-            'total_shares': engagement['total_shares'] or 0,
+            'total_reactions': engagement['total_reactions'],
+            'total_comments': engagement['total_comments'],
+            'total_shares': engagement['total_shares'],
             'total_authors': total_authors,
             'posts_by_date': posts_by_date_formatted
         }), 200
@@ -882,6 +1412,135 @@ def get_stats():
         return jsonify({'error': 'Failed to fetch statistics'}), 500
 
 
+author_index = AuthorIndex(get_db_connection, targets=shards.route())
+
+
+@app.route('/api/authors', methods=['GET'])
+@jwt_required()
+@admit('listing')
+def get_authors():
+    """Author typeahead: authors with a name word starting with `prefix`, most active first"""
+    try:
+        prefix = request.args.get('prefix', '')
+        try:
+            limit = max(1, min(int(request.args.get('limit', 10)), 100))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+
+        authors = []
+        for author in author_index.search(prefix, limit):
+            authors.append({
+                'id': author['id'],
+                'name': author['author_name'],
+                'url': author['author_url'],
+                'post_count': author['post_count'],
+                'total_engagement': author['total_engagement'],
+                'last_seen': (datetime.utcfromtimestamp(author['last_seen']).isoformat() + 'Z'
+                              if author['last_seen'] else None),
+            })
+        return jsonify({'authors': authors}), 200
+
+    except Exception as e:
+        logger.error(f"Get authors error: {e}")
+        return jsonify({'error': 'Failed to fetch authors'}), 500
+
+
+# One LISTEN connection per process; NOTIFY is only delivered on the primary
+# New posts are inserted (and notified) on the shards when posts are sharded
+post_events = PostEventBroker(lambda shard: get_db_connection(pooled=False, shard=shard), targets=shards.route())
+EVENTS_HEARTBEAT_SECONDS = 15
+
+
+@app.route('/api/events', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def post_events_stream():
+    """Server-Sent Events stream of new-post and stats-delta notifications.
+
+    EventSource cannot set headers, so the JWT may also be passed as ?jwt=<token>.
+    """
+    from flask import Response, stream_with_context
+
+    subscriber = post_events.subscribe()
+
+    def generate():
+        try:
+            # Tell the client how long to wait before reconnecting
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=EVENTS_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event, data)
+        finally:
+            post_events.unsubscribe(subscriber)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # disable nginx response buffering
+        }
+    )
+
+
+@app.route('/api/analytics/trends', methods=['GET'])
+@jwt_required()
+@admit('stats')
+def get_trends():
+    """Per-group and per-author engagement time series with rolling averages and growth.
+
+    Query params: days (window, default 90), bucket (day|week), top (series per
+    dimension, default 10), rolling (window in buckets, default 7), group_id.
+    """
+    try:
+        try:
+            import analytics
+        except ImportError:
+            return jsonify({'error': 'Trend analytics requires numpy. Install with: pip install numpy'}), 500
+
+        try:
+            days = max(1, min(int(request.args.get('days', 90)), 730))
+            top = max(1, min(int(request.args.get('top', 10)), 100))
+            rolling_window = max(1, min(int(request.args.get('rolling', 7)), 90))
+        except ValueError:
+            return jsonify({'error': 'days, top and rolling must be integers'}), 400
+        bucket = request.args.get('bucket', 'day')
+        if bucket not in analytics.BUCKET_SECONDS:
+            bucket = 'day'
+        group_id = request.args.get('group_id', '')
+
+        params = {'days': days, 'top': top, 'rolling': rolling_window, 'bucket': bucket, 'group_id': group_id}
+
+        def compute():
+            now = time.time()
+            bucket_seconds = analytics.BUCKET_SECONDS[bucket]
+            # Align the window start to a bucket boundary
+            since = (int(now) // bucket_seconds - max(1, (days * 86400) // bucket_seconds) + 1) * bucket_seconds
+
+            parts = []
+            for shard in shards.route(group_id):
+                conn = get_db_connection(readonly=True, shard=shard)
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                parts.append(analytics.fetch_trend_columns(cursor, since, group_id or None))
+                cursor.close()
+                conn.close()
+            columns = analytics.concat_trend_columns(parts)
+
+            result = analytics.compute_trends(columns, now, days, bucket, top, rolling_window)
+            result['generated_at'] = datetime.utcfromtimestamp(now).isoformat() + 'Z'
+            return result
+
+        result, cached = analytics.cached_trends(params, compute)
+        return jsonify(dict(result, cached=cached)), 200
+
+    except Exception as e:
+        logger.error(f"Get trends error: {e}")
+        return jsonify({'error': 'Failed to compute trends'}), 500
+
+
 @app.route('/api/profile', methods=['GET'])
 @jwt_required()
 def get_profile():
@@ -1001,10 +1660,34 @@ def _is_allowed_image_url(url):
         return False
 
 
+image_cache = ImageCache()
+
+
+def _image_cluster_key(image_url):
+    """Cache key of an image url's perceptual cluster, or None (not hashed yet or lookup failed)"""
+    try:
+        targets = shards.route()
+        rows = run_concurrently([
+            (CLUSTER_LOOKUP_SQL, (image_url,), 'one', 'image_cluster', shard) for shard in targets
+        ])
+        for shard, row in zip(targets, rows):
+            if row:
+                return cluster_cache_key(row[0], shard)
+        return None
+    except Exception as e:
+        logger.warning(f"Image proxy: cluster lookup failed: {e}")
+        return None
+
+
 @app.route('/api/image-proxy', methods=['GET'])
+@admit('proxy')
 def image_proxy():
-    """Proxy image requests to avoid CORS/referrer blocking from Facebook CDN."""
-    import urllib.request
+    """Proxy image requests to avoid CORS/referrer blocking from Facebook CDN.
+
+    Responses are cached on disk: per perceptual cluster once phash_worker.py
+    has hashed the image (one copy for every URL of the same picture), per URL
+    before that.
+    """
     import urllib.error
     from flask import Response
 
@@ -1014,19 +1697,21 @@ def image_proxy():
     if not _is_allowed_image_url(image_url):
         return jsonify({'error': 'URL not allowed'}), 403
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
-        'Referer': 'https://www.facebook.com/',
-        'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.9',
-    }
-    req = urllib.request.Request(image_url, headers=headers)
+    url_key = url_cache_key(image_url)
+    cached = image_cache.get(url_key)
+    cluster_key = None
+    if cached is None:
+        cluster_key = _image_cluster_key(image_url)
+        if cluster_key is not None:
+            cached = image_cache.get(cluster_key)
+    if cached is not None:
+        data, content_type = cached
+        response = Response(data, mimetype=content_type)
+        response.headers['X-Cache'] = 'HIT'
+        return response
 
     try:
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = resp.read()
-            content_type = resp.headers.get('Content-Type', 'image/jpeg')
-        return Response(data, mimetype=content_type.split(';')[0].strip())
+        data, content_type = fetch_image(image_url)
     except urllib.error.HTTPError as e:
         if e.code == 403:
             try:
@@ -1044,6 +1729,287 @@ def image_proxy():
         logger.warning(f"Image proxy error: {e}")
         return jsonify({'error': 'Failed to load image'}), 502
 
+    try:
+        image_cache.put(cluster_key or url_key, data, content_type)
+    except OSError as e:
+        logger.warning(f"Image proxy: failed to cache image: {e}")
+    response = Response(data, mimetype=content_type)
+    response.headers['X-Cache'] = 'MISS'
+    return response
+
+
+video_cache = SegmentCache() if VIDEO_CACHE_ENABLED else None
+
+
+@app.route('/api/video-proxy', methods=['GET'])
+@admit('proxy')
+def video_proxy():
+    """Stream CDN videos with Range passthrough so the player can seek.
+
+    Bodies are relayed chunk by chunk (never buffered). With VIDEO_CACHE_ENABLED,
+    segments seen in earlier responses are served from disk when they cover the
+    requested range.
+    """
+    import urllib.error
+    from flask import Response, stream_with_context
+
+    video_url = request.args.get('url')
+    if not video_url:
+        return jsonify({'error': 'Missing url parameter'}), 400
+    if not _is_allowed_image_url(video_url):
+        return jsonify({'error': 'URL not allowed'}), 403
+    range_header = request.headers.get('Range')
+
+    if video_cache is not None:
+        meta = video_cache.get_meta(video_url)
+        if meta and meta.get('size'):
+            size = meta['size']
+            requested = parse_range(range_header, size) if range_header else (0, size - 1)
+            chunks = video_cache.read_range(video_url, *requested) if requested else None
+            if chunks is not None:
+                start, end = requested
+                headers = {'Accept-Ranges': 'bytes', 'Content-Length': str(end - start + 1), 'X-Cache': 'HIT'}
+                if range_header:
+                    headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+                return Response(chunks, status=206 if range_header else 200,
+                                mimetype=meta.get('content_type') or 'video/mp4', headers=headers,
+                                direct_passthrough=True)
+
+    try:
+        upstream = open_upstream(video_url, range_header)
+    except urllib.error.HTTPError as e:
+        if e.code == 416:
+            return Response(status=416, headers={'Content-Range': e.headers.get('Content-Range', 'bytes */*')})
+        logger.warning(f"Video proxy: HTTP {e.code} from CDN")
+        return jsonify({'error': 'Video unavailable'}), 404
+    except Exception as e:
+        logger.warning(f"Video proxy error: {e}")
+        return jsonify({'error': 'Failed to load video'}), 502
+
+    headers = {name: upstream.headers[name] for name in PASSTHROUGH_HEADERS if upstream.headers.get(name)}
+    headers.setdefault('Accept-Ranges', 'bytes')
+    content_type = headers.pop('Content-Type', 'video/mp4').split(';')[0].strip()
+    chunks = iter_upstream(upstream)
+
+    if video_cache is not None:
+        start, total = upstream_extent(upstream)
+        if total:
+            try:
+                video_cache.put_meta(video_url, total, content_type)
+                chunks = video_cache.tee(video_url, start, total, chunks)
+            except OSError as e:
+                logger.warning(f"Video proxy: segment cache unavailable: {e}")
+
+    return Response(stream_with_context(chunks), status=upstream.status, mimetype=content_type,
+                    headers=headers, direct_passthrough=True)
+
+
+@app.route('/api/images/matches', methods=['GET'])
+@jwt_required()
+@admit('listing')
+def get_image_matches():
+    """Posts containing a visually identical image (perceptual hash within max_distance bits).
+
+    Query params: url (an image attachment url) or post_id (post url; matches
+    any of its images), max_distance (default and maximum 3), limit.
+    """
+    try:
+        try:
+            from phash import DISTANCE_SQL, PHASH_MAX_DISTANCE
+        except ImportError:
+            return jsonify({'error': 'Image matching requires numpy. Install with: pip install numpy'}), 500
+
+        image_url = request.args.get('url')
+        post_id = request.args.get('post_id')
+        if not image_url and not post_id:
+            return jsonify({'error': 'Missing url or post_id parameter'}), 400
+        try:
+            max_distance = max(0, min(int(request.args.get('max_distance', PHASH_MAX_DISTANCE)), PHASH_MAX_DISTANCE))
+            limit = max(1, min(int(request.args.get('limit', 50)), 500))
+        except ValueError:
+            return jsonify({'error': 'max_distance and limit must be integers'}), 400
+
+        # Source hashes first: with post shards the matches can be on any shard
+        if image_url:
+            source_sql = "attachment_url = %s"
+        else:
+            source_sql = ("attachment_url IN (SELECT attachment_url FROM facebook_attachments "
+                          "WHERE post_url = %s AND attachment_type = 'image')")
+        targets = shards.route()
+        results = run_concurrently([
+            (f"""SELECT attachment_url, phash, band0, band1, band2, band3 FROM attachment_phash
+                 WHERE status = 'ok' AND {source_sql}""",
+             (image_url or post_id,), 'all', 'image_match_sources', shard)
+            for shard in targets
+        ], cursor_factory=RealDictCursor)
+        sources = {row['attachment_url']: row for rows in results for row in rows}
+        if not sources:
+            return jsonify({'matches': [], 'max_distance': max_distance}), 200
+        columns = ('attachment_url', 'phash', 'band0', 'band1', 'band2', 'band3')
+        source_params = [[row[column] for row in sources.values()] for column in columns]
+
+        distance_sql = DISTANCE_SQL.format(a='m.phash', b='src.phash')
+        query = f"""
+            WITH src AS (
+                SELECT *
+                FROM unnest(%s::text[], %s::bigint[], %s::smallint[], %s::smallint[], %s::smallint[], %s::smallint[])
+                     AS src(attachment_url, phash, band0, band1, band2, band3)
+            )
+            SELECT * FROM (
+                SELECT DISTINCT ON (fp.id)
+                    fp.post_url AS post_id,
+                    fp.author_name AS author,
+                    fp.group_id,
+                    to_timestamp(fp.created_at) AS created_at,
+                    m.attachment_url AS image_url,
+                    src.attachment_url AS source_image_url,
+                    m.cluster_id,
+                    {distance_sql} AS distance
+                FROM src
+                JOIN attachment_phash m
+                  ON m.status = 'ok'
+                 AND (m.band0 = src.band0 OR m.band1 = src.band1 OR m.band2 = src.band2 OR m.band3 = src.band3)
+                JOIN facebook_attachments fa ON fa.attachment_url = m.attachment_url
+                JOIN facebook_posts fp ON fp.post_url = fa.post_url
+                WHERE {distance_sql} <= %s
+                  AND fp.post_url IS DISTINCT FROM %s
+                ORDER BY fp.id, distance
+            ) matches
+            ORDER BY distance, created_at DESC
+            LIMIT %s
+        """
+        params = (*source_params, max_distance, post_id, limit)
+        results = run_concurrently([(query, params, 'all', 'image_matches', shard) for shard in targets],
+                                   cursor_factory=RealDictCursor)
+
+        # Same order as the query: distance, then newest first (NULLs first, as with DESC)
+        def match_order(row):
+            created_at = row['created_at']
+            return (row['distance'], created_at is not None, -created_at.timestamp() if created_at else 0)
+
+        matches = []
+        for row in shards.merge_page(list(zip(targets, results)), match_order, False, 0, limit):
+            match = dict(row)
+            match.pop('_shard', None)
+            if match.get('created_at'):
+                match['created_at'] = match['created_at'].isoformat()
+            matches.append(match)
+
+        return jsonify({'matches': matches, 'max_distance': max_distance}), 200
+
+    except Exception as e:
+        logger.error(f"Get image matches error: {e}")
+        return jsonify({'error': 'Failed to find matching images'}), 500
+
+
+media_store = get_media_store()
+# Archived objects never change under their digest
+MEDIA_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+@app.route('/api/media/<digest>', methods=['GET'])
+@admit('proxy')
+def get_media(digest):
+    """Serve an archived attachment by SHA-256 (see media_archiver.py).
+
+    Like the image proxy this is unauthenticated so <img>/<video> tags can load
+    it; digests are only discoverable through the authenticated post endpoints.
+    """
+    from flask import Response, send_file
+
+    if not DIGEST_RE.match(digest):
+        return jsonify({'error': 'Invalid media id'}), 400
+    try:
+        # With post shards the archiver records each blob on the shard of its post
+        rows = run_concurrently([
+            ("SELECT content_type, size_bytes FROM media_objects WHERE sha256 = %s", (digest,), 'one', 'media', shard)
+            for shard in shards.route()
+        ])
+        row = next((row for row in rows if row), None)
+        if not row:
+            return jsonify({'error': 'Media not found'}), 404
+        content_type, size = row
+
+        path = media_store.local_path(digest)
+        if path is not None:
+            # send_file handles Range (video seeking) and If-None-Match
+            response = send_file(path, mimetype=content_type, conditional=True, etag=digest, max_age=31536000)
+        else:
+            if request.if_none_match.contains(digest):
+                return Response(status=304, headers={'ETag': f'"{digest}"', 'Cache-Control': MEDIA_CACHE_CONTROL})
+            chunks, size = media_store.open(digest)
+            response = Response(chunks, mimetype=content_type)
+            response.headers['Content-Length'] = str(size)
+            response.set_etag(digest)
+        response.headers['Cache-Control'] = MEDIA_CACHE_CONTROL
+        return response
+
+    except FileNotFoundError:
+        return jsonify({'error': 'Media not found'}), 404
+    except Exception as e:
+        logger.error(f"Get media error: {e}")
+        return jsonify({'error': 'Failed to load media'}), 500
+
+
+@app.route('/api/profiles', methods=['GET'])
+@jwt_required()
+def list_request_profiles():
+    """Stored request profiles, newest first (admins only)"""
+    try:
+        if not _is_admin(get_jwt_identity()):
+            return jsonify({'error': 'Admin privileges required'}), 403
+        try:
+            limit = max(1, min(int(request.args.get('limit', 50)), profiling.PROFILE_KEEP))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        return jsonify({'profiles': profiling.list_profiles(limit)}), 200
+
+    except Exception as e:
+        logger.error(f"List profiles error: {e}")
+        return jsonify({'error': 'Failed to list profiles'}), 500
+
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+@jwt_required()
+def get_request_profile(profile_id):
+    """Summary of a stored request profile: top functions and allocation sites (admins only)"""
+    try:
+        if not _is_admin(get_jwt_identity()):
+            return jsonify({'error': 'Admin privileges required'}), 403
+        summary = profiling.get_profile(profile_id)
+        if not summary:
+            return jsonify({'error': 'Profile not found'}), 404
+        return jsonify(summary), 200
+
+    except Exception as e:
+        logger.error(f"Get request profile error: {e}")
+        return jsonify({'error': 'Failed to fetch profile'}), 500
+
+
+@app.route('/api/profiles/<profile_id>/download', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def download_request_profile(profile_id):
+    """Raw cProfile dump of a stored profile, for pstats or snakeviz (admins only).
+
+    The JWT may be passed as ?jwt=<token> so plain links work.
+    """
+    from flask import send_file
+
+    if not _is_admin(get_jwt_identity()):
+        return jsonify({'error': 'Admin privileges required'}), 403
+    if not profiling.get_profile(profile_id):
+        return jsonify({'error': 'Profile not found'}), 404
+    path = profiling.dump_path(profile_id)
+    if not os.path.exists(path):
+        return jsonify({'error': 'Profile has expired'}), 410
+    return send_file(
+        path,
+        mimetype='application/octet-stream',
+        as_attachment=True,
+        download_name=f"profile_{profile_id}.prof",
+        max_age=0
+    )
+
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -1051,7 +2017,13 @@ def health_check():
     try:
         conn = get_db_connection()
         conn.close()
-        return jsonify({'status': 'healthy', 'database': 'connected'}), 200
+        return jsonify({
+            'status': 'healthy',
+            'database': 'connected',
+            'admission': admission.stats(),
+            'statements': statements.stats(),
+            'profiling': profiling.stats,
+        }), 200
     except Exception as e:
         return jsonify({'status': 'unhealthy', 'database': 'disconnected', 'error': str(e)}), 500
 
@@ -0,0 +1,119 @@
+"""
+In-memory prefix index over the authors table for /api/authors typeahead.
+
+Each process keeps a sorted list of (lowercased name token suffix, author) keys
+so a prefix lookup is a bisect plus a scan of the matching range; every word
+of a name is indexed, so "smi" finds "John Smith". The snapshot is rebuilt from
+the database at most every AUTHORS_INDEX_TTL seconds, by one request thread
+while the others keep serving the previous snapshot.
+"""
+
+import bisect
+import heapq
+import logging
+import os
+import threading
+import time
+
+from shards import global_id
+
+logger = logging.getLogger(__name__)
+
+AUTHORS_INDEX_TTL = int(os.getenv('AUTHORS_INDEX_TTL', '60'))
+
+AUTHORS_QUERY = """
+    SELECT id, author_name, author_url, post_count, total_engagement, last_seen
+    FROM authors
+    WHERE post_count > 0
+"""
+
+
+class _Snapshot:
+    def __init__(self, rows):
+        self.authors = [dict(row) for row in rows]
+        entries = []
+        for i, author in enumerate(self.authors):
+            name = author['author_name'].lower()
+            starts = {0} | {pos + 1 for pos, ch in enumerate(name) if ch.isspace()}
+            for start in starts:
+                if start < len(name):
+                    entries.append((name[start:], i))
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.refs = [i for _, i in entries]
+
+
+class AuthorIndex:
+    """Prefix search over author names, ranked by post count"""
+
+    def __init__(self, connect, ttl=AUTHORS_INDEX_TTL, targets=(None,)):
+        self._connect = connect
+        self._targets = list(targets)
+        self._ttl = ttl
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # With post shards every shard has its own authors table; names are unique
+        # per table, so the same author's rows are added up (keeping the first
+        # shard's id, made unique across shards by global_id)
+        by_name = {}
+        for shard in self._targets:
+            conn = self._connect(readonly=True, shard=shard)
+            try:
+                cursor = conn.cursor()
+                cursor.execute(AUTHORS_QUERY)
+                columns = [desc[0] for desc in cursor.description]
+                for row in cursor.fetchall():
+                    author = dict(zip(columns, row))
+                    author['id'] = global_id(author['id'], shard)
+                    seen = by_name.get(author['author_name'])
+                    if seen is None:
+                        by_name[author['author_name']] = author
+                        continue
+                    seen['post_count'] += author['post_count']
+                    seen['total_engagement'] += author['total_engagement']
+                    seen['last_seen'] = max(seen['last_seen'] or 0, author['last_seen'] or 0) or None
+                cursor.close()
+            finally:
+                conn.close()
+        return _Snapshot(by_name.values())
+
+    def _current(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.time() - self._loaded_at < self._ttl:
+            return snapshot
+        # Only one thread refreshes; the rest keep using the stale snapshot if there is one
+        if not self._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            if self._snapshot is None or time.time() - self._loaded_at >= self._ttl:
+                self._snapshot = self._load()
+                self._loaded_at = time.time()
+            return self._snapshot
+        finally:
+            self._lock.release()
+
+    def search(self, prefix, limit=10):
+        """Authors with a name word starting with prefix, most active first"""
+        snapshot = self._current()
+        prefix = prefix.strip().lower()
+        if not prefix:
+            candidates = range(len(snapshot.authors))
+        else:
+            lo = bisect.bisect_left(snapshot.keys, prefix)
+            hi = bisect.bisect_left(snapshot.keys, prefix + '\uffff', lo)
+            candidates = set(snapshot.refs[lo:hi])
+        best = heapq.nsmallest(
+            limit, candidates,
+            key=lambda i: (-snapshot.authors[i]['post_count'], snapshot.authors[i]['author_name'])
+        )
+        return [snapshot.authors[i] for i in best]
+
+    def count(self):
+        """Number of authors with posts"""
+        return len(self._current().authors)
+
+    def invalidate(self):
+        self._loaded_at = 0.0
@@ -0,0 +1,73 @@
+"""
+Benchmark the concurrent read path of /api/posts and /api/stats.
+
+Calls both endpoints in-process against the configured database, first with
+their queries run one after another (DB_PARALLEL_WORKERS=1) and then
+concurrently, and prints latency percentiles for each mode. Admission control
+is disabled for the run.
+
+Usage:
+    python bench_read_path.py                          # 30 iterations per endpoint and mode
+    python bench_read_path.py --iterations 100 --query "search=sale&per_page=50"
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+import admission
+import db
+from app import app
+from flask_jwt_extended import create_access_token
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def measure(client, path, headers, iterations, workers):
+    """Latencies in milliseconds of `iterations` requests with the given worker count"""
+    db.DB_PARALLEL_WORKERS = workers
+    client.get(path, headers=headers).close()   # warm up connections and plans
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        response = client.get(path, headers=headers)
+        elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        response.close()
+        samples.append(elapsed)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare serial and concurrent queries of /api/posts and /api/stats")
+    parser.add_argument('--iterations', type=int, default=30, help="requests per endpoint and mode")
+    parser.add_argument('--query', default='', help="extra query string for /api/posts, e.g. 'search=sale'")
+    args = parser.parse_args()
+
+    admission.ADMISSION_ENABLED = False
+    parallel_workers = max(2, db.DB_PARALLEL_WORKERS)
+    with app.app_context():
+        headers = {'Authorization': f"Bearer {create_access_token(identity='bench@localhost')}"}
+    client = app.test_client()
+
+    paths = ['/api/posts' + (f"?{args.query}" if args.query else ''), '/api/stats']
+    print(f"{'endpoint':<40} {'mode':<10} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+    for path in paths:
+        results = {}
+        for mode, workers in (('serial', 1), ('concurrent', parallel_workers)):
+            samples = measure(client, path, headers, args.iterations, workers)
+            results[mode] = statistics.median(samples)
+            print(f"{path[:40]:<40} {mode:<10} {statistics.median(samples):>8.1f} "
+                  f"{_percentile(samples, 95):>8.1f} {statistics.mean(samples):>8.1f}")
+        if results['concurrent']:
+            print(f"{'':<40} speedup    {results['serial'] / results['concurrent']:>8.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
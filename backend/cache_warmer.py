@@ -0,0 +1,216 @@
+"""
+Background service that fetches new attachment images into the proxy cache.
+
+Facebook CDN URLs carry expiring signatures, so images are fetched as soon as
+they are scraped rather than on the first dashboard view. New image
+attachments are queued in attachment_warm_queue by a trigger (see init_db.sql);
+the warmer drains the queue when notified on fb_attachments_warm and on a
+polling interval as a fallback. Fetches run on a bounded thread pool with a
+per-host token bucket; transient failures are retried with exponential
+backoff, expired or removed images are dropped.
+
+Usage:
+    python cache_warmer.py                     # run until interrupted
+    python cache_warmer.py --backfill-days 3   # also queue images of the last 3 days of posts
+    python cache_warmer.py --shard 0           # with post shards, one process per shard
+"""
+
+import argparse
+import logging
+import os
+import select
+import sys
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import psycopg2
+import psycopg2.extensions
+
+from db import get_db_connection
+from shards import add_shard_argument
+from image_cache import ImageCache, fetch_image, url_cache_key
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WARM_CHANNEL = 'fb_attachments_warm'
+WARM_WORKERS = int(os.getenv('WARM_WORKERS', '8'))
+WARM_BATCH_SIZE = int(os.getenv('WARM_BATCH_SIZE', '100'))
+# Requests per second (and burst size) allowed against a single CDN host
+WARM_HOST_RATE = float(os.getenv('WARM_HOST_RATE', '5'))
+WARM_HOST_BURST = int(os.getenv('WARM_HOST_BURST', '10'))
+WARM_MAX_ATTEMPTS = int(os.getenv('WARM_MAX_ATTEMPTS', '5'))
+# First retry delay in seconds; doubles on every attempt
+WARM_RETRY_BASE = int(os.getenv('WARM_RETRY_BASE', '30'))
+WARM_POLL_INTERVAL = int(os.getenv('WARM_POLL_INTERVAL', '30'))
+
+CLAIM_QUERY = """
+    SELECT id, attachment_url, attempts
+    FROM attachment_warm_queue
+    WHERE next_attempt_at <= NOW()
+    ORDER BY next_attempt_at, id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+
+class HostRateLimiter:
+    """Token bucket per host, shared by the fetch threads"""
+
+    def __init__(self, rate=WARM_HOST_RATE, burst=WARM_HOST_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host):
+        """Block until a request to host is allowed"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, updated = self._buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                if tokens >= 1:
+                    self._buckets[host] = (tokens - 1, now)
+                    return
+                self._buckets[host] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+
+def warm_url(url, cache, limiter):
+    """Fetch one image into the cache; returns 'cached', 'ok', 'gone' or 'retry'"""
+    key = url_cache_key(url)
+    if cache.contains(key):
+        return 'cached'
+    limiter.acquire(urlparse(url).netloc.lower())
+    try:
+        data, content_type = fetch_image(url)
+    except urllib.error.HTTPError as e:
+        # Throttling and server errors are transient; 403/404 mean the image is gone
+        return 'retry' if e.code == 429 or e.code >= 500 else 'gone'
+    except Exception as e:
+        logger.debug(f"Fetch failed for {url[:120]}: {e}")
+        return 'retry'
+    try:
+        cache.put(key, data, content_type)
+    except OSError as e:
+        # Full or unwritable cache directory; keep the entry for a later attempt
+        logger.warning(f"Failed to cache {url[:120]}: {e}")
+        return 'retry'
+    return 'ok'
+
+
+def process_batch(conn, pool, cache, limiter, batch_size=WARM_BATCH_SIZE):
+    """Warm one batch of due queue entries; returns how many were claimed"""
+    cursor = conn.cursor()
+    cursor.execute(CLAIM_QUERY, (batch_size,))
+    rows = cursor.fetchall()
+    if not rows:
+        conn.commit()
+        cursor.close()
+        return 0
+
+    results = pool.map(lambda row: warm_url(row[1], cache, limiter), rows)
+    finished, retry, counts = [], [], {}
+    for (entry_id, url, attempts), result in zip(rows, results):
+        counts[result] = counts.get(result, 0) + 1
+        if result == 'retry' and attempts + 1 < WARM_MAX_ATTEMPTS:
+            retry.append((entry_id, WARM_RETRY_BASE * 2 ** attempts))
+        else:
+            finished.append(entry_id)
+
+    if finished:
+        cursor.execute("DELETE FROM attachment_warm_queue WHERE id = ANY(%s)", (finished,))
+    for entry_id, delay in retry:
+        cursor.execute("""
+            UPDATE attachment_warm_queue
+            SET attempts = attempts + 1, next_attempt_at = NOW() + make_interval(secs => %s)
+            WHERE id = %s
+        """, (delay, entry_id))
+    conn.commit()
+    cursor.close()
+
+    logger.info("Warmed batch: " + ", ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+    return len(rows)
+
+
+def backfill(conn, days):
+    """Queue the image attachments of posts created in the last `days` days"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO attachment_warm_queue (attachment_url)
+        SELECT DISTINCT fa.attachment_url
+        FROM facebook_attachments fa
+        JOIN facebook_posts fp ON fp.post_url = fa.post_url
+        WHERE fa.attachment_type = 'image'
+          AND fa.attachment_url IS NOT NULL
+          AND fp.created_at >= %s
+        ON CONFLICT (attachment_url) DO NOTHING
+    """, (int(time.time()) - days * 86400,))
+    queued = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    logger.info(f"Queued {queued} images for backfill")
+
+
+def _listen_connection(shard=None):
+    conn = get_db_connection(pooled=False, shard=shard)
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cursor = conn.cursor()
+    cursor.execute(f"LISTEN {WARM_CHANNEL}")
+    cursor.close()
+    return conn
+
+
+def run(pool, cache, limiter, interval, shard=None):
+    """Drain the queue, then sleep until notified or the poll interval passes"""
+    listen_conn = _listen_connection(shard)
+    conn = get_db_connection(shard=shard)
+    try:
+        while True:
+            while process_batch(conn, pool, cache, limiter):
+                pass
+            if select.select([listen_conn], [], [], interval) != ([], [], []):
+                listen_conn.poll()
+                listen_conn.notifies.clear()
+    finally:
+        conn.close()
+        listen_conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch new attachment images into the image proxy cache")
+    parser.add_argument('--interval', type=int, default=WARM_POLL_INTERVAL,
+                        help="seconds between polls when no notification arrives")
+    parser.add_argument('--backfill-days', type=int, help="queue images of posts from the last N days first")
+    add_shard_argument(parser)
+    args = parser.parse_args()
+
+    if args.backfill_days:
+        conn = get_db_connection(shard=args.shard)
+        try:
+            backfill(conn, args.backfill_days)
+        finally:
+            conn.close()
+
+    cache = ImageCache()
+    limiter = HostRateLimiter()
+    backoff = 1
+    with ThreadPoolExecutor(max_workers=WARM_WORKERS) as pool:
+        while True:
+            try:
+                run(pool, cache, limiter, args.interval, args.shard)
+            except KeyboardInterrupt:
+                return 0
+            except psycopg2.Error as e:
+                logger.warning(f"Database connection lost ({e}); reconnecting in {backoff}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Response compression (gzip / brotli) negotiated from Accept-Encoding.
+
+Buffered responses are compressed in one shot once they exceed
+COMPRESSION_MIN_SIZE; streamed (generator) responses are compressed chunk by
+chunk so exports never have to be held in memory.
+"""
+
+import gzip
+import logging
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+# Buffered responses smaller than this (bytes) are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+# Brotli quality 0-11; 4-5 is a good speed/ratio trade-off for dynamic content
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+
+COMPRESSIBLE_MIMETYPES = (
+    'application/json',
+    'text/csv',
+    'text/plain',
+    'text/html',
+    'application/javascript',
+)
+
+
+def _choose_encoding(accept_encodings):
+    """Pick 'br' or 'gzip' from the request's Accept-Encoding, or None"""
+    br_q = accept_encodings.quality('br') if brotli is not None else 0
+    gzip_q = accept_encodings.quality('gzip')
+    if br_q and br_q >= gzip_q:
+        return 'br'
+    if gzip_q:
+        return 'gzip'
+    return None
+
+
+def _should_compress(response):
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return False
+    if 'Content-Encoding' in response.headers or 'Content-Range' in response.headers:
+        return False
+    # Byte ranges refer to the identity encoding
+    if response.headers.get('Accept-Ranges', 'none') != 'none':
+        return False
+    if 'no-transform' in response.headers.get('Cache-Control', ''):
+        return False
+    return True
+
+
+def _compress_stream(chunks, encoding):
+    """Yield the compressed form of an iterable of str/bytes chunks"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        # wbits=31 -> gzip container
+        compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            out = compress(chunk)
+            if out:
+                yield out
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response, accept_encodings):
+    """Compress a Flask response in place when the client accepts it"""
+    if not COMPRESSION_ENABLED or not _should_compress(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    encoding = _choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESSION_MIN_SIZE:
+            return response
+        if encoding == 'br':
+            data = brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            data = gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL)
+        response.set_data(data)
+
+    response.headers['Content-Encoding'] = encoding
+    # A strong ETag would no longer describe the bytes on the wire
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    """Register response compression on a Flask app"""
+
+    @app.after_request
+    def _compress(response):
+        from flask import request
+        try:
+            return compress_response(response, request.accept_encodings)
+        except Exception as e:
+            logger.warning(f"Response compression skipped: {e}")
+            return response
@@ -0,0 +1,125 @@
+"""
+Batch job that indexes post text for near-duplicate detection.
+
+Computes a MinHash signature for every post not yet in post_minhash, looks up
+candidates through the LSH band index and assigns the post to the cluster of
+its most similar candidate (or starts a new cluster).
+
+Usage:
+    python dedupe_worker.py            # index all pending posts, then exit
+    python dedupe_worker.py --watch    # keep polling for new posts
+    python dedupe_worker.py --shard 0  # with post shards, one process per shard
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from psycopg2.extras import execute_values
+
+from db import get_db_connection
+from shards import add_shard_argument
+from minhash import LSH_BANDS, band_hashes, signature, similarity
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Estimated Jaccard similarity at which two posts count as near-duplicates
+DEDUPE_THRESHOLD = float(os.getenv('DEDUPE_THRESHOLD', '0.8'))
+DEDUPE_BATCH_SIZE = int(os.getenv('DEDUPE_BATCH_SIZE', '500'))
+# Upper bound on candidates compared per post (large clusters share every band)
+DEDUPE_MAX_CANDIDATES = int(os.getenv('DEDUPE_MAX_CANDIDATES', '100'))
+
+
+def index_post(cursor, post_id, text):
+    """Store the signature and LSH bands of one post; returns its cluster id"""
+    sig = signature(text)
+    if sig is None:
+        # Too little text to compare: the post is its own cluster
+        cursor.execute(
+            "INSERT INTO post_minhash (post_id, signature, cluster_id) VALUES (%s, NULL, %s) "
+            "ON CONFLICT (post_id) DO NOTHING",
+            (post_id, post_id)
+        )
+        return post_id
+
+    bands = band_hashes(sig)
+    cursor.execute("""
+        SELECT DISTINCT pm.post_id, pm.signature, pm.cluster_id
+        FROM unnest(%s::smallint[], %s::bigint[]) AS q(band, band_hash)
+        JOIN post_lsh_bands b ON b.band = q.band AND b.band_hash = q.band_hash
+        JOIN post_minhash pm ON pm.post_id = b.post_id
+        WHERE pm.post_id <> %s
+        LIMIT %s
+    """, (list(range(LSH_BANDS)), bands, post_id, DEDUPE_MAX_CANDIDATES))
+
+    cluster_id, best = post_id, DEDUPE_THRESHOLD
+    for candidate_id, candidate_sig, candidate_cluster in cursor.fetchall():
+        score = similarity(sig, candidate_sig)
+        if score >= best:
+            cluster_id, best = candidate_cluster, score
+
+    cursor.execute(
+        "INSERT INTO post_minhash (post_id, signature, cluster_id) VALUES (%s, %s, %s) "
+        "ON CONFLICT (post_id) DO NOTHING",
+        (post_id, sig.tolist(), cluster_id)
+    )
+    execute_values(
+        cursor,
+        "INSERT INTO post_lsh_bands (band, band_hash, post_id) VALUES %s ON CONFLICT DO NOTHING",
+        [(band, band_hash, post_id) for band, band_hash in enumerate(bands)]
+    )
+    return cluster_id
+
+
+def process_pending(conn, batch_size=DEDUPE_BATCH_SIZE):
+    """Index one batch of posts without a signature; returns how many were processed"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT fp.id, fp.post_text
+        FROM facebook_posts fp
+        LEFT JOIN post_minhash pm ON pm.post_id = fp.id
+        WHERE pm.post_id IS NULL
+        ORDER BY fp.id
+        LIMIT %s
+    """, (batch_size,))
+    rows = cursor.fetchall()
+
+    duplicates = 0
+    for post_id, text in rows:
+        if index_post(cursor, post_id, text) != post_id:
+            duplicates += 1
+    conn.commit()
+    cursor.close()
+
+    if rows:
+        logger.info(f"Indexed {len(rows)} posts ({duplicates} near-duplicates)")
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index posts for near-duplicate detection")
+    parser.add_argument('--watch', action='store_true', help="keep polling for new posts")
+    parser.add_argument('--interval', type=int, default=30, help="seconds between polls with --watch")
+    add_shard_argument(parser)
+    args = parser.parse_args()
+
+    conn = get_db_connection(shard=args.shard)
+    try:
+        while True:
+            while process_pending(conn):
+                pass
+            if not args.watch:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
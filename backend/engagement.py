@@ -0,0 +1,49 @@
+"""
+Engagement curves from the delta-encoded post_engagement_history rows.
+
+Each history row covers one UTC day of a post: offsets are seconds since the
+day starts and d_reactions / d_comments / d_shares the change of each counter
+at that sample (see init_db.sql). Absolute values are rebuilt backwards from
+the post's current counts, so history that starts after the post was first
+scraped still yields correct values.
+"""
+
+from datetime import datetime
+
+COUNTERS = ('reactions', 'comments', 'shares')
+
+
+def decode_samples(rows):
+    """Flatten history rows into [(epoch, d_reactions, d_comments, d_shares)] in time order"""
+    samples = []
+    for row in rows:
+        samples.extend(zip(
+            (row['bucket'] + offset for offset in row['offsets']),
+            row['d_reactions'], row['d_comments'], row['d_shares'],
+        ))
+    samples.sort(key=lambda sample: sample[0])
+    return samples
+
+
+def engagement_curve(current, rows, since=None):
+    """Points {t, reactions, comments, shares, engagement} after each sample.
+
+    current maps reactions/comments/shares to the post's counts now; rows are
+    its history rows (any subset of buckets ending with the latest); samples
+    before the epoch `since` are left out.
+    """
+    values = [int(current.get(name) or 0) for name in COUNTERS]
+    points = []
+    for epoch, *deltas in reversed(decode_samples(rows)):
+        if since is not None and epoch < since:
+            break
+        points.append({
+            't': datetime.utcfromtimestamp(epoch).isoformat() + 'Z',
+            'reactions': values[0],
+            'comments': values[1],
+            'shares': values[2],
+            'engagement': sum(values),
+        })
+        values = [value - delta for value, delta in zip(values, deltas)]
+    points.reverse()
+    return points
@@ -0,0 +1,124 @@
+"""
+Fan-out of Postgres NOTIFY events to Server-Sent Events subscribers.
+
+Each process holds one LISTEN connection per database the posts live on (the
+primary, or every post shard; started lazily on the first subscriber) and
+copies every notification into the queues of all connected /api/events
+clients.
+"""
+
+import json
+import logging
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+# Channel the facebook_posts triggers in init_db.sql notify on
+EVENTS_CHANNEL = 'fb_posts_events'
+
+
+class PostEventBroker:
+    """LISTEN connections of one process, fanned out to subscriber queues.
+
+    connect(target) opens a dedicated connection to each of targets (see
+    shards.route()); their notifications are merged into one stream.
+    """
+
+    def __init__(self, connect, channel=EVENTS_CHANNEL, queue_size=100, targets=(None,)):
+        self._connect = connect
+        self._targets = list(targets)
+        self._channel = channel
+        self._queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        """Register a new subscriber and return its queue"""
+        q = queue.Queue(maxsize=self._queue_size)
+        with self._lock:
+            self._subscribers.add(q)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._listen_forever, name='post-events', daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event, data):
+        """Deliver an event to every subscriber.
+
+        A subscriber whose queue is full is too slow to keep up; its pending
+        events are replaced by a single 'resync' so the client re-fetches once.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait(('resync', {}))
+
+    def _listen_forever(self):
+        backoff = 1
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            conns = []
+            try:
+                for target in self._targets:
+                    conn = self._connect(target)
+                    conns.append(conn)
+                    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                    cursor = conn.cursor()
+                    cursor.execute(f"LISTEN {self._channel}")
+                    cursor.close()
+                logger.info(f"Listening for post events on '{self._channel}' ({len(conns)} connections)")
+                backoff = 1
+                self._poll(conns)
+            except Exception as e:
+                logger.warning(f"Post event listener error, reconnecting in {backoff}s: {e}")
+                # Events may have been missed while disconnected
+                self.publish('resync', {})
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                for conn in conns:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _poll(self, conns):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    return
+            ready, _, _ = select.select(conns, [], [], 5)
+            for conn in ready:
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        payload = json.loads(notify.payload)
+                    except ValueError:
+                        logger.warning(f"Ignoring malformed post event payload: {notify.payload[:200]}")
+                        continue
+                    self.publish(payload.pop('type', 'posts'), payload)
+
+
+def format_sse(event, data):
+    """Encode a single Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
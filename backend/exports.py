@@ -0,0 +1,482 @@
+"""
+Post export writers (CSV, JSON, XLSX, Parquet, Arrow IPC) and background export jobs.
+
+Export jobs run in a process pool: each worker streams rows from a server-side
+cursor and writes the file to EXPORT_JOB_DIR in batches, recording progress in
+a small JSON status file next to it. Status lives on disk so every gunicorn
+worker process can report on (and reuse) jobs started by any other.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+EXPORT_JOB_DIR = os.getenv('EXPORT_JOB_DIR', os.path.join(tempfile.gettempdir(), 'fb_exports'))
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', '2'))
+# Finished exports with identical filters are reused for this many seconds
+EXPORT_JOB_TTL = int(os.getenv('EXPORT_JOB_TTL', '900'))
+# Rows fetched from the server-side cursor (and written) per batch
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '2000'))
+# A running job whose status has not been updated for this long is considered dead
+EXPORT_JOB_STALE_SECONDS = int(os.getenv('EXPORT_JOB_STALE_SECONDS', '300'))
+
+# format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'csv': ('text/csv', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'xls': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+}
+
+# Formats written as Arrow record batches (pyarrow)
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+# Formats produced chunk by chunk (an XLSX workbook is only complete once saved)
+STREAMED_FORMATS = ('csv', 'json') + COLUMNAR_FORMATS
+
+CSV_FIELDS = [
+    'id', 'post_url', 'author_name', 'author_url', 'text_content',
+    'reactions', 'comments', 'created_at', 'group_id', 'content_type',
+    'image_urls', 'video_urls'
+]
+
+XLSX_HEADERS = [
+    'Post URL', 'Author Name', 'Author URL', 'Text Content',
+    'Reactions', 'Comments', 'Created At', 'Group ID', 'Content Type',
+    'Image URLs', 'Video URLs'
+]
+
+# All matching posts (no pagination) with attachments aggregated
+EXPORT_QUERY = """
+    SELECT
+        fp.id,
+        fp.post_url,
+        fp.author_name as author_name,
+        fp.author_url as author_url,
+        fp.post_text as text_content,
+        fp.group_id,
+        fp.reaction_count as reactions,
+        fp.comment_count as comments,
+        fp.share_count as shares,
+        to_timestamp(fp.created_at) as created_at,
+        fp.content_type,
+        COALESCE(
+            json_agg(
+                DISTINCT jsonb_build_object(
+                    'url', fa.attachment_url,
+                    'type', fa.attachment_type
+                )
+            ) FILTER (WHERE fa.attachment_type = 'image'),
+            '[]'::json
+        ) as image_attachments,
+        COALESCE(
+            json_agg(
+                DISTINCT jsonb_build_object(
+                    'url', fa.attachment_url,
+                    'type', fa.attachment_type
+                )
+            ) FILTER (WHERE fa.attachment_type = 'video'),
+            '[]'::json
+        ) as video_attachments
+    FROM facebook_posts fp
+    LEFT JOIN facebook_attachments fa ON fp.post_url = fa.post_url
+    WHERE {where_clause}
+    GROUP BY fp.id, fp.post_url, fp.author_name, fp.author_url, fp.post_text,
+             fp.group_id, fp.reaction_count, fp.comment_count, fp.share_count, fp.created_at,
+             fp.content_type
+    ORDER BY fp.created_at DESC
+"""
+
+
+def attachment_urls(attachments):
+    """Return the urls from a json_agg'ed attachment list (may arrive as a JSON string)"""
+    if isinstance(attachments, str):
+        try:
+            attachments = json.loads(attachments)
+        except ValueError:
+            return []
+    if not isinstance(attachments, list):
+        return []
+    return [att.get('url') for att in attachments if att and att.get('url')]
+
+
+def format_export_row(post, iso_dates=True):
+    """Turn an EXPORT_QUERY row into the exported post dict"""
+    post_dict = dict(post)
+    image_urls = attachment_urls(post_dict.pop('image_attachments', None))
+    video_urls = attachment_urls(post_dict.pop('video_attachments', None))
+    post_dict['image_urls'] = image_urls
+    post_dict['video_urls'] = video_urls
+    if iso_dates and post_dict.get('created_at'):
+        post_dict['created_at'] = post_dict['created_at'].isoformat()
+    return post_dict
+
+
+def iter_csv(rows, batch_size=None):
+    """Yield EXPORT_QUERY rows as CSV byte chunks of batch_size rows"""
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    buffer = io.StringIO(newline='')
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for i, post in enumerate(rows, 1):
+        row = format_export_row(post)
+        # Convert arrays to strings for CSV
+        row['image_urls'] = ', '.join(row.get('image_urls', []))
+        row['video_urls'] = ', '.join(row.get('video_urls', []))
+        writer.writerow(row)
+        if i % batch_size == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def iter_json(rows, pretty=False, batch_size=None):
+    """Yield EXPORT_QUERY rows as a JSON array in byte chunks of batch_size posts"""
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    separator = ',\n  ' if pretty else ','
+    parts = ['[\n  ' if pretty else '[']
+    for i, row in enumerate(rows):
+        post = format_export_row(row)
+        if i:
+            parts.append(separator)
+        if pretty:
+            parts.append(json.dumps(post, indent=2).replace('\n', '\n  '))
+        else:
+            parts.append(json.dumps(post, separators=(',', ':')))
+        if (i + 1) % batch_size == 0:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+    parts.append('\n]' if pretty else ']')
+    yield ''.join(parts).encode('utf-8')
+
+
+def write_xlsx(rows, fileobj):
+    """Write EXPORT_QUERY rows as an XLSX workbook to a binary file object.
+
+    Uses openpyxl's write-only mode so rows are streamed to disk instead of
+    being kept as cell objects in memory.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Posts")
+    ws.append(XLSX_HEADERS)
+    for row in rows:
+        post = format_export_row(row)
+        ws.append([
+            post.get('post_url', ''),
+            post.get('author_name', ''),
+            post.get('author_url', ''),
+            post.get('text_content', ''),
+            post.get('reactions', 0),
+            post.get('comments', 0),
+            post.get('created_at', ''),
+            post.get('group_id', ''),
+            post.get('content_type', 'text'),
+            ', '.join(post.get('image_urls', [])),
+            ', '.join(post.get('video_urls', []))
+        ])
+    wb.save(fileobj)
+
+
+def _arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('id', pa.int64()),
+        ('post_url', pa.string()),
+        ('author_name', pa.string()),
+        ('author_url', pa.string()),
+        ('text_content', pa.string()),
+        ('group_id', pa.string()),
+        ('reactions', pa.int64()),
+        ('comments', pa.int64()),
+        ('shares', pa.int64()),
+        ('created_at', pa.timestamp('us', tz='UTC')),
+        ('content_type', pa.string()),
+        ('image_urls', pa.list_(pa.string())),
+        ('video_urls', pa.list_(pa.string())),
+    ])
+
+
+class _ChunkSink:
+    """Write-only file object that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_columnar_export(format_type, rows, batch_size=None):
+    """Yield a Parquet or Arrow IPC file as byte chunks, one record batch at a time.
+
+    Rows are consumed batch_size at a time (e.g. straight from a server-side
+    cursor), so memory use is bounded by one batch regardless of export size.
+    image_urls/video_urls become list<string> columns and created_at a UTC timestamp.
+    """
+    import pyarrow as pa
+
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    if format_type == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+        write_batch = writer.write_batch
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+        write_batch = writer.write_batch
+
+    columns = {name: [] for name in schema.names}
+
+    def flush_batch():
+        batch = pa.record_batch([pa.array(columns[name], type=schema.field(name).type)
+                                 for name in schema.names], schema=schema)
+        write_batch(batch)
+        for values in columns.values():
+            values.clear()
+
+    pending = 0
+    for row in rows:
+        post = format_export_row(row, iso_dates=False)
+        for name in schema.names:
+            columns[name].append(post.get(name))
+        pending += 1
+        if pending == batch_size:
+            flush_batch()
+            pending = 0
+            yield sink.drain()
+    if pending:
+        flush_batch()
+    writer.close()
+    yield sink.drain()
+
+
+def iter_export(format_type, rows, pretty=False):
+    """Yield EXPORT_QUERY rows in one of STREAMED_FORMATS (JSON for anything else) as byte chunks"""
+    if format_type == 'csv':
+        return iter_csv(rows)
+    if format_type in COLUMNAR_FORMATS:
+        return iter_columnar_export(format_type, rows)
+    return iter_json(rows, pretty=pretty)
+
+
+def write_export(format_type, rows, fileobj, pretty=False):
+    """Write EXPORT_QUERY rows in the given export format to a binary file object"""
+    if format_type in ('xls', 'xlsx'):
+        write_xlsx(rows, fileobj)
+        return
+    for chunk in iter_export(format_type, rows, pretty=pretty):
+        fileobj.write(chunk)
+
+
+# ---------------------------------------------------------------------------
+# Background export jobs
+# ---------------------------------------------------------------------------
+
+_JOB_ID_RE = re.compile(r'^[0-9a-f]{24}$')
+
+
+def _status_path(job_id):
+    return os.path.join(EXPORT_JOB_DIR, f"{job_id}.json")
+
+
+def result_path(job_id, format_type):
+    return os.path.join(EXPORT_JOB_DIR, f"{job_id}.{EXPORT_FORMATS[format_type][1]}")
+
+
+def _write_status(job_id, status):
+    """Atomically replace a job's status file"""
+    status['updated_at'] = time.time()
+    tmp_path = f"{_status_path(job_id)}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp_path, _status_path(job_id))
+
+
+def get_job_status(job_id):
+    """Return a job's status dict, or None if the id is unknown or malformed"""
+    if not _JOB_ID_RE.match(job_id or ''):
+        return None
+    try:
+        with open(_status_path(job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def export_job_id(format_type, filters):
+    """Stable job id for a format + filter set; empty filters are ignored"""
+    normalized = {k: str(v).strip() for k, v in filters.items() if v not in (None, '')}
+    key = json.dumps({'format': format_type, 'filters': normalized}, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:24]
+
+
+def run_export_job(job_id, format_type, where_clause, params, pretty=False, targets=None):
+    """Process-pool entry point: stream the export to disk, reporting progress.
+
+    targets are the post shards to read (see shards.route()); None is the primary.
+    """
+    import shards
+    import statements
+
+    status = get_job_status(job_id) or {'id': job_id, 'format': format_type}
+    status.update({'status': 'running', 'started_at': time.time(), 'rows_written': 0})
+    _write_status(job_id, status)
+
+    final_path = result_path(job_id, format_type)
+    part_path = f"{final_path}.part"
+    conns = []
+    try:
+        conns = shards.connect(targets or [None])
+
+        total = 0
+        for conn in conns:
+            cursor = conn.cursor()
+            statements.execute(cursor, f"SELECT COUNT(*) FROM facebook_posts fp WHERE {where_clause}", params,
+                               'exports.count')
+            total += cursor.fetchone()[0]
+            cursor.close()
+        status['total_rows'] = total
+        _write_status(job_id, status)
+
+        # Named cursors -> rows are fetched from Postgres EXPORT_BATCH_SIZE at a time,
+        # merged across shards in the export order (created_at DESC)
+        merged = shards.iter_merged(conns, EXPORT_QUERY.format(where_clause=where_clause), params,
+                                    shards.sort_key('created_at'), reverse=True, batch_size=EXPORT_BATCH_SIZE)
+
+        def rows():
+            for i, row in enumerate(merged, 1):
+                yield row
+                if i % EXPORT_BATCH_SIZE == 0:
+                    status['rows_written'] = i
+                    _write_status(job_id, status)
+
+        with open(part_path, 'wb') as f:
+            write_export(format_type, rows(), f, pretty=pretty)
+        os.replace(part_path, final_path)
+
+        status.update({
+            'status': 'done',
+            'rows_written': status.get('total_rows', 0),
+            'size': os.path.getsize(final_path),
+            'finished_at': time.time(),
+        })
+        _write_status(job_id, status)
+    except Exception as e:
+        logger.error(f"Export job {job_id} failed: {e}")
+        status.update({'status': 'failed', 'error': str(e), 'finished_at': time.time()})
+        _write_status(job_id, status)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+class ExportJobManager:
+    """Submits export jobs to a per-process pool and reuses recent identical jobs"""
+
+    def __init__(self, max_workers=EXPORT_WORKERS):
+        self._max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily so each gunicorn worker gets its own pool after forking;
+        # 'spawn' keeps the pool processes free of the parent's DB connections and threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _is_reusable(self, status, now):
+        if status['status'] == 'done':
+            return (now - status.get('finished_at', 0) < EXPORT_JOB_TTL
+                    and os.path.exists(result_path(status['id'], status['format'])))
+        if status['status'] in ('queued', 'running'):
+            return now - status.get('updated_at', 0) < EXPORT_JOB_STALE_SECONDS
+        return False
+
+    def submit(self, format_type, filters, where_clause, params, pretty=False, targets=None):
+        """Start (or reuse) an export job on the given post shards; returns (status, reused)"""
+        os.makedirs(EXPORT_JOB_DIR, exist_ok=True)
+        self.cleanup_expired()
+
+        job_id = export_job_id(format_type, dict(filters, pretty=pretty or ''))
+        now = time.time()
+        status = get_job_status(job_id)
+        if status and self._is_reusable(status, now):
+            return status, True
+
+        status = {
+            'id': job_id,
+            'format': format_type,
+            'status': 'queued',
+            'created_at': now,
+            'rows_written': 0,
+        }
+        _write_status(job_id, status)
+        self._get_executor().submit(run_export_job, job_id, format_type, where_clause, list(params), pretty,
+                                  targets)
+        return status, False
+
+    def cleanup_expired(self):
+        """Remove results and status files of jobs that finished more than EXPORT_JOB_TTL ago"""
+        now = time.time()
+        try:
+            names = os.listdir(EXPORT_JOB_DIR)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            status = get_job_status(name[:-len('.json')])
+            if not status or status['status'] not in ('done', 'failed'):
+                continue
+            if now - status.get('finished_at', now) < EXPORT_JOB_TTL:
+                continue
+            for path in (result_path(status['id'], status['format']), _status_path(status['id'])):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
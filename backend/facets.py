@@ -0,0 +1,177 @@
+"""
+Facet counts for the filter sidebar.
+
+All facets are computed in one scan of the posts matching the active filters:
+the matching rows are grouped once with GROUPING SETS (group, content type,
+day, author and the grand total) and the author facet is cut down to the top
+authors in the same statement. The group and content type facets ignore their
+own filter, so the options not chosen keep their counts. Results are cached
+per normalized filter set for one FACETS_CACHE_SECONDS time bucket. With
+sharding every shard runs the query and merge_facets() adds up their counts.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+FACETS_CACHE_SECONDS = int(os.getenv('FACETS_CACHE_SECONDS', '60'))
+FACETS_CACHE_MAX_ENTRIES = int(os.getenv('FACETS_CACHE_MAX_ENTRIES', '256'))
+
+GROUP_KEY_SQL = "COALESCE(NULLIF(fp.group_id, ''), (regexp_match(fp.post_url, '/groups/([^/?]+)'))[1])"
+
+# GROUPING(group_key, content_type, day, author_id) of each grouping set
+_FACET_BITS = {7: 'groups', 11: 'content_types', 13: 'days', 14: 'authors', 15: 'total'}
+
+# Facets counted without their own filter, and that filter's request parameter
+SELF_EXCLUDING = {'groups': 'group_id', 'content_types': 'content_type'}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def facet_query(where_clause, params, top_authors, excluding=None):
+    """SQL and params returning one row per facet value.
+
+    excluding maps facets of SELF_EXCLUDING to the (where_clause, params) of the
+    filters without that facet's own filter; those facets count the posts
+    matching everything else, so choosing one group still shows the others'
+    counts instead of zeros.
+    """
+    excluding = excluding or {}
+    flags = ["TRUE AS selected"]
+    scan, query_params = where_clause, list(params)
+    if excluding:
+        # Every row matching any of the filter sets, flagged with the sets it matches.
+        # The full filter set is narrower than each of the others, so scanning their
+        # OR keeps the filters' indexes and partition pruning.
+        flags = [f"({where_clause}) AS selected"]
+        scan_params = []
+        for facet, (clause, clause_params) in excluding.items():
+            flags.append(f"({clause}) AS in_{facet}")
+            query_params += clause_params
+            scan_params += clause_params
+        scan = ' OR '.join(f"({clause})" for clause, _ in excluding.values())
+        query_params += scan_params
+    flags = ',\n                '.join(flags)
+
+    def count(facet):
+        return f"COUNT(*) FILTER (WHERE {'in_' + facet if facet in excluding else 'selected'})"
+
+    sql = f"""
+        WITH matched AS (
+            SELECT
+                {GROUP_KEY_SQL} AS group_key,
+                fp.content_type,
+                DATE(to_timestamp(fp.created_at) AT TIME ZONE 'UTC') AS day,
+                fp.author_id,
+                {flags}
+            FROM facebook_posts fp
+            WHERE {scan}
+        ),
+        counted AS (
+            SELECT
+                group_key, content_type, day, author_id,
+                GROUPING(group_key, content_type, day, author_id) AS facet,
+                CASE GROUPING(group_key, content_type, day, author_id)
+                    WHEN 7 THEN {count('groups')}
+                    WHEN 11 THEN {count('content_types')}
+                    ELSE COUNT(*) FILTER (WHERE selected)
+                END AS count
+            FROM matched
+            GROUP BY GROUPING SETS ((group_key), (content_type), (day), (author_id), ())
+        ),
+        ranked AS (
+            SELECT counted.*, ROW_NUMBER() OVER (PARTITION BY facet ORDER BY count DESC) AS rank
+            FROM counted
+            WHERE count > 0 OR facet = 15
+        )
+        SELECT c.facet, c.group_key, c.content_type, c.day, c.author_id, a.author_name, c.count
+        FROM ranked c
+        LEFT JOIN authors a ON a.id = c.author_id
+        WHERE c.facet <> 14 OR (c.author_id IS NOT NULL AND c.rank <= %s)
+    """
+    return sql, query_params + [top_authors]
+
+
+def build_facets(rows):
+    """Shape the facet rows into the /api/posts/facets response"""
+    result = {'total': 0, 'groups': [], 'content_types': [], 'days': [], 'authors': []}
+    for row in rows:
+        facet = _FACET_BITS.get(row['facet'])
+        if facet == 'total':
+            result['total'] = row['count']
+        elif facet == 'groups':
+            if row['group_key']:
+                result['groups'].append({'group_id': row['group_key'], 'count': row['count']})
+        elif facet == 'content_types':
+            result['content_types'].append({'content_type': row['content_type'], 'count': row['count']})
+        elif facet == 'days':
+            if row['day'] is not None:
+                result['days'].append({'date': row['day'].isoformat(), 'count': row['count']})
+        elif facet == 'authors':
+            result['authors'].append({'id': row['author_id'], 'name': row['author_name'], 'count': row['count']})
+
+    result['groups'].sort(key=lambda g: (-g['count'], g['group_id']))
+    result['content_types'].sort(key=lambda c: -c['count'])
+    result['days'].sort(key=lambda d: d['date'])
+    result['authors'].sort(key=lambda a: (-a['count'], a['name'] or ''))
+    return result
+
+
+def merge_facets(results, top_authors):
+    """Add up the build_facets() results of several shards.
+
+    Authors are matched by name (author ids are per shard) and keep the id of
+    the shard where they have the most posts. Each shard only reports its top
+    authors, so an author spread thinly over many shards can be missing.
+    """
+    merged = {'total': sum(result['total'] for result in results)}
+    for facet, key in (('groups', 'group_id'), ('content_types', 'content_type'), ('days', 'date')):
+        totals = {}
+        for result in results:
+            for entry in result[facet]:
+                totals[entry[key]] = totals.get(entry[key], 0) + entry['count']
+        merged[facet] = [{key: value, 'count': count} for value, count in totals.items()]
+    authors = {}
+    for result in results:
+        for entry in result['authors']:
+            author = authors.setdefault(entry['name'], {'id': entry['id'], 'name': entry['name'], 'count': 0, 'best': 0})
+            author['count'] += entry['count']
+            if entry['count'] > author['best']:
+                author['id'], author['best'] = entry['id'], entry['count']
+    merged['authors'] = [{'id': a['id'], 'name': a['name'], 'count': a['count']} for a in authors.values()]
+
+    merged['groups'].sort(key=lambda g: (-g['count'], g['group_id']))
+    merged['content_types'].sort(key=lambda c: -c['count'])
+    merged['days'].sort(key=lambda d: d['date'])
+    merged['authors'].sort(key=lambda a: (-a['count'], a['name'] or ''))
+    merged['authors'] = merged['authors'][:top_authors]
+    return merged
+
+
+def normalize_filters(args, keys):
+    """Cache key form of the filters: trimmed, lower-cased flags, empty values dropped"""
+    normalized = {}
+    for key in keys:
+        value = str(args.get(key, '') or '').strip()
+        if key == 'dedupe':
+            value = 'true' if value.lower() == 'true' else ''
+        if value:
+            normalized[key] = value
+    return normalized
+
+
+def cached_facets(params, compute):
+    """Return compute() for params, cached for the current FACETS_CACHE_SECONDS bucket"""
+    key = (tuple(sorted(params.items())), int(time.time() // FACETS_CACHE_SECONDS))
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key], True
+    result = compute()
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > FACETS_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return result, False
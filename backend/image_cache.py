@@ -0,0 +1,98 @@
+"""
+Upstream image fetching and the on-disk cache behind /api/image-proxy.
+
+Cache entries are keyed either by URL or, once phash_worker.py has hashed an
+attachment, by its perceptual cluster, so visually identical images served
+from different fbcdn URLs share a single cached copy.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'fb_image_cache'))
+# Cached images older than this (seconds) are treated as missing
+IMAGE_CACHE_MAX_AGE = int(os.getenv('IMAGE_CACHE_MAX_AGE', str(7 * 86400)))
+IMAGE_FETCH_TIMEOUT = int(os.getenv('IMAGE_FETCH_TIMEOUT', '10'))
+
+UPSTREAM_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
+    'Referer': 'https://www.facebook.com/',
+    'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+
+def fetch_image(url, timeout=IMAGE_FETCH_TIMEOUT):
+    """Fetch an image from the CDN; returns (data, content_type). Raises urllib errors."""
+    req = urllib.request.Request(url, headers=UPSTREAM_HEADERS)
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        data = resp.read()
+        content_type = resp.headers.get('Content-Type', 'image/jpeg')
+    return data, content_type.split(';')[0].strip()
+
+
+def url_cache_key(url):
+    return 'url-' + hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def cluster_cache_key(cluster_id, shard=None):
+    """Cluster ids are sequences of the database that hashed the image, so with
+    post shards the key names the shard too"""
+    if shard is None:
+        return f"phash-{cluster_id}"
+    return f"phash-{shard}-{cluster_id}"
+
+
+# Perceptual cluster id of an attachment url; no row if it has not been hashed
+CLUSTER_LOOKUP_SQL = "SELECT cluster_id FROM attachment_phash WHERE attachment_url = %s AND cluster_id IS NOT NULL"
+
+
+class ImageCache:
+    """Filesystem cache: <dir>/<2-char shard>/<key> plus a <key>.json metadata file"""
+
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_age=IMAGE_CACHE_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+
+    def _path(self, key):
+        shard = hashlib.md5(key.encode('utf-8')).hexdigest()[:2]
+        return os.path.join(self.directory, shard, key)
+
+    def get(self, key):
+        """Return (data, content_type) for a fresh entry, or None"""
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(f"{path}.json") as f:
+                meta = json.load(f)
+            with open(path, 'rb') as f:
+                return f.read(), meta.get('content_type', 'image/jpeg')
+        except (OSError, ValueError):
+            return None
+
+    def contains(self, key):
+        path = self._path(key)
+        try:
+            return time.time() - os.path.getmtime(path) <= self.max_age
+        except OSError:
+            return False
+
+    def put(self, key, data, content_type):
+        """Store an entry atomically (metadata first, then the data file)"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        suffix = f".{os.getpid()}.tmp"
+        with open(f"{path}.json{suffix}", 'w') as f:
+            json.dump({'content_type': content_type, 'stored_at': time.time()}, f)
+        os.replace(f"{path}.json{suffix}", f"{path}.json")
+        with open(f"{path}{suffix}", 'wb') as f:
+            f.write(data)
+        os.replace(f"{path}{suffix}", path)
@@ -95,3 +95,854 @@ CREATE INDEX IF NOT EXISTS idx_fb_media_posts_created_at ON fb_media_posts(creat
 --   12,
 --   NOW()
 -- );
+
+-- ---------------------------------------------------------------------------
+-- Post event notifications (consumed by GET /api/events)
+-- facebook_posts / facebook_attachments are written by the scraper; these
+-- statement-level triggers send one compact NOTIFY per insert/update batch.
+-- ---------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION notify_fb_posts_inserted() RETURNS trigger AS $$
+DECLARE
+  payload TEXT;
+BEGIN
+  SELECT json_build_object(
+      'type', 'posts',
+      'posts', COUNT(*),
+      'reactions', COALESCE(SUM(reaction_count), 0),
+      'comments', COALESCE(SUM(comment_count), 0),
+      'shares', COALESCE(SUM(share_count), 0),
+      'groups', (
+        SELECT COALESCE(json_object_agg(g.group_id, g.posts), '{}'::json)
+        FROM (
+          SELECT COALESCE(NULLIF(group_id, ''), (regexp_match(post_url, '/groups/([^/?]+)'))[1]) AS group_id,
+                 COUNT(*) AS posts
+          FROM new_rows
+          GROUP BY 1
+        ) g
+        WHERE g.group_id IS NOT NULL
+      )
+    )::text
+  INTO payload
+  FROM new_rows;
+
+  -- NOTIFY payloads are limited to 8000 bytes; drop the per-group breakdown if needed
+  IF length(payload) > 7900 THEN
+    payload := (payload::jsonb - 'groups' || '{"groups": null}'::jsonb)::text;
+  END IF;
+
+  PERFORM pg_notify('fb_posts_events', payload);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_fb_posts_engagement() RETURNS trigger AS $$
+DECLARE
+  delta RECORD;
+BEGIN
+  SELECT
+      COALESCE(SUM(COALESCE(n.reaction_count, 0) - COALESCE(o.reaction_count, 0)), 0) AS reactions,
+      COALESCE(SUM(COALESCE(n.comment_count, 0) - COALESCE(o.comment_count, 0)), 0) AS comments,
+      COALESCE(SUM(COALESCE(n.share_count, 0) - COALESCE(o.share_count, 0)), 0) AS shares
+  INTO delta
+  FROM new_rows n
+  JOIN old_rows o ON o.id = n.id;
+
+  IF delta.reactions <> 0 OR delta.comments <> 0 OR delta.shares <> 0 THEN
+    PERFORM pg_notify('fb_posts_events', json_build_object(
+      'type', 'stats',
+      'reactions', delta.reactions,
+      'comments', delta.comments,
+      'shares', delta.shares
+    )::text);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_fb_posts_notify_insert ON facebook_posts;
+CREATE TRIGGER trg_fb_posts_notify_insert
+  AFTER INSERT ON facebook_posts
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_fb_posts_inserted();
+
+DROP TRIGGER IF EXISTS trg_fb_posts_notify_update ON facebook_posts;
+CREATE TRIGGER trg_fb_posts_notify_update
+  AFTER UPDATE ON facebook_posts
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_fb_posts_engagement();
+
+-- ---------------------------------------------------------------------------
+-- Change tracking for incremental sync (GET /api/posts/changes)
+-- change_xid is the (64-bit) id of the transaction that inserted the post or
+-- last changed its reaction/comment/share counts. Consumers page by
+-- (change_xid, id) and only see transactions older than the oldest in-flight
+-- one, so no change can commit "behind" a returned watermark. Requires PG 13+.
+-- ---------------------------------------------------------------------------
+ALTER TABLE facebook_posts ADD COLUMN IF NOT EXISTS change_xid xid8;
+ALTER TABLE facebook_posts ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ;
+
+CREATE OR REPLACE FUNCTION fb_posts_track_change() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT'
+     OR NEW.reaction_count IS DISTINCT FROM OLD.reaction_count
+     OR NEW.comment_count IS DISTINCT FROM OLD.comment_count
+     OR NEW.share_count IS DISTINCT FROM OLD.share_count THEN
+    NEW.change_xid := pg_current_xact_id();
+    NEW.updated_at := NOW();
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_fb_posts_track_change ON facebook_posts;
+CREATE TRIGGER trg_fb_posts_track_change
+  BEFORE INSERT OR UPDATE ON facebook_posts
+  FOR EACH ROW EXECUTE FUNCTION fb_posts_track_change();
+
+-- Backfill existing rows (one-off; all pre-existing posts share this transaction id)
+UPDATE facebook_posts
+SET change_xid = pg_current_xact_id(), updated_at = COALESCE(updated_at, NOW())
+WHERE change_xid IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_facebook_posts_change ON facebook_posts(change_xid, id);
+
+-- ---------------------------------------------------------------------------
+-- Near-duplicate detection (filled by dedupe_worker.py, used by dedupe=true)
+-- post_minhash holds one MinHash signature per post and the cluster it belongs
+-- to (the id of the first post seen with that text); post_lsh_bands is the LSH
+-- index used to find candidate duplicates of a new post.
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS post_minhash (
+  post_id BIGINT PRIMARY KEY,
+  signature INTEGER[],
+  cluster_id BIGINT NOT NULL,
+  computed_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_post_minhash_cluster ON post_minhash(cluster_id);
+
+CREATE TABLE IF NOT EXISTS post_lsh_bands (
+  band SMALLINT NOT NULL,
+  band_hash BIGINT NOT NULL,
+  post_id BIGINT NOT NULL,
+  PRIMARY KEY (band, band_hash, post_id)
+);
+CREATE INDEX IF NOT EXISTS idx_post_lsh_bands_post ON post_lsh_bands(post_id);
+
+-- ---------------------------------------------------------------------------
+-- Perceptual hashes of image attachments (filled by phash_worker.py)
+-- phash is a 64-bit DCT hash; band0-band3 are its four 16-bit slices, so any
+-- image within 3 bits of another shares at least one indexed band with it.
+-- cluster_id groups visually identical images (the id of the first one seen)
+-- and keys the image proxy cache. Unfetchable images are kept with a NULL hash
+-- and a non-'ok' status so they are not retried on every run; transient fetch
+-- errors ('error') are retried at next_attempt_at with exponential backoff.
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS attachment_phash (
+  id BIGSERIAL PRIMARY KEY,
+  attachment_url TEXT NOT NULL UNIQUE,
+  phash BIGINT,
+  band0 SMALLINT,
+  band1 SMALLINT,
+  band2 SMALLINT,
+  band3 SMALLINT,
+  cluster_id BIGINT,
+  status VARCHAR(20) NOT NULL DEFAULT 'ok',
+  computed_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_attachment_phash_band0 ON attachment_phash(band0) WHERE status = 'ok';
+CREATE INDEX IF NOT EXISTS idx_attachment_phash_band1 ON attachment_phash(band1) WHERE status = 'ok';
+CREATE INDEX IF NOT EXISTS idx_attachment_phash_band2 ON attachment_phash(band2) WHERE status = 'ok';
+CREATE INDEX IF NOT EXISTS idx_attachment_phash_band3 ON attachment_phash(band3) WHERE status = 'ok';
+CREATE INDEX IF NOT EXISTS idx_attachment_phash_cluster ON attachment_phash(cluster_id);
+ALTER TABLE attachment_phash ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE attachment_phash ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ;
+-- Errors recorded before retries existed get one
+UPDATE attachment_phash SET next_attempt_at = NOW()
+WHERE status = 'error' AND attempts = 0 AND next_attempt_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_attachment_phash_retry ON attachment_phash(next_attempt_at) WHERE status = 'error';
+CREATE INDEX IF NOT EXISTS idx_facebook_attachments_url ON facebook_attachments(attachment_url);
+
+-- ---------------------------------------------------------------------------
+-- Author directory (GET /api/authors, author_id filter on /api/posts)
+-- One row per distinct author_name with running post count, total engagement
+-- and the newest post time, kept current by triggers so the dashboard never
+-- has to aggregate facebook_posts by author. facebook_posts.author_id is
+-- resolved on insert / author change.
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS authors (
+  id BIGSERIAL PRIMARY KEY,
+  author_name TEXT NOT NULL UNIQUE,
+  author_url TEXT,
+  post_count BIGINT NOT NULL DEFAULT 0,
+  total_engagement BIGINT NOT NULL DEFAULT 0,
+  last_seen BIGINT
+);
+
+ALTER TABLE facebook_posts ADD COLUMN IF NOT EXISTS author_id BIGINT;
+
+-- Backfill (only touches posts that have no author_id yet)
+INSERT INTO authors (author_name, author_url)
+SELECT author_name, MAX(author_url)
+FROM facebook_posts
+WHERE author_name IS NOT NULL AND author_name <> '' AND author_id IS NULL
+GROUP BY author_name
+ON CONFLICT (author_name) DO NOTHING;
+
+UPDATE facebook_posts fp
+SET author_id = a.id
+FROM authors a
+WHERE fp.author_id IS NULL AND a.author_name = fp.author_name;
+
+UPDATE authors a
+SET post_count = s.post_count,
+    total_engagement = s.total_engagement,
+    last_seen = s.last_seen
+FROM (
+  SELECT author_id,
+         COUNT(*) AS post_count,
+         SUM(COALESCE(reaction_count, 0) + COALESCE(comment_count, 0) + COALESCE(share_count, 0)) AS total_engagement,
+         MAX(created_at) AS last_seen
+  FROM facebook_posts
+  WHERE author_id IS NOT NULL
+  GROUP BY author_id
+) s
+WHERE a.id = s.author_id AND a.post_count = 0;
+
+CREATE INDEX IF NOT EXISTS idx_facebook_posts_author_id ON facebook_posts(author_id);
+
+CREATE OR REPLACE FUNCTION fb_posts_resolve_author() RETURNS trigger AS $$
+BEGIN
+  IF NEW.author_name IS NULL OR NEW.author_name = '' THEN
+    NEW.author_id := NULL;
+    RETURN NEW;
+  END IF;
+  SELECT id INTO NEW.author_id FROM authors WHERE author_name = NEW.author_name;
+  IF NEW.author_id IS NULL THEN
+    INSERT INTO authors (author_name, author_url)
+    VALUES (NEW.author_name, NEW.author_url)
+    ON CONFLICT (author_name) DO NOTHING
+    RETURNING id INTO NEW.author_id;
+    -- Lost a race with a concurrent insert of the same author
+    IF NEW.author_id IS NULL THEN
+      SELECT id INTO NEW.author_id FROM authors WHERE author_name = NEW.author_name;
+    END IF;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Counts are applied AFTER the row is written so posts skipped by
+-- INSERT ... ON CONFLICT DO NOTHING are not counted.
+CREATE OR REPLACE FUNCTION fb_posts_author_stats() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.author_id IS NOT NULL THEN
+    UPDATE authors
+    SET post_count = post_count - 1,
+        total_engagement = total_engagement
+          - (COALESCE(OLD.reaction_count, 0) + COALESCE(OLD.comment_count, 0) + COALESCE(OLD.share_count, 0))
+    WHERE id = OLD.author_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.author_id IS NOT NULL THEN
+    UPDATE authors
+    SET post_count = post_count + 1,
+        total_engagement = total_engagement
+          + (COALESCE(NEW.reaction_count, 0) + COALESCE(NEW.comment_count, 0) + COALESCE(NEW.share_count, 0)),
+        last_seen = GREATEST(last_seen, NEW.created_at)
+    WHERE id = NEW.author_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_fb_posts_resolve_author ON facebook_posts;
+CREATE TRIGGER trg_fb_posts_resolve_author
+  BEFORE INSERT OR UPDATE OF author_name ON facebook_posts
+  FOR EACH ROW EXECUTE FUNCTION fb_posts_resolve_author();
+
+DROP TRIGGER IF EXISTS trg_fb_posts_author_stats ON facebook_posts;
+CREATE TRIGGER trg_fb_posts_author_stats
+  AFTER INSERT OR DELETE ON facebook_posts
+  FOR EACH ROW EXECUTE FUNCTION fb_posts_author_stats();
+
+DROP TRIGGER IF EXISTS trg_fb_posts_author_stats_update ON facebook_posts;
+CREATE TRIGGER trg_fb_posts_author_stats_update
+  AFTER UPDATE ON facebook_posts
+  FOR EACH ROW
+  WHEN (OLD.author_id IS DISTINCT FROM NEW.author_id
+        OR OLD.reaction_count IS DISTINCT FROM NEW.reaction_count
+        OR OLD.comment_count IS DISTINCT FROM NEW.comment_count
+        OR OLD.share_count IS DISTINCT FROM NEW.share_count)
+  EXECUTE FUNCTION fb_posts_author_stats();
+
+-- ---------------------------------------------------------------------------
+-- Monthly partitions of facebook_posts (after running partition_posts.sql)
+-- Partitions are named facebook_posts_pYYYYMM and cover [month start, next
+-- month start) in epoch seconds (UTC). fb_posts_ensure_partitions creates the
+-- missing ones up to months_ahead months from now and returns their names;
+-- partition_maintenance.py calls it on a schedule and detaches old months.
+-- It is a no-op while facebook_posts is not partitioned.
+-- ---------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION fb_posts_ensure_partitions(months_ahead INTEGER DEFAULT 3, from_month DATE DEFAULT NULL)
+RETURNS SETOF TEXT AS $$
+DECLARE
+  this_month DATE := date_trunc('month', NOW() AT TIME ZONE 'UTC')::date;
+  month DATE;
+  part TEXT;
+  lo BIGINT;
+  hi BIGINT;
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'facebook_posts'::regclass) THEN
+    RETURN;
+  END IF;
+  month := date_trunc('month', COALESCE(LEAST(from_month, this_month), this_month))::date;
+  WHILE month <= this_month + make_interval(months => months_ahead) LOOP
+    part := 'facebook_posts_p' || to_char(month, 'YYYYMM');
+    -- EXTRACT(EPOCH) of a timestamp without time zone reads it as UTC
+    lo := EXTRACT(EPOCH FROM month::timestamp)::bigint;
+    hi := EXTRACT(EPOCH FROM (month + INTERVAL '1 month')::timestamp)::bigint;
+    IF to_regclass(part) IS NULL THEN
+      -- A partition cannot be added over rows already in the default partition
+      IF EXISTS (SELECT 1 FROM facebook_posts_default WHERE created_at >= lo AND created_at < hi) THEN
+        RAISE WARNING '% not created: facebook_posts_default holds posts in its range', part;
+      ELSE
+        EXECUTE format('CREATE TABLE %I PARTITION OF facebook_posts FOR VALUES FROM (%s) TO (%s)', part, lo, hi);
+        RETURN NEXT part;
+      END IF;
+    END IF;
+    month := (month + INTERVAL '1 month')::date;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Listing order; on a partitioned table this becomes one index per partition
+CREATE INDEX IF NOT EXISTS idx_facebook_posts_created_at ON facebook_posts(created_at);
+
+-- Partitions partition_maintenance.py is retiring. A detach fires no row
+-- triggers, so the script subtracts the partition's posts from the author
+-- stats itself; stats_adjusted_at makes that happen exactly once per
+-- partition, also when a run stopped between the detach and the adjustment.
+CREATE TABLE IF NOT EXISTS retired_post_partitions (
+  partition_name TEXT PRIMARY KEY,
+  detached_at TIMESTAMPTZ,
+  stats_adjusted_at TIMESTAMPTZ
+);
+
+-- A partitioned facebook_posts can only be unique on (post_url, created_at),
+-- so post_urls keeps post_url itself unique: inserting a post that already
+-- exists with another created_at fails instead of adding a second row. Fix a
+-- timestamp with an UPDATE; the trigger moves the claim along.
+CREATE TABLE IF NOT EXISTS post_urls (
+  post_url TEXT PRIMARY KEY,
+  created_at BIGINT
+);
+
+CREATE OR REPLACE FUNCTION fb_posts_claim_url() RETURNS trigger AS $$
+DECLARE
+  claimed BIGINT;
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    DELETE FROM post_urls WHERE post_url = OLD.post_url AND created_at IS NOT DISTINCT FROM OLD.created_at;
+    IF TG_OP = 'DELETE' THEN
+      RETURN OLD;
+    END IF;
+  END IF;
+  INSERT INTO post_urls (post_url, created_at) VALUES (NEW.post_url, NEW.created_at)
+  ON CONFLICT (post_url) DO NOTHING;
+  IF NOT FOUND THEN
+    SELECT created_at INTO claimed FROM post_urls WHERE post_url = NEW.post_url;
+    IF claimed IS DISTINCT FROM NEW.created_at THEN
+      RAISE unique_violation USING
+        MESSAGE = format('post %s already exists with created_at %s', NEW.post_url, claimed),
+        HINT = 'Update the existing row to change its created_at.';
+    END IF;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'facebook_posts'::regclass) THEN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_fb_posts_claim_url'
+                   AND tgrelid = 'facebook_posts'::regclass) THEN
+      INSERT INTO post_urls (post_url, created_at)
+      SELECT post_url, MIN(created_at) FROM facebook_posts WHERE post_url IS NOT NULL GROUP BY post_url
+      ON CONFLICT (post_url) DO NOTHING;
+    END IF;
+    DROP TRIGGER IF EXISTS trg_fb_posts_claim_url ON facebook_posts;
+    CREATE TRIGGER trg_fb_posts_claim_url
+      BEFORE INSERT OR DELETE OR UPDATE OF post_url, created_at ON facebook_posts
+      FOR EACH ROW EXECUTE FUNCTION fb_posts_claim_url();
+  END IF;
+END;
+$$;
+
+-- ---------------------------------------------------------------------------
+-- Image cache warming queue (drained by cache_warmer.py)
+-- Every new image attachment is queued and announced on the
+-- fb_attachments_warm channel, so the warmer can fetch it into the image proxy
+-- cache before its CDN signature expires. Failed fetches are retried with
+-- backoff through attempts / next_attempt_at.
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS attachment_warm_queue (
+  id BIGSERIAL PRIMARY KEY,
+  attachment_url TEXT NOT NULL UNIQUE,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  enqueued_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_attachment_warm_queue_next ON attachment_warm_queue(next_attempt_at, id);
+
+CREATE OR REPLACE FUNCTION enqueue_attachment_warm() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO attachment_warm_queue (attachment_url)
+  SELECT DISTINCT attachment_url
+  FROM new_rows
+  WHERE attachment_type = 'image' AND attachment_url IS NOT NULL
+  ON CONFLICT (attachment_url) DO NOTHING;
+  IF FOUND THEN
+    PERFORM pg_notify('fb_attachments_warm', '');
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_fb_attachments_warm ON facebook_attachments;
+CREATE TRIGGER trg_fb_attachments_warm
+  AFTER INSERT ON facebook_attachments
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION enqueue_attachment_warm();
+
+-- ---------------------------------------------------------------------------
+-- Archived media (filled by media_archiver.py, served by GET /api/media/<sha256>)
+-- media_objects has one row per stored blob, keyed by its SHA-256;
+-- attachment_media maps each attachment URL to the blob it resolved to.
+-- Attachments that could not be downloaded keep a NULL sha256 and a non-'ok'
+-- status; transient errors ('error') are retried at next_attempt_at with
+-- exponential backoff.
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS media_objects (
+  sha256 CHAR(64) PRIMARY KEY,
+  content_type TEXT NOT NULL,
+  size_bytes BIGINT NOT NULL,
+  stored_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS attachment_media (
+  attachment_url TEXT PRIMARY KEY,
+  sha256 CHAR(64) REFERENCES media_objects(sha256),
+  status VARCHAR(20) NOT NULL DEFAULT 'ok',
+  archived_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_attachment_media_sha256 ON attachment_media(sha256);
+ALTER TABLE attachment_media ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE attachment_media ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ;
+-- Errors recorded before retries existed get one
+UPDATE attachment_media SET next_attempt_at = NOW()
+WHERE status = 'error' AND attempts = 0 AND next_attempt_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_attachment_media_retry ON attachment_media(next_attempt_at) WHERE status = 'error';
+
+-- ---------------------------------------------------------------------------
+-- Media summary of each post (content_type / has_media filters on /api/posts)
+-- Distinct image and video attachment counts, the derived content_type
+-- (video if any video, else image if any image, else text) and the first
+-- image / video URL (lowest URL, for thumbnails) are stored on facebook_posts
+-- so listings can filter on media and render cards without aggregating
+-- facebook_attachments. Kept current by triggers on both tables.
+-- ---------------------------------------------------------------------------
+ALTER TABLE facebook_posts ADD COLUMN IF NOT EXISTS image_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE facebook_posts ADD COLUMN IF NOT EXISTS video_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE facebook_posts ADD COLUMN IF NOT EXISTS content_type VARCHAR(10) NOT NULL DEFAULT 'text';
+ALTER TABLE facebook_posts ADD COLUMN IF NOT EXISTS first_image_url TEXT;
+ALTER TABLE facebook_posts ADD COLUMN IF NOT EXISTS first_video_url TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_facebook_attachments_post_url ON facebook_attachments(post_url);
+
+-- Recompute the summary of the given posts from their attachments
+CREATE OR REPLACE FUNCTION fb_posts_refresh_media(urls TEXT[]) RETURNS void AS $$
+BEGIN
+  UPDATE facebook_posts fp
+  SET image_count = s.image_count,
+      video_count = s.video_count,
+      content_type = CASE WHEN s.video_count > 0 THEN 'video'
+                          WHEN s.image_count > 0 THEN 'image'
+                          ELSE 'text' END,
+      first_image_url = s.first_image_url,
+      first_video_url = s.first_video_url
+  FROM (
+    SELECT p.post_url,
+           COUNT(DISTINCT fa.attachment_url) FILTER (WHERE fa.attachment_type = 'image') AS image_count,
+           COUNT(DISTINCT fa.attachment_url) FILTER (WHERE fa.attachment_type = 'video') AS video_count,
+           MIN(fa.attachment_url) FILTER (WHERE fa.attachment_type = 'image') AS first_image_url,
+           MIN(fa.attachment_url) FILTER (WHERE fa.attachment_type = 'video') AS first_video_url
+    FROM unnest(urls) AS p(post_url)
+    LEFT JOIN facebook_attachments fa ON fa.post_url = p.post_url
+    GROUP BY p.post_url
+  ) s
+  WHERE fp.post_url = s.post_url
+    AND (fp.image_count, fp.video_count, fp.first_image_url, fp.first_video_url)
+        IS DISTINCT FROM (s.image_count, s.video_count, s.first_image_url, s.first_video_url);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION fb_attachments_refresh_media() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    PERFORM fb_posts_refresh_media(ARRAY(SELECT DISTINCT post_url FROM old_rows WHERE post_url IS NOT NULL));
+  ELSE
+    PERFORM fb_posts_refresh_media(ARRAY(SELECT DISTINCT post_url FROM new_rows WHERE post_url IS NOT NULL));
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_fb_attachments_media_insert ON facebook_attachments;
+CREATE TRIGGER trg_fb_attachments_media_insert
+  AFTER INSERT ON facebook_attachments
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION fb_attachments_refresh_media();
+
+DROP TRIGGER IF EXISTS trg_fb_attachments_media_delete ON facebook_attachments;
+CREATE TRIGGER trg_fb_attachments_media_delete
+  AFTER DELETE ON facebook_attachments
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION fb_attachments_refresh_media();
+
+-- Attachments scraped before their post: summarise them when the post arrives
+CREATE OR REPLACE FUNCTION fb_posts_init_media() RETURNS trigger AS $$
+BEGIN
+  SELECT COUNT(DISTINCT attachment_url) FILTER (WHERE attachment_type = 'image'),
+         COUNT(DISTINCT attachment_url) FILTER (WHERE attachment_type = 'video'),
+         MIN(attachment_url) FILTER (WHERE attachment_type = 'image'),
+         MIN(attachment_url) FILTER (WHERE attachment_type = 'video')
+  INTO NEW.image_count, NEW.video_count, NEW.first_image_url, NEW.first_video_url
+  FROM facebook_attachments
+  WHERE post_url = NEW.post_url;
+  NEW.content_type := CASE WHEN NEW.video_count > 0 THEN 'video'
+                           WHEN NEW.image_count > 0 THEN 'image'
+                           ELSE 'text' END;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_fb_posts_init_media ON facebook_posts;
+CREATE TRIGGER trg_fb_posts_init_media
+  BEFORE INSERT ON facebook_posts
+  FOR EACH ROW EXECUTE FUNCTION fb_posts_init_media();
+
+-- Backfill (only rewrites posts whose summary is out of date)
+SELECT fb_posts_refresh_media(ARRAY(SELECT DISTINCT post_url FROM facebook_attachments WHERE post_url IS NOT NULL));
+
+CREATE INDEX IF NOT EXISTS idx_facebook_posts_content_type ON facebook_posts(content_type, created_at);
+
+-- ---------------------------------------------------------------------------
+-- Schema version (invalidates the API's prepared statements, see statements.py)
+-- version is bumped by every DDL command, including re-running this script
+-- and partition maintenance; API processes re-read it periodically and
+-- re-prepare their statements when it changes. Creating the event trigger
+-- needs superuser; without it, run SELECT bump_schema_version(); after
+-- schema changes.
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS app_schema_version (
+  singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+  version BIGINT NOT NULL DEFAULT 0,
+  changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+INSERT INTO app_schema_version (singleton) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_schema_version() RETURNS BIGINT AS $$
+  UPDATE app_schema_version SET version = version + 1, changed_at = NOW() RETURNING version;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION app_schema_changed() RETURNS event_trigger AS $$
+BEGIN
+  PERFORM bump_schema_version();
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+  DROP EVENT TRIGGER IF EXISTS trg_app_schema_changed;
+  CREATE EVENT TRIGGER trg_app_schema_changed ON ddl_command_end
+    EXECUTE FUNCTION app_schema_changed();
+EXCEPTION WHEN insufficient_privilege THEN
+  RAISE NOTICE 'Not a superuser: run SELECT bump_schema_version(); after schema changes';
+END;
+$$;
+
+SELECT bump_schema_version();
+
+-- ---------------------------------------------------------------------------
+-- Top-post leaderboards (GET /api/leaderboards, refreshed by leaderboard_job.py)
+-- One board per (period, metric, scope): period is 24h / 7d / 30d / all,
+-- metric is reactions / comments / engagement (reactions + comments + shares)
+-- and scope is a group key, or '' for all posts. Each board keeps the top
+-- fb_leaderboard_size() posts. New posts and engagement increases are offered
+-- to the boards by a statement trigger; a post only enters when it beats the
+-- board's last entry, so reads never aggregate facebook_posts. Entries that
+-- age out of a period are dropped and the board refilled by
+-- fb_leaderboard_rebuild(), which leaderboard_job.py runs periodically.
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS post_leaderboard (
+  period VARCHAR(4) NOT NULL,
+  metric VARCHAR(10) NOT NULL,
+  scope TEXT NOT NULL,
+  post_id BIGINT NOT NULL,
+  score BIGINT NOT NULL,
+  created_at BIGINT NOT NULL,
+  PRIMARY KEY (period, metric, scope, post_id)
+);
+CREATE INDEX IF NOT EXISTS idx_post_leaderboard_rank ON post_leaderboard(period, metric, scope, score DESC, post_id);
+
+CREATE OR REPLACE FUNCTION fb_leaderboard_size() RETURNS INTEGER AS $$
+  SELECT 100;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Period lengths in seconds (NULL = all time)
+CREATE OR REPLACE FUNCTION fb_leaderboard_periods() RETURNS TABLE (period VARCHAR(4), seconds BIGINT) AS $$
+  VALUES ('24h'::VARCHAR(4), 86400::BIGINT), ('7d', 604800), ('30d', 2592000), ('all', NULL);
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Offer posts to every board they qualify for
+CREATE OR REPLACE FUNCTION fb_leaderboard_offer_posts(posts facebook_posts[]) RETURNS void AS $$
+  WITH offers AS (
+    SELECT p.period, m.metric, s.scope, n.id AS post_id, m.score, n.created_at
+    FROM unnest(posts) n
+    CROSS JOIN LATERAL (VALUES
+      ('reactions', COALESCE(n.reaction_count, 0)::BIGINT),
+      ('comments', COALESCE(n.comment_count, 0)::BIGINT),
+      ('engagement', (COALESCE(n.reaction_count, 0) + COALESCE(n.comment_count, 0) + COALESCE(n.share_count, 0))::BIGINT)
+    ) AS m(metric, score)
+    CROSS JOIN LATERAL (VALUES
+      (''), (COALESCE(NULLIF(n.group_id, ''), (regexp_match(n.post_url, '/groups/([^/?]+)'))[1]))
+    ) AS s(scope)
+    JOIN fb_leaderboard_periods() p
+      ON p.seconds IS NULL OR n.created_at >= EXTRACT(EPOCH FROM NOW())::BIGINT - p.seconds
+    WHERE s.scope IS NOT NULL AND n.created_at IS NOT NULL
+  )
+  -- Only offers that beat the board's last entry, fill a board that is not full
+  -- yet or update a post already on the board. Boards can briefly hold more
+  -- than fb_leaderboard_size() entries; fb_leaderboard_trim() cuts them back.
+  INSERT INTO post_leaderboard (period, metric, scope, post_id, score, created_at)
+  SELECT o.period, o.metric, o.scope, o.post_id, o.score, o.created_at
+  FROM offers o
+  CROSS JOIN LATERAL (
+    SELECT COUNT(*) AS entries, MIN(b.score) AS min_score
+    FROM (
+      SELECT b.score FROM post_leaderboard b
+      WHERE b.period = o.period AND b.metric = o.metric AND b.scope = o.scope
+      ORDER BY b.score DESC
+      LIMIT fb_leaderboard_size()
+    ) b
+  ) board
+  WHERE board.entries < fb_leaderboard_size() OR o.score > board.min_score
+     OR EXISTS (SELECT 1 FROM post_leaderboard e
+                WHERE e.period = o.period AND e.metric = o.metric AND e.scope = o.scope AND e.post_id = o.post_id)
+  ON CONFLICT (period, metric, scope, post_id) DO UPDATE SET score = EXCLUDED.score;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION fb_leaderboard_offer() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    PERFORM fb_leaderboard_offer_posts(ARRAY(SELECT n::facebook_posts FROM new_rows n));
+  ELSE
+    PERFORM fb_leaderboard_offer_posts(ARRAY(
+      SELECT n::facebook_posts
+      FROM new_rows n
+      JOIN old_rows o ON o.id = n.id
+      WHERE n.reaction_count IS DISTINCT FROM o.reaction_count
+         OR n.comment_count IS DISTINCT FROM o.comment_count
+         OR n.share_count IS DISTINCT FROM o.share_count
+    ));
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_fb_posts_leaderboard_insert ON facebook_posts;
+CREATE TRIGGER trg_fb_posts_leaderboard_insert
+  AFTER INSERT ON facebook_posts
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION fb_leaderboard_offer();
+
+DROP TRIGGER IF EXISTS trg_fb_posts_leaderboard_update ON facebook_posts;
+CREATE TRIGGER trg_fb_posts_leaderboard_update
+  AFTER UPDATE ON facebook_posts
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION fb_leaderboard_offer();
+
+-- Recompute the boards of one period from facebook_posts; returns the entries written
+CREATE OR REPLACE FUNCTION fb_leaderboard_rebuild(target_period VARCHAR(4)) RETURNS BIGINT AS $$
+DECLARE
+  since BIGINT;
+  written BIGINT;
+BEGIN
+  SELECT EXTRACT(EPOCH FROM NOW())::BIGINT - p.seconds INTO since
+  FROM fb_leaderboard_periods() p WHERE p.period = target_period;
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'unknown leaderboard period %', target_period;
+  END IF;
+
+  DELETE FROM post_leaderboard WHERE period = target_period;
+
+  INSERT INTO post_leaderboard (period, metric, scope, post_id, score, created_at)
+  SELECT target_period, r.metric, r.scope, r.post_id, r.score, r.created_at
+  FROM (
+    SELECT m.metric, s.scope, fp.id AS post_id, m.score, fp.created_at,
+           ROW_NUMBER() OVER (PARTITION BY m.metric, s.scope ORDER BY m.score DESC, fp.id) AS rank
+    FROM facebook_posts fp
+    CROSS JOIN LATERAL (VALUES
+      ('reactions', COALESCE(fp.reaction_count, 0)::BIGINT),
+      ('comments', COALESCE(fp.comment_count, 0)::BIGINT),
+      ('engagement', (COALESCE(fp.reaction_count, 0) + COALESCE(fp.comment_count, 0) + COALESCE(fp.share_count, 0))::BIGINT)
+    ) AS m(metric, score)
+    CROSS JOIN LATERAL (VALUES
+      (''), (COALESCE(NULLIF(fp.group_id, ''), (regexp_match(fp.post_url, '/groups/([^/?]+)'))[1]))
+    ) AS s(scope)
+    WHERE s.scope IS NOT NULL AND fp.created_at IS NOT NULL
+      AND (since IS NULL OR fp.created_at >= since)
+  ) r
+  WHERE r.rank <= fb_leaderboard_size();
+  GET DIAGNOSTICS written = ROW_COUNT;
+  RETURN written;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Drop entries that aged out of their period and cut boards back to their size
+CREATE OR REPLACE FUNCTION fb_leaderboard_trim() RETURNS BIGINT AS $$
+DECLARE
+  removed BIGINT;
+BEGIN
+  DELETE FROM post_leaderboard pl
+  USING fb_leaderboard_periods() p
+  WHERE pl.period = p.period AND p.seconds IS NOT NULL
+    AND pl.created_at < EXTRACT(EPOCH FROM NOW())::BIGINT - p.seconds;
+  GET DIAGNOSTICS removed = ROW_COUNT;
+
+  DELETE FROM post_leaderboard pl
+  USING (
+    SELECT period, metric, scope, post_id,
+           ROW_NUMBER() OVER (PARTITION BY period, metric, scope ORDER BY score DESC, post_id) AS rank
+    FROM post_leaderboard
+  ) ranked
+  WHERE ranked.rank > fb_leaderboard_size()
+    AND pl.period = ranked.period AND pl.metric = ranked.metric
+    AND pl.scope = ranked.scope AND pl.post_id = ranked.post_id;
+  RETURN removed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ---------------------------------------------------------------------------
+-- Engagement history (GET /api/posts/<id>/engagement, /api/posts/fastest-growing)
+-- Every change of a post's reaction/comment/share counts appends one sample
+-- to the post's row for the current UTC day: offsets are seconds since the
+-- day starts, d_* the change of each counter since the previous sample (the
+-- first sample of a new post holds its initial counts). Absolute values are
+-- recovered backwards from the current counts, so posts scraped before this
+-- was installed still get a curve from their first change on.
+-- post_engagement_velocity holds each post's engagement per hour, smoothed
+-- with an exponentially weighted average (6 hour time constant), so the
+-- fastest-growing posts are an index scan.
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS post_engagement_history (
+  post_id BIGINT NOT NULL,
+  bucket BIGINT NOT NULL,
+  offsets INTEGER[] NOT NULL,
+  d_reactions INTEGER[] NOT NULL,
+  d_comments INTEGER[] NOT NULL,
+  d_shares INTEGER[] NOT NULL,
+  PRIMARY KEY (post_id, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS post_engagement_velocity (
+  post_id BIGINT PRIMARY KEY,
+  sampled_at BIGINT NOT NULL,
+  engagement BIGINT NOT NULL,
+  velocity DOUBLE PRECISION NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_post_engagement_velocity ON post_engagement_velocity(velocity DESC);
+
+-- changes: (post_id, created_at, reactions/comments/shares now, and their deltas)
+CREATE OR REPLACE FUNCTION fb_posts_record_engagement(now_epoch BIGINT, changes JSONB) RETURNS void AS $$
+  WITH c AS (
+    SELECT *
+    FROM jsonb_to_recordset(changes) AS c(
+      post_id BIGINT, created_at BIGINT, reactions BIGINT, comments BIGINT, shares BIGINT,
+      d_reactions INTEGER, d_comments INTEGER, d_shares INTEGER
+    )
+  ),
+  history AS (
+    INSERT INTO post_engagement_history AS h (post_id, bucket, offsets, d_reactions, d_comments, d_shares)
+    SELECT post_id, now_epoch - now_epoch % 86400, ARRAY[(now_epoch % 86400)::INTEGER],
+           ARRAY[d_reactions], ARRAY[d_comments], ARRAY[d_shares]
+    FROM c
+    ON CONFLICT (post_id, bucket) DO UPDATE SET
+      offsets = h.offsets || EXCLUDED.offsets,
+      d_reactions = h.d_reactions || EXCLUDED.d_reactions,
+      d_comments = h.d_comments || EXCLUDED.d_comments,
+      d_shares = h.d_shares || EXCLUDED.d_shares
+  )
+  INSERT INTO post_engagement_velocity AS v (post_id, sampled_at, engagement, velocity)
+  SELECT post_id, now_epoch, reactions + comments + shares,
+         -- First sample: average rate since the post was created (at least an hour)
+         (d_reactions + d_comments + d_shares) * 3600.0
+           / GREATEST(now_epoch - COALESCE(created_at, now_epoch), 3600)
+  FROM c
+  ON CONFLICT (post_id) DO UPDATE SET
+    velocity = (1 - exp(-GREATEST(now_epoch - v.sampled_at, 1) / 21600.0))
+                 * (EXCLUDED.engagement - v.engagement) * 3600.0 / GREATEST(now_epoch - v.sampled_at, 1)
+               + exp(-GREATEST(now_epoch - v.sampled_at, 1) / 21600.0) * v.velocity,
+    engagement = EXCLUDED.engagement,
+    sampled_at = now_epoch;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION fb_posts_engagement_history() RETURNS trigger AS $$
+DECLARE
+  changes JSONB;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT jsonb_agg(jsonb_build_object(
+             'post_id', n.id, 'created_at', n.created_at,
+             'reactions', COALESCE(n.reaction_count, 0),
+             'comments', COALESCE(n.comment_count, 0),
+             'shares', COALESCE(n.share_count, 0),
+             'd_reactions', COALESCE(n.reaction_count, 0),
+             'd_comments', COALESCE(n.comment_count, 0),
+             'd_shares', COALESCE(n.share_count, 0)))
+    INTO changes
+    FROM new_rows n;
+  ELSE
+    SELECT jsonb_agg(jsonb_build_object(
+             'post_id', n.id, 'created_at', n.created_at,
+             'reactions', COALESCE(n.reaction_count, 0),
+             'comments', COALESCE(n.comment_count, 0),
+             'shares', COALESCE(n.share_count, 0),
+             'd_reactions', COALESCE(n.reaction_count, 0) - COALESCE(o.reaction_count, 0),
+             'd_comments', COALESCE(n.comment_count, 0) - COALESCE(o.comment_count, 0),
+             'd_shares', COALESCE(n.share_count, 0) - COALESCE(o.share_count, 0)))
+    INTO changes
+    FROM new_rows n
+    JOIN old_rows o ON o.id = n.id
+    WHERE n.reaction_count IS DISTINCT FROM o.reaction_count
+       OR n.comment_count IS DISTINCT FROM o.comment_count
+       OR n.share_count IS DISTINCT FROM o.share_count;
+  END IF;
+
+  IF changes IS NOT NULL THEN
+    PERFORM fb_posts_record_engagement(EXTRACT(EPOCH FROM NOW())::BIGINT, changes);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_fb_posts_engagement_history_insert ON facebook_posts;
+CREATE TRIGGER trg_fb_posts_engagement_history_insert
+  AFTER INSERT ON facebook_posts
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION fb_posts_engagement_history();
+
+DROP TRIGGER IF EXISTS trg_fb_posts_engagement_history_update ON facebook_posts;
+CREATE TRIGGER trg_fb_posts_engagement_history_update
+  AFTER UPDATE ON facebook_posts
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION fb_posts_engagement_history();
@@ -0,0 +1,87 @@
+"""
+Periodic maintenance of the top-post leaderboards (post_leaderboard).
+
+Triggers on facebook_posts keep the boards current on ingest (see
+init_db.sql), but cannot notice time passing: this job drops entries that aged
+out of the 24h/7d/30d periods, cuts boards back to their size and, every
+--rebuild-interval seconds, recomputes the windowed boards from facebook_posts
+so posts that now qualify (because older leaders expired) move up.
+
+Usage:
+    python leaderboard_job.py --rebuild-all      # initial fill, including the all-time boards
+    python leaderboard_job.py --watch            # trim every minute, rebuild every 15 minutes
+    python leaderboard_job.py --watch --shard 0  # with post shards, one process per shard
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from db import get_db_connection
+from shards import add_shard_argument
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WINDOWED_PERIODS = ('24h', '7d', '30d')
+LEADERBOARD_TRIM_INTERVAL = int(os.getenv('LEADERBOARD_TRIM_INTERVAL', '60'))
+LEADERBOARD_REBUILD_INTERVAL = int(os.getenv('LEADERBOARD_REBUILD_INTERVAL', '900'))
+
+
+def trim(conn):
+    """Drop expired and surplus entries; returns how many expired"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT fb_leaderboard_trim()")
+    expired = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    return expired
+
+
+def rebuild(conn, periods):
+    """Recompute the boards of the given periods, one transaction each"""
+    cursor = conn.cursor()
+    for period in periods:
+        started = time.monotonic()
+        cursor.execute("SELECT fb_leaderboard_rebuild(%s)", (period,))
+        written = cursor.fetchone()[0]
+        conn.commit()
+        logger.info(f"Rebuilt {period} leaderboards: {written} entries in {time.monotonic() - started:.1f}s")
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Expire and refresh the top-post leaderboards")
+    parser.add_argument('--watch', action='store_true', help="keep running instead of a single pass")
+    parser.add_argument('--rebuild-all', action='store_true', help="also rebuild the all-time boards (initial fill)")
+    parser.add_argument('--trim-interval', type=int, default=LEADERBOARD_TRIM_INTERVAL,
+                        help="seconds between trims with --watch")
+    parser.add_argument('--rebuild-interval', type=int, default=LEADERBOARD_REBUILD_INTERVAL,
+                        help="seconds between rebuilds of the 24h/7d/30d boards")
+    add_shard_argument(parser)
+    args = parser.parse_args()
+
+    conn = get_db_connection(pooled=False, shard=args.shard)
+    try:
+        rebuild(conn, WINDOWED_PERIODS + (('all',) if args.rebuild_all else ()))
+        trim(conn)
+        last_rebuild = time.monotonic()
+        while args.watch:
+            time.sleep(args.trim_interval)
+            expired = trim(conn)
+            if expired:
+                logger.info(f"Expired {expired} leaderboard entries")
+            if time.monotonic() - last_rebuild >= args.rebuild_interval:
+                rebuild(conn, WINDOWED_PERIODS)
+                last_rebuild = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
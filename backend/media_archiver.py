@@ -0,0 +1,168 @@
+"""
+Background job that archives attachments into the content-addressed media store.
+
+Every image and video in facebook_attachments without an attachment_media row
+is downloaded once (images are taken from the proxy cache when cache_warmer.py
+already fetched them, which also rescues URLs whose signature has expired since),
+stored under its SHA-256 and mapped in attachment_media. The API then serves
+the archived copy from /api/media/<sha256> instead of the CDN URL. Transient
+download and storage errors are retried with exponential backoff, up to
+ARCHIVE_MAX_ATTEMPTS times.
+
+Usage:
+    python media_archiver.py            # archive all pending attachments, then exit
+    python media_archiver.py --watch    # keep polling for new attachments
+    python media_archiver.py --shard 0  # with post shards, one process per shard
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+from db import get_db_connection
+from image_cache import ImageCache, url_cache_key
+from media_store import download, get_media_store
+from shards import add_shard_argument
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '100'))
+ARCHIVE_WORKERS = int(os.getenv('ARCHIVE_WORKERS', '4'))
+ARCHIVE_MAX_ATTEMPTS = int(os.getenv('ARCHIVE_MAX_ATTEMPTS', '5'))
+# First retry delay in seconds; doubles on every attempt
+ARCHIVE_RETRY_BASE = int(os.getenv('ARCHIVE_RETRY_BASE', '300'))
+
+
+def _from_cache(cache, url):
+    """Copy a cached image into a temp file; returns download()-style tuple or None"""
+    cached = cache.get(url_cache_key(url))
+    if cached is None:
+        return None
+    data, content_type = cached
+    fd, path = tempfile.mkstemp(suffix='.download')
+    with os.fdopen(fd, 'wb') as out:
+        out.write(data)
+    return path, hashlib.sha256(data).hexdigest(), len(data), content_type
+
+
+def archive_url(url, attachment_type, store, cache):
+    """Download and store one attachment; returns (url, status, sha256, size, content_type)"""
+    try:
+        result = _from_cache(cache, url) if attachment_type == 'image' else None
+        path, digest, size, content_type = result or download(url)
+    except urllib.error.HTTPError as e:
+        if e.code == 429 or e.code >= 500:
+            logger.warning(f"Failed to download {url[:120]}: HTTP {e.code}")
+            return url, 'error', None, None, None
+        # Expired signatures and removed files never come back
+        return url, 'unavailable', None, None, None
+    except ValueError as e:
+        logger.warning(f"Skipping {url[:120]}: {e}")
+        return url, 'too_large', None, None, None
+    except Exception as e:
+        logger.warning(f"Failed to download {url[:120]}: {e}")
+        return url, 'error', None, None, None
+    try:
+        store.put_file(digest, path, content_type)
+    except Exception as e:
+        # OSError from the local store, botocore/boto3 errors from S3
+        logger.warning(f"Failed to store {url[:120]}: {e}")
+        return url, 'error', None, None, None
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+    return url, 'ok', digest, size, content_type
+
+
+def process_pending(conn, pool, store, cache, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive one batch of unarchived attachments; returns how many were processed"""
+    cursor = conn.cursor()
+    # Due retries of transient errors first, then attachments never seen
+    cursor.execute("""
+        SELECT attachment_url, attachment_type, attempts FROM (
+            (SELECT am.attachment_url, MIN(fa.attachment_type) AS attachment_type, am.attempts
+             FROM attachment_media am
+             JOIN facebook_attachments fa ON fa.attachment_url = am.attachment_url
+             WHERE am.status = 'error' AND am.next_attempt_at <= NOW()
+             GROUP BY am.attachment_url
+             ORDER BY am.next_attempt_at
+             LIMIT %s)
+            UNION ALL
+            (SELECT fa.attachment_url, MIN(fa.attachment_type), 0
+             FROM facebook_attachments fa
+             LEFT JOIN attachment_media am ON am.attachment_url = fa.attachment_url
+             WHERE fa.attachment_type IN ('image', 'video')
+               AND fa.attachment_url IS NOT NULL
+               AND am.attachment_url IS NULL
+             GROUP BY fa.attachment_url
+             LIMIT %s)
+        ) pending
+        LIMIT %s
+    """, (batch_size, batch_size, batch_size))
+    rows = cursor.fetchall()
+    attempts = {url: tries for url, _, tries in rows}
+
+    stored = failed = 0
+    for url, status, digest, size, content_type in pool.map(lambda r: archive_url(r[0], r[1], store, cache), rows):
+        if status == 'ok':
+            stored += 1
+            cursor.execute(
+                "INSERT INTO media_objects (sha256, content_type, size_bytes) VALUES (%s, %s, %s) "
+                "ON CONFLICT (sha256) DO NOTHING",
+                (digest, content_type, size)
+            )
+            tries, delay = attempts[url], None
+        else:
+            failed += 1
+            tries = attempts[url] + 1
+            delay = ARCHIVE_RETRY_BASE * 2 ** attempts[url] if status == 'error' and tries < ARCHIVE_MAX_ATTEMPTS else None
+        cursor.execute("""
+            INSERT INTO attachment_media (attachment_url, sha256, status, attempts, next_attempt_at)
+            VALUES (%s, %s, %s, %s, NOW() + make_interval(secs => %s))
+            ON CONFLICT (attachment_url) DO UPDATE
+            SET sha256 = EXCLUDED.sha256, status = EXCLUDED.status, attempts = EXCLUDED.attempts,
+                next_attempt_at = EXCLUDED.next_attempt_at, archived_at = NOW()
+            WHERE attachment_media.status = 'error'
+        """, (url, digest, status, tries, delay))
+    conn.commit()
+    cursor.close()
+
+    if rows:
+        logger.info(f"Archived {stored} attachments ({failed} unavailable or failed, transient errors are retried)")
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive attachments into the media store")
+    parser.add_argument('--watch', action='store_true', help="keep polling for new attachments")
+    parser.add_argument('--interval', type=int, default=60, help="seconds between polls with --watch")
+    add_shard_argument(parser)
+    args = parser.parse_args()
+
+    store = get_media_store()
+    cache = ImageCache()
+    conn = get_db_connection(shard=args.shard)
+    try:
+        with ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS) as pool:
+            while True:
+                while process_pending(conn, pool, store, cache):
+                    pass
+                if not args.watch:
+                    break
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
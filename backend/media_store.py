@@ -0,0 +1,157 @@
+"""
+Permanent, content-addressed storage for archived attachments.
+
+Every object is stored once under its SHA-256 digest, so the same image or
+video attached to many posts takes the space of one copy, and a digest URL
+(/api/media/<sha256>) never changes content and can be cached forever.
+
+Backends: a local directory (MEDIA_STORE=filesystem, the default) or an
+S3-compatible bucket (MEDIA_STORE=s3, requires boto3; MEDIA_S3_ENDPOINT points
+it at MinIO or another stand-in).
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import urllib.request
+
+from image_cache import UPSTREAM_HEADERS
+
+MEDIA_STORE = os.getenv('MEDIA_STORE', 'filesystem').lower()
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media'))
+MEDIA_S3_BUCKET = os.getenv('MEDIA_S3_BUCKET', '')
+MEDIA_S3_PREFIX = os.getenv('MEDIA_S3_PREFIX', 'media/')
+MEDIA_S3_ENDPOINT = os.getenv('MEDIA_S3_ENDPOINT') or None
+# Larger downloads are abandoned (videos can be big)
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', str(500 * 1024 * 1024)))
+MEDIA_URL_PREFIX = '/api/media'
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+CHUNK_SIZE = 256 * 1024
+
+
+def media_url(digest):
+    """Stable API URL of a stored object"""
+    return f"{MEDIA_URL_PREFIX}/{digest}"
+
+
+def _object_key(digest):
+    return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+def download(url, directory=None, max_bytes=MEDIA_MAX_BYTES, timeout=30):
+    """Stream url into a temp file while hashing it.
+
+    Returns (path, sha256, size, content_type); the caller removes the file.
+    Raises urllib errors, or ValueError when the body exceeds max_bytes.
+    """
+    headers = dict(UPSTREAM_HEADERS, Accept='*/*')
+    req = urllib.request.Request(url, headers=headers)
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.download')
+    try:
+        with os.fdopen(fd, 'wb') as out, urllib.request.urlopen(req, timeout=timeout) as resp:
+            content_type = resp.headers.get('Content-Type', 'application/octet-stream').split(';')[0].strip()
+            while True:
+                chunk = resp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"download exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, digest.hexdigest(), size, content_type
+
+
+class FilesystemMediaStore:
+    """Objects under <root>/<aa>/<bb>/<sha256>"""
+
+    def __init__(self, root=MEDIA_ROOT):
+        self.root = root
+
+    def local_path(self, digest):
+        return os.path.join(self.root, _object_key(digest))
+
+    def exists(self, digest):
+        return os.path.exists(self.local_path(digest))
+
+    def put_file(self, digest, path, content_type):
+        """Move a downloaded file into place (no-op when the digest is already stored)"""
+        target = self.local_path(digest)
+        if os.path.exists(target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{os.getpid()}.tmp"
+        shutil.move(path, tmp)
+        os.replace(tmp, target)
+
+    def open(self, digest, chunk_size=CHUNK_SIZE):
+        """(chunk iterator, size) of a stored object"""
+        path = self.local_path(digest)
+        size = os.path.getsize(path)
+
+        def chunks():
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        return chunks(), size
+
+
+class S3MediaStore:
+    """Objects under s3://<bucket>/<prefix><aa>/<bb>/<sha256>"""
+
+    def __init__(self, bucket=MEDIA_S3_BUCKET, prefix=MEDIA_S3_PREFIX, endpoint_url=MEDIA_S3_ENDPOINT):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def _key(self, digest):
+        return self.prefix + _object_key(digest)
+
+    def local_path(self, digest):
+        return None
+
+    def exists(self, digest):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(digest))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put_file(self, digest, path, content_type):
+        if self.exists(digest):
+            os.unlink(path)
+            return
+        self.client.upload_file(path, self.bucket, self._key(digest), ExtraArgs={
+            'ContentType': content_type,
+            'CacheControl': 'public, max-age=31536000, immutable',
+        })
+        os.unlink(path)
+
+    def open(self, digest, chunk_size=CHUNK_SIZE):
+        obj = self.client.get_object(Bucket=self.bucket, Key=self._key(digest))
+        return obj['Body'].iter_chunks(chunk_size), obj['ContentLength']
+
+
+def get_media_store():
+    """Backend selected by MEDIA_STORE"""
+    if MEDIA_STORE == 's3':
+        return S3MediaStore()
+    return FilesystemMediaStore()
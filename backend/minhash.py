@@ -0,0 +1,73 @@
+"""
+MinHash signatures and LSH banding for near-duplicate post detection.
+
+A post's text is normalized and split into character shingles; the signature
+is the minimum of NUM_PERM universal hash permutations over the shingle
+hashes. Signatures are cut into LSH_BANDS bands of LSH_ROWS values, and two
+posts become candidates when any band hashes identically, so finding the
+duplicates of a new post is an index lookup rather than a table scan.
+"""
+
+import hashlib
+import re
+import zlib
+
+import numpy as np
+
+NUM_PERM = 128
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+# Character shingle length
+SHINGLE_SIZE = 5
+
+# Universal hashing (a*x + b) mod p over 32-bit shingle hashes x, with p the
+# smallest prime above 2^32 and a, b < 2^32: a*x < 2^64 fits in uint64, and it
+# is reduced mod p before b is added so the sum cannot wrap either
+_PRIME = np.uint64(4294967311)
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(1, 2 ** 32, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 2 ** 32, size=NUM_PERM, dtype=np.uint64)
+
+_URL_RE = re.compile(r'https?://\S+')
+_NON_WORD_RE = re.compile(r'[^\w]+', re.UNICODE)
+
+
+def normalize_text(text):
+    """Lowercase, drop URLs and punctuation, collapse whitespace"""
+    text = _URL_RE.sub(' ', (text or '').lower())
+    return ' '.join(_NON_WORD_RE.sub(' ', text).split())
+
+
+def shingle_hashes(text):
+    """32-bit hashes of the distinct character shingles of normalized text"""
+    text = normalize_text(text)
+    if len(text) < SHINGLE_SIZE:
+        return np.empty(0, dtype=np.uint64)
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def signature(text):
+    """MinHash signature as an int32 array, or None when the text is too short to compare"""
+    hashes = shingle_hashes(text)
+    if hashes.size == 0:
+        return None
+    permuted = (_PERM_A[:, None] * hashes[None, :] % _PRIME + _PERM_B[:, None]) % _PRIME
+    # Values in [2^32, p) fold onto the low 32 bits
+    mins = permuted.min(axis=1) & np.uint64(0xFFFFFFFF)
+    # Postgres has no unsigned int; reinterpret the 32-bit values as signed
+    return mins.astype(np.uint32).view(np.int32)
+
+
+def band_hashes(sig):
+    """One signed 64-bit hash per LSH band of a signature"""
+    bands = np.asarray(sig, dtype=np.int32).reshape(LSH_BANDS, LSH_ROWS)
+    return [
+        int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), 'big', signed=True)
+        for band in bands
+    ]
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.mean(np.asarray(sig_a) == np.asarray(sig_b)))
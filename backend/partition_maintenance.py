@@ -0,0 +1,203 @@
+"""
+Scheduled maintenance for the monthly partitions of facebook_posts.
+
+Creates the partitions for the coming months (so new posts never fall into the
+default partition) and, with --retain-months, detaches the months older than
+the retention window. Detaching is a catalog change instead of a bulk DELETE;
+the detached tables stay in the database for archiving until dropped (--drop).
+Detaching subtracts the partition's posts from the author stats and releases
+their post_urls exactly once, tracked in retired_post_partitions, so a run
+that stopped halfway is completed by the next one.
+
+Run daily from cron, after partition_posts.sql has been applied:
+    python partition_maintenance.py --months-ahead 3 --retain-months 24
+With post shards, run it once per shard with --shard N.
+"""
+
+import argparse
+import logging
+import re
+import sys
+from datetime import date
+
+from db import get_db_connection
+from shards import add_shard_argument
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME_RE = re.compile(r'^facebook_posts_p(\d{4})(\d{2})$')
+
+# Author stats are maintained by row triggers, which a detach does not fire
+AUTHOR_STATS_ADJUST = """
+    UPDATE authors a
+    SET post_count = a.post_count - s.posts,
+        total_engagement = a.total_engagement - s.engagement
+    FROM (
+        SELECT author_id,
+               COUNT(*) AS posts,
+               SUM(COALESCE(reaction_count, 0) + COALESCE(comment_count, 0) + COALESCE(share_count, 0)) AS engagement
+        FROM {table}
+        WHERE author_id IS NOT NULL
+        GROUP BY author_id
+    ) s
+    WHERE a.id = s.author_id
+"""
+
+# Detached posts no longer hold their url (see post_urls in init_db.sql)
+POST_URLS_RELEASE = """
+    DELETE FROM post_urls p
+    USING {table} d
+    WHERE p.post_url = d.post_url AND p.created_at = d.created_at
+"""
+
+
+def ensure_partitions(conn, months_ahead):
+    """Create missing partitions through months_ahead; returns the created names"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT fb_posts_ensure_partitions(%s)", (months_ahead,))
+    created = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    cursor.close()
+    return created
+
+
+def list_partitions(conn):
+    """(name, first day of month) of every monthly partition, oldest first"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'facebook_posts'::regclass
+    """)
+    partitions = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    cursor.close()
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def _has_default_partition(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT partdefid <> 0 FROM pg_partitioned_table WHERE partrelid = 'facebook_posts'::regclass")
+    row = cursor.fetchone()
+    cursor.close()
+    return bool(row and row[0])
+
+
+def _finish_retired(conn, name, drop):
+    """Subtract a detached partition's posts from the author stats and post_urls (once) and optionally drop it, in one transaction"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE retired_post_partitions
+        SET detached_at = COALESCE(detached_at, NOW()), stats_adjusted_at = NOW()
+        WHERE partition_name = %s AND stats_adjusted_at IS NULL
+    """, (name,))
+    if cursor.rowcount:
+        cursor.execute(AUTHOR_STATS_ADJUST.format(table=f'"{name}"'))
+        cursor.execute(POST_URLS_RELEASE.format(table=f'"{name}"'))
+    if drop:
+        cursor.execute(f'DROP TABLE IF EXISTS "{name}"')
+    conn.commit()
+    cursor.close()
+
+
+def detach_partition(conn, name, drop=False):
+    """Detach one partition and adjust author stats.
+
+    Postgres 14+ detaches CONCURRENTLY, without blocking scraper writes, unless
+    facebook_posts has a DEFAULT partition (which CONCURRENTLY rejects).
+    CONCURRENTLY cannot run inside a transaction, so the stats adjustment
+    commits separately; finish_interrupted() completes it if the run stops in
+    between. Otherwise detach, adjustment and drop commit together.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO retired_post_partitions (partition_name) VALUES (%s) ON CONFLICT DO NOTHING", (name,)
+    )
+    if conn.server_version >= 140000 and not _has_default_partition(conn):
+        conn.commit()
+        conn.autocommit = True
+        try:
+            cursor.execute(f'ALTER TABLE facebook_posts DETACH PARTITION "{name}" CONCURRENTLY')
+        finally:
+            conn.autocommit = False
+    else:
+        cursor.execute(f'ALTER TABLE facebook_posts DETACH PARTITION "{name}"')
+    cursor.close()
+    _finish_retired(conn, name, drop)
+
+
+def finish_interrupted(conn, drop=False):
+    """Complete detaches an earlier run started but did not finish; returns their names"""
+    cursor = conn.cursor()
+    if conn.server_version >= 140000:
+        # A CONCURRENTLY detach that was cancelled leaves the partition pending
+        cursor.execute("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'facebook_posts'::regclass AND i.inhdetachpending
+        """)
+        pending = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        for name in pending:
+            conn.autocommit = True
+            try:
+                cursor.execute(f'ALTER TABLE facebook_posts DETACH PARTITION "{name}" FINALIZE')
+            finally:
+                conn.autocommit = False
+    # Recorded as retired, no longer attached, stats not adjusted yet
+    cursor.execute("""
+        SELECT r.partition_name
+        FROM retired_post_partitions r
+        WHERE r.stats_adjusted_at IS NULL
+          AND to_regclass(quote_ident(r.partition_name)) IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_inherits i
+              WHERE i.inhrelid = to_regclass(quote_ident(r.partition_name))
+                AND i.inhparent = 'facebook_posts'::regclass
+          )
+    """)
+    names = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    conn.commit()
+    for name in names:
+        _finish_retired(conn, name, drop)
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create and retire monthly facebook_posts partitions")
+    parser.add_argument('--months-ahead', type=int, default=3, help="create partitions this many months ahead")
+    parser.add_argument('--retain-months', type=int, help="detach partitions older than this many months")
+    parser.add_argument('--drop', action='store_true', help="drop partitions after detaching them")
+    add_shard_argument(parser)
+    args = parser.parse_args()
+
+    conn = get_db_connection(shard=args.shard)
+    try:
+        created = ensure_partitions(conn, args.months_ahead)
+        if created:
+            logger.info(f"Created partitions: {', '.join(created)}")
+
+        if args.retain_months:
+            for name in finish_interrupted(conn, drop=args.drop):
+                logger.info(f"Completed the interrupted retirement of partition {name}")
+            today = date.today()
+            months = today.year * 12 + today.month - 1 - args.retain_months
+            cutoff = date(months // 12, months % 12 + 1, 1)
+            for name, month in list_partitions(conn):
+                if month < cutoff:
+                    detach_partition(conn, name, drop=args.drop)
+                    logger.info(f"{'Dropped' if args.drop else 'Detached'} partition {name}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+-- One-off migration: convert facebook_posts into a table range-partitioned by
+-- month on created_at (BIGINT epoch seconds, UTC month boundaries).
+--
+-- Run after init_db.sql (it defines fb_posts_ensure_partitions), then run
+-- init_db.sql again to recreate the triggers and indexes on the new table:
+--
+--   psql -d facebook_aggregator -f init_db.sql
+--   psql -d facebook_aggregator -f partition_posts.sql
+--   psql -d facebook_aggregator -f init_db.sql
+--
+-- Scraper writes block until the migration commits; reads keep working. The
+-- old table is kept as facebook_posts_unpartitioned for rollback and can be
+-- dropped once the new table is verified.
+--
+-- Unique constraints on a partitioned table must include the partition key,
+-- so the unique index becomes (post_url, created_at): scrapers that upsert
+-- with ON CONFLICT (post_url) must use ON CONFLICT (post_url, created_at).
+-- post_url alone stays unique through the post_urls table, which init_db.sql
+-- creates and maintains by trigger once facebook_posts is partitioned: a post
+-- scraped again with a corrected created_at is rejected instead of inserted a
+-- second time, so timestamp corrections have to UPDATE the existing row.
+-- Assumes id is a serial/bigserial column; its sequence is carried over.
+
+BEGIN;
+
+LOCK TABLE facebook_posts IN EXCLUSIVE MODE;
+
+CREATE TABLE facebook_posts_partitioned (
+  LIKE facebook_posts INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE
+) PARTITION BY RANGE (created_at);
+
+-- Rows outside every monthly partition (or with a NULL created_at) land here
+CREATE TABLE facebook_posts_default PARTITION OF facebook_posts_partitioned DEFAULT;
+
+-- Free the index names so init_db.sql recreates them on the new table
+DO $$
+DECLARE
+  idx RECORD;
+BEGIN
+  FOR idx IN
+    SELECT c.relname
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE i.indrelid = 'facebook_posts'::regclass
+  LOOP
+    EXECUTE format('ALTER INDEX %I RENAME TO %I', idx.relname, left('unpartitioned_' || idx.relname, 63));
+  END LOOP;
+END;
+$$;
+
+ALTER TABLE facebook_posts RENAME TO facebook_posts_unpartitioned;
+ALTER TABLE facebook_posts_partitioned RENAME TO facebook_posts;
+
+-- Monthly partitions from the oldest post through three months ahead
+SELECT fb_posts_ensure_partitions(
+  3,
+  (SELECT (to_timestamp(MIN(created_at)) AT TIME ZONE 'UTC')::date FROM facebook_posts_unpartitioned)
+);
+
+INSERT INTO facebook_posts SELECT * FROM facebook_posts_unpartitioned;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_facebook_posts_id ON facebook_posts(id, created_at);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_facebook_posts_post_url ON facebook_posts(post_url, created_at);
+CREATE INDEX IF NOT EXISTS idx_facebook_posts_url ON facebook_posts(post_url);
+
+-- fb_leaderboard_offer_posts(facebook_posts[]) is bound to the old table's row
+-- type; init_db.sql recreates it for the new table, so dropping the old table
+-- later does not need CASCADE
+DROP FUNCTION IF EXISTS fb_leaderboard_offer_posts(facebook_posts_unpartitioned[]);
+
+-- Keep the id sequence alive when the old table is dropped
+DO $$
+DECLARE
+  seq TEXT := pg_get_serial_sequence('facebook_posts_unpartitioned', 'id');
+BEGIN
+  IF seq IS NOT NULL THEN
+    EXECUTE format('ALTER SEQUENCE %s OWNED BY facebook_posts.id', seq);
+  END IF;
+END;
+$$;
+
+COMMIT;
+
+ANALYZE facebook_posts;
@@ -0,0 +1,71 @@
+"""
+Perceptual hashes (pHash) for attachment images.
+
+An image is reduced to 32x32 grayscale, transformed with a 2-D DCT, and the
+8x8 lowest-frequency coefficients are thresholded at their median into a
+64-bit hash. Re-encoded, resized or re-signed copies of the same picture land
+within a few bits of each other.
+
+The hash is split into PHASH_BANDS 16-bit bands for lookup: two hashes within
+Hamming distance PHASH_BANDS - 1 must agree on at least one band (pigeonhole),
+so matching is an equality lookup on indexed band columns followed by an exact
+distance check on the few candidates.
+"""
+
+import io
+
+import numpy as np
+
+PHASH_SIZE = 32
+PHASH_LOW_FREQ = 8
+PHASH_BANDS = 4
+PHASH_BAND_BITS = 64 // PHASH_BANDS
+# Largest distance the band index is guaranteed to find
+PHASH_MAX_DISTANCE = PHASH_BANDS - 1
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def phash(data):
+    """64-bit perceptual hash of encoded image bytes, as a signed int (fits BIGINT)"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert('L').resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS)
+        pixels = np.asarray(img, dtype=np.float64)
+    coefficients = (_DCT @ pixels @ _DCT.T)[:PHASH_LOW_FREQ, :PHASH_LOW_FREQ].flatten()
+    # Skip the DC term when picking the threshold; it only reflects overall brightness
+    bits = coefficients > np.median(coefficients[1:])
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def bands(value):
+    """Split a hash into PHASH_BANDS signed 16-bit values (SMALLINT columns)"""
+    unsigned = value & 0xFFFFFFFFFFFFFFFF
+    mask = (1 << PHASH_BAND_BITS) - 1
+    result = []
+    for i in range(PHASH_BANDS):
+        band = (unsigned >> (PHASH_BAND_BITS * (PHASH_BANDS - 1 - i))) & mask
+        result.append(band - (1 << PHASH_BAND_BITS) if band >= (1 << (PHASH_BAND_BITS - 1)) else band)
+    return result
+
+
+def distance(a, b):
+    """Hamming distance between two hashes"""
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count('1')
+
+
+# SQL expression for the Hamming distance between two BIGINT hashes
+DISTANCE_SQL = "length(replace((({a}) # ({b}))::bit(64)::text, '0', ''))"
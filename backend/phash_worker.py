@@ -0,0 +1,180 @@
+"""
+Background job that computes perceptual hashes for image attachments.
+
+Every image in facebook_attachments without an attachment_phash row is
+downloaded (a bounded thread pool), hashed, and assigned to the cluster of its
+nearest already-hashed image within PHASH_MATCH_DISTANCE bits (or starts a new
+cluster). The downloaded bytes are also written to the image proxy cache under
+the cluster key, so the proxy keeps one copy per visually identical image.
+Transient fetch errors are retried with exponential backoff, up to
+PHASH_MAX_ATTEMPTS times.
+
+Usage:
+    python phash_worker.py            # hash all pending images, then exit
+    python phash_worker.py --watch    # keep polling for new attachments
+    python phash_worker.py --shard 0  # with post shards, one process per shard
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+from db import get_db_connection
+from image_cache import ImageCache, cluster_cache_key, fetch_image
+from phash import DISTANCE_SQL, PHASH_MAX_DISTANCE, bands, phash
+from shards import add_shard_argument
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PHASH_BATCH_SIZE = int(os.getenv('PHASH_BATCH_SIZE', '200'))
+PHASH_FETCH_WORKERS = int(os.getenv('PHASH_FETCH_WORKERS', '8'))
+# Images within this many differing bits share a cluster (capped by the band index)
+PHASH_MATCH_DISTANCE = min(int(os.getenv('PHASH_MATCH_DISTANCE', '3')), PHASH_MAX_DISTANCE)
+# Also store downloaded images in the proxy cache
+PHASH_WARM_CACHE = os.getenv('PHASH_WARM_CACHE', 'true').lower() == 'true'
+PHASH_MAX_ATTEMPTS = int(os.getenv('PHASH_MAX_ATTEMPTS', '5'))
+# First retry delay in seconds; doubles on every attempt
+PHASH_RETRY_BASE = int(os.getenv('PHASH_RETRY_BASE', '300'))
+
+NEAREST_QUERY = f"""
+    SELECT cluster_id, {DISTANCE_SQL.format(a='phash', b='%(phash)s::bigint')} AS distance
+    FROM attachment_phash
+    WHERE status = 'ok'
+      AND (band0 = %(b0)s OR band1 = %(b1)s OR band2 = %(b2)s OR band3 = %(b3)s)
+      AND {DISTANCE_SQL.format(a='phash', b='%(phash)s::bigint')} <= %(max_distance)s
+    ORDER BY distance, id
+    LIMIT 1
+"""
+
+
+def _hash_url(url):
+    """Download and hash one image; returns (url, status, hash, data, content_type)"""
+    try:
+        data, content_type = fetch_image(url)
+    except urllib.error.HTTPError as e:
+        if e.code == 429 or e.code >= 500:
+            logger.warning(f"Failed to fetch {url[:120]}: HTTP {e.code}")
+            return url, 'error', None, None, None
+        # Expired signatures and removed images never come back
+        return url, 'unavailable', None, None, None
+    except Exception as e:
+        logger.warning(f"Failed to fetch {url[:120]}: {e}")
+        return url, 'error', None, None, None
+    try:
+        return url, 'ok', phash(data), data, content_type
+    except Exception as e:
+        logger.warning(f"Failed to decode {url[:120]}: {e}")
+        return url, 'invalid', None, None, None
+
+
+def index_image(cursor, url, value):
+    """Insert the hash of one image; returns its cluster id"""
+    b0, b1, b2, b3 = bands(value)
+    cursor.execute(NEAREST_QUERY, {
+        'phash': value, 'b0': b0, 'b1': b1, 'b2': b2, 'b3': b3,
+        'max_distance': PHASH_MATCH_DISTANCE,
+    })
+    nearest = cursor.fetchone()
+    cursor.execute("SELECT nextval(pg_get_serial_sequence('attachment_phash', 'id'))")
+    row_id = cursor.fetchone()[0]
+    cluster_id = nearest[0] if nearest else row_id
+    cursor.execute("""
+        INSERT INTO attachment_phash (id, attachment_url, phash, band0, band1, band2, band3, cluster_id, status)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'ok')
+        ON CONFLICT (attachment_url) DO NOTHING
+    """, (row_id, url, value, b0, b1, b2, b3, cluster_id))
+    return cluster_id
+
+
+def process_pending(conn, pool, cache=None, batch_size=PHASH_BATCH_SIZE, shard=None):
+    """Hash one batch of unindexed image attachments; returns how many were processed
+
+    shard is the post shard conn is on; cluster ids are only unique within it.
+    """
+    cursor = conn.cursor()
+    # Due retries of transient errors first, then images never seen
+    cursor.execute("""
+        SELECT attachment_url, attempts FROM (
+            (SELECT attachment_url, attempts
+             FROM attachment_phash
+             WHERE status = 'error' AND next_attempt_at <= NOW()
+             ORDER BY next_attempt_at
+             LIMIT %s)
+            UNION ALL
+            (SELECT DISTINCT fa.attachment_url, 0
+             FROM facebook_attachments fa
+             LEFT JOIN attachment_phash ap ON ap.attachment_url = fa.attachment_url
+             WHERE fa.attachment_type = 'image'
+               AND fa.attachment_url IS NOT NULL
+               AND ap.id IS NULL
+             LIMIT %s)
+        ) pending
+        LIMIT %s
+    """, (batch_size, batch_size, batch_size))
+    rows = cursor.fetchall()
+    urls = [row[0] for row in rows]
+    attempts = dict(rows)
+
+    clustered = failed = 0
+    for url, status, value, data, content_type in pool.map(_hash_url, urls):
+        if status != 'ok':
+            failed += 1
+            tries = attempts[url] + 1
+            delay = PHASH_RETRY_BASE * 2 ** attempts[url] if status == 'error' and tries < PHASH_MAX_ATTEMPTS else None
+            cursor.execute("""
+                INSERT INTO attachment_phash (attachment_url, status, attempts, next_attempt_at)
+                VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+                ON CONFLICT (attachment_url) DO UPDATE
+                SET status = EXCLUDED.status, attempts = EXCLUDED.attempts,
+                    next_attempt_at = EXCLUDED.next_attempt_at, computed_at = NOW()
+                WHERE attachment_phash.status = 'error'
+            """, (url, status, tries, delay))
+            continue
+        if attempts[url]:
+            # Replaced by a hashed row (and its own cluster)
+            cursor.execute("DELETE FROM attachment_phash WHERE attachment_url = %s AND status = 'error'", (url,))
+        cluster_id = index_image(cursor, url, value)
+        if cache is not None:
+            key = cluster_cache_key(cluster_id, shard)
+            if not cache.contains(key):
+                cache.put(key, data, content_type)
+        clustered += 1
+    conn.commit()
+    cursor.close()
+
+    if urls:
+        logger.info(f"Hashed {clustered} images ({failed} failed, transient errors are retried)")
+    return len(urls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute perceptual hashes for image attachments")
+    parser.add_argument('--watch', action='store_true', help="keep polling for new attachments")
+    parser.add_argument('--interval', type=int, default=60, help="seconds between polls with --watch")
+    add_shard_argument(parser)
+    args = parser.parse_args()
+
+    cache = ImageCache() if PHASH_WARM_CACHE else None
+    conn = get_db_connection(shard=args.shard)
+    try:
+        with ThreadPoolExecutor(max_workers=PHASH_FETCH_WORKERS) as pool:
+            while True:
+                while process_pending(conn, pool, cache, shard=args.shard):
+                    pass
+                if not args.watch:
+                    break
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
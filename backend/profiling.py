@@ -0,0 +1,272 @@
+"""
+Opt-in profiling of single requests for admins.
+
+A request carrying the X-Profile: 1 header (or ?profile=1) from an admin user
+runs under cProfile and tracemalloc. The profile is finished when the response
+has been sent, so streamed exports include the writer and compression time.
+The pstats dump (open it with `python -m pstats` or snakeviz) and a JSON
+summary are stored in PROFILE_DIR under the id returned in the X-Profile-Id
+response header. The summary holds the top functions by cumulative time, the
+top allocation sites still held when the request ended, and the peak traced memory.
+Status lives on disk, as for export jobs, so any gunicorn worker can list and
+serve the profiles of every other.
+
+At most PROFILE_MAX_CONCURRENT requests per process are profiled at a time.
+Requests over the cap run unprofiled and get X-Profile-Status: busy.
+tracemalloc traces the whole process, so with a cap above 1 the allocation
+sites of overlapping profiles include each other's allocations. Only the
+request thread is profiled, so background export jobs have to be profiled in
+their worker process.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'true').lower() == 'true'
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'fb_profiles'))
+PROFILE_MAX_CONCURRENT = int(os.getenv('PROFILE_MAX_CONCURRENT', '1'))
+# Most recent profiles kept on disk (older ones are deleted when a new one is stored)
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
+# Stack depth recorded per allocation (deeper is slower)
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', '10'))
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_TOP_ALLOCATIONS = 25
+
+# Query parameters never written to a profile summary
+_SECRET_PARAMS = ('jwt',)
+
+_PROFILE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+_lock = threading.Lock()
+_active = 0
+_started_tracemalloc = False
+stats = {'profiled': 0, 'busy': 0, 'denied': 0}
+
+
+def _summary_path(profile_id):
+    return os.path.join(PROFILE_DIR, f"{profile_id}.json")
+
+
+def dump_path(profile_id):
+    return os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+
+
+def _requested():
+    value = request.headers.get('X-Profile') or request.args.get('profile') or ''
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def _acquire():
+    """Take a profiling slot and make sure tracemalloc is running; False when at the cap"""
+    global _active, _started_tracemalloc
+    with _lock:
+        if _active >= PROFILE_MAX_CONCURRENT:
+            return False
+        _active += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            _started_tracemalloc = True
+        elif _active == 1:
+            tracemalloc.reset_peak()
+        return True
+
+
+def _release():
+    """Give the slot back; stops tracemalloc with the last profile if we started it"""
+    global _active, _started_tracemalloc
+    with _lock:
+        _active -= 1
+        if _active == 0 and _started_tracemalloc:
+            tracemalloc.stop()
+            _started_tracemalloc = False
+
+
+def _top_functions(profiler):
+    profile_stats = pstats.Stats(profiler)
+    functions = []
+    for (filename, line, name), (calls, primitive, tottime, cumtime, _) in profile_stats.stats.items():
+        functions.append({
+            'function': f"{filename}:{line}({name})",
+            'calls': calls,
+            'primitive_calls': primitive,
+            'total_ms': round(tottime * 1000, 3),
+            'cumulative_ms': round(cumtime * 1000, 3),
+        })
+    functions.sort(key=lambda f: -f['cumulative_ms'])
+    return functions[:PROFILE_TOP_FUNCTIONS]
+
+
+def _top_allocations(snapshot, baseline):
+    """Allocation sites that grew during the request, largest first"""
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    allocations = []
+    for stat in snapshot.compare_to(baseline, 'traceback')[:PROFILE_TOP_ALLOCATIONS]:
+        if stat.size_diff <= 0:
+            break
+        allocations.append({
+            'size_kb': round(stat.size_diff / 1024, 1),
+            'count': stat.count_diff,
+            'traceback': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+        })
+    return allocations
+
+
+def _summaries():
+    """Directory entries of the stored summaries, newest first"""
+    def mtime(entry):
+        try:
+            return entry.stat().st_mtime
+        except OSError:  # pruned by another worker meanwhile
+            return 0
+    try:
+        entries = [entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith('.json')]
+    except OSError:
+        return []
+    entries.sort(key=mtime, reverse=True)
+    return entries
+
+
+def _prune():
+    """Delete all but the PROFILE_KEEP most recent profiles"""
+    for entry in _summaries()[PROFILE_KEEP:]:
+        profile_id = entry.name[:-len('.json')]
+        for path in (entry.path, dump_path(profile_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _finish(state, status_code):
+    """Stop profiling a request and store its dump and summary"""
+    try:
+        state['profiler'].disable()
+        duration = time.monotonic() - state['started']
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        summary = dict(state['summary'], **{
+            'status_code': status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'peak_traced_kb': round(peak / 1024, 1),
+            'functions': _top_functions(state['profiler']),
+            'allocations': _top_allocations(snapshot, state['baseline']),
+        })
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        state['profiler'].dump_stats(dump_path(state['id']))
+        tmp_path = f"{_summary_path(state['id'])}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f)
+        os.replace(tmp_path, _summary_path(state['id']))
+        _prune()
+        logger.info(f"Stored profile {state['id']} of {summary['method']} {summary['path']} "
+                    f"({summary['duration_ms']}ms)")
+    except Exception as e:
+        logger.error(f"Storing profile failed: {e}")
+    finally:
+        _release()
+
+
+def get_profile(profile_id):
+    """Return a stored profile summary, or None if the id is unknown or malformed"""
+    if not _PROFILE_ID_RE.match(profile_id or ''):
+        return None
+    try:
+        with open(_summary_path(profile_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def list_profiles(limit=50):
+    """Stored profiles, newest first, without the function and allocation tables"""
+    profiles = []
+    for entry in _summaries()[:limit]:
+        summary = get_profile(entry.name[:-len('.json')])
+        if summary:
+            summary.pop('functions', None)
+            summary.pop('allocations', None)
+            profiles.append(summary)
+    return profiles
+
+
+def init_profiling(app, is_admin):
+    """Profile requests that ask for it; is_admin(identity) decides who may"""
+    if not PROFILING_ENABLED:
+        return
+    from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+    @app.before_request
+    def _start_profile():
+        if not _requested():
+            return
+        try:
+            verify_jwt_in_request(locations=['headers', 'query_string'])
+            identity = get_jwt_identity()
+        except Exception:
+            # The route's own @jwt_required answers unauthenticated requests
+            return
+        if not is_admin(identity):
+            stats['denied'] += 1
+            g.profile_status = 'denied'
+            return
+        if not _acquire():
+            stats['busy'] += 1
+            g.profile_status = 'busy'
+            return
+        stats['profiled'] += 1
+        query = {k: v for k, v in request.args.items() if k not in _SECRET_PARAMS}
+        state = {
+            'id': uuid.uuid4().hex,
+            'started': time.monotonic(),
+            'baseline': tracemalloc.take_snapshot(),
+            'profiler': cProfile.Profile(),
+            'summary': {
+                'method': request.method,
+                'path': request.path,
+                'query': query,
+                'user': identity,
+                'started_at': time.time(),
+            },
+        }
+        state['summary']['id'] = state['id']
+        try:
+            state['profiler'].enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler per process
+            _release()
+            stats['busy'] += 1
+            g.profile_status = 'busy'
+            return
+        g.profile = state
+
+    @app.after_request
+    def _attach_profile(response):
+        state = g.pop('profile', None)
+        if state is None:
+            if 'profile_status' in g:
+                response.headers['X-Profile-Status'] = g.profile_status
+            return response
+        response.headers['X-Profile-Id'] = state['id']
+        # Streamed bodies are produced after this hook; finish once the response is closed
+        response.call_on_close(lambda: _finish(state, response.status_code))
+        return response
+
+    @app.teardown_request
+    def _finish_unsent_profile(exc):
+        # after_request did not run (the request failed before a response existed)
+        state = g.pop('profile', None)
+        if state is not None:
+            _finish(state, 500)
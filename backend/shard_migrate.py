@@ -0,0 +1,144 @@
+"""
+Split the posts of the primary database (DB_CONFIG) across the shards in
+DB_SHARD_DSNS, or check that every shard only holds posts of its own groups.
+
+Each shard needs the primary's schema first, e.g.:
+    pg_dump --schema-only -t facebook_posts -t facebook_attachments "$PRIMARY_URL" | psql "$SHARD_URL"
+    psql "$SHARD_URL" -f init_db.sql
+
+--copy streams each shard's posts and their attachments with COPY through a
+temporary file, so the triggers from init_db.sql fill the derived tables
+(authors, media summary, leaderboards, ...) on the shard. Shards that already
+hold posts are skipped. The primary is left untouched; run the workers once per
+shard with --shard N (dedupe_worker.py, phash_worker.py, media_archiver.py,
+cache_warmer.py, leaderboard_job.py, partition_maintenance.py).
+
+Usage:
+    python shard_migrate.py --copy
+    python shard_migrate.py --check     # exit status 1 when posts sit on the wrong shard
+"""
+
+import argparse
+import logging
+import sys
+import tempfile
+import time
+
+from db import DB_SHARD_DSNS, get_db_connection
+from shards import SHARD_COUNT, SHARD_SQL
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SHARD_OF_POST = SHARD_SQL.format(count=SHARD_COUNT or 1)
+
+
+def _columns(conn, table):
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        ORDER BY ordinal_position
+    """, (table,))
+    columns = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return columns
+
+
+def _copy(source, target, table, select, columns):
+    """COPY the rows of select (over the given columns) from source into table on target"""
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    with tempfile.TemporaryFile() as buffer:
+        cursor = source.cursor()
+        cursor.copy_expert(f"COPY ({select}) TO STDOUT", buffer)
+        cursor.close()
+        buffer.seek(0)
+        cursor = target.cursor()
+        cursor.copy_expert(f"COPY {table} ({column_list}) FROM STDIN", buffer)
+        copied = cursor.rowcount
+        cursor.close()
+    return copied
+
+
+def copy_to_shards():
+    source = get_db_connection(readonly=True, pooled=False)
+    # One snapshot for every shard's copy
+    source.set_session(readonly=True, isolation_level='REPEATABLE READ')
+    try:
+        post_columns = _columns(source, 'facebook_posts')
+        attachment_columns = _columns(source, 'facebook_attachments')
+        for shard in range(SHARD_COUNT):
+            target = get_db_connection(pooled=False, shard=shard)
+            try:
+                cursor = target.cursor()
+                cursor.execute("SELECT EXISTS (SELECT 1 FROM facebook_posts)")
+                if cursor.fetchone()[0]:
+                    logger.warning(f"Shard {shard} already holds posts, skipping")
+                    target.rollback()
+                    continue
+                started = time.monotonic()
+                posts = _copy(source, target, 'facebook_posts', f"""
+                    SELECT {', '.join(f'fp."{column}"' for column in post_columns)}
+                    FROM facebook_posts fp
+                    WHERE {SHARD_OF_POST} = {shard}
+                """, post_columns)
+                attachments = _copy(source, target, 'facebook_attachments', f"""
+                    SELECT {', '.join(f'fa."{column}"' for column in attachment_columns)}
+                    FROM facebook_attachments fa
+                    WHERE fa.post_url IN (SELECT fp.post_url FROM facebook_posts fp WHERE {SHARD_OF_POST} = {shard})
+                """, attachment_columns)
+                # Copied ids keep their values; continue the sequence after them
+                cursor.execute("""
+                    SELECT setval(pg_get_serial_sequence('facebook_posts', 'id'), MAX(id))
+                    FROM facebook_posts
+                    WHERE pg_get_serial_sequence('facebook_posts', 'id') IS NOT NULL
+                """)
+                cursor.close()
+                target.commit()
+                logger.info(f"Shard {shard}: copied {posts} posts and {attachments} attachments "
+                            f"in {time.monotonic() - started:.1f}s")
+            finally:
+                target.close()
+    finally:
+        source.close()
+
+
+def check_shards():
+    """Log the posts stored on a shard other than their group's; returns their total"""
+    misplaced = 0
+    for shard in range(SHARD_COUNT):
+        conn = get_db_connection(readonly=True, pooled=False, shard=shard)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT COUNT(*) FILTER (WHERE {SHARD_OF_POST} <> {shard}), COUNT(*)
+                FROM facebook_posts fp
+            """)
+            wrong, total = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        misplaced += wrong
+        log = logger.warning if wrong else logger.info
+        log(f"Shard {shard}: {total} posts, {wrong} belong to another shard")
+    return misplaced
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split posts across the shards in DB_SHARD_DSNS")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument('--copy', action='store_true', help="copy the primary's posts to empty shards")
+    action.add_argument('--check', action='store_true', help="count posts stored on the wrong shard")
+    args = parser.parse_args()
+
+    if not DB_SHARD_DSNS:
+        logger.error("DB_SHARD_DSNS is not set")
+        return 2
+    if args.copy:
+        copy_to_shards()
+        return 0
+    return 1 if check_shards() else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
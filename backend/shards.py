@@ -0,0 +1,155 @@
+"""
+Horizontal sharding of posts by group across several Postgres servers.
+
+With DB_SHARD_DSNS set, facebook_posts and facebook_attachments (and the
+tables init_db.sql maintains from them) live on the shards instead of the
+primary, which keeps users and the other application state. A post belongs to
+the shard of its group key, the same COALESCE(group_id, /groups/<id> of the
+post URL) the API filters on: the first 32 bits of its md5, modulo the number
+of shards. shard_for_post() and SHARD_SQL compute the same value, so the
+scraper and shard_migrate.py agree on where a post lives.
+
+Reads filtered on one group_id are routed to that group's shard. Everything
+else is scattered to every shard concurrently (db.run_concurrently) and
+gathered here: counts and sums are added up, and sorted listings are k-way
+merged on the sort key. Post ids come from per-shard sequences and are only
+unique within a shard.
+
+Without DB_SHARD_DSNS, route() returns [None] (the primary), so callers use
+one code path for both setups.
+"""
+
+import argparse
+import hashlib
+import heapq
+import re
+from itertools import islice
+
+from psycopg2.extras import RealDictCursor
+
+from db import DB_SHARD_DSNS, get_db_connection
+
+SHARD_COUNT = len(DB_SHARD_DSNS)
+SHARDING_ENABLED = SHARD_COUNT > 0
+
+GROUP_KEY_SQL = "COALESCE(NULLIF(fp.group_id, ''), (regexp_match(fp.post_url, '/groups/([^/?]+)'))[1])"
+# Shard of a facebook_posts row (alias fp) in SQL; matches shard_for_group()
+SHARD_SQL = f"(('x' || substr(md5(COALESCE({GROUP_KEY_SQL}, '')), 1, 8))::bit(32)::bigint % {{count}})"
+
+_GROUP_RE = re.compile(r'/groups/([^/?]+)')
+
+
+def group_key(post_url, group_id=None):
+    """Group key of a post, as GROUP_KEY_SQL computes it"""
+    if group_id:
+        return group_id
+    match = _GROUP_RE.search(post_url or '')
+    return match.group(1) if match else None
+
+
+def shard_for_group(group_id, count=None):
+    """Shard index holding the posts of a group (posts without a group share one shard)"""
+    digest = hashlib.md5((group_id or '').encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % (count or SHARD_COUNT)
+
+
+def shard_for_post(post_url, group_id=None, count=None):
+    """Shard index a scraped post has to be written to"""
+    return shard_for_group(group_key(post_url, group_id), count)
+
+
+def global_id(row_id, shard):
+    """Id of a row from a per-shard sequence that is unique across shards (e.g. authors in /api/authors)"""
+    return row_id if shard is None else row_id * SHARD_COUNT + shard
+
+
+def split_global_id(value):
+    """(shard, per-shard id) of a global_id(); (None, value) without sharding"""
+    if not SHARDING_ENABLED:
+        return None, value
+    return value % SHARD_COUNT, value // SHARD_COUNT
+
+
+def add_shard_argument(parser):
+    """The workers' --shard option; required with DB_SHARD_DSNS (run one process per shard)"""
+    def shard_index(value):
+        shard = int(value)
+        if not 0 <= shard < SHARD_COUNT:
+            raise argparse.ArgumentTypeError(f"no shard {shard}, DB_SHARD_DSNS has {SHARD_COUNT}")
+        return shard
+    parser.add_argument('--shard', type=shard_index, required=SHARDING_ENABLED,
+                        help="post shard to work on (index into DB_SHARD_DSNS)")
+
+
+def route(group_id=''):
+    """Shards a posts query has to read: [None] (the primary) without sharding,
+    the group's shard when filtering on group_id, every shard otherwise"""
+    if not SHARDING_ENABLED:
+        return [None]
+    if group_id:
+        return [shard_for_group(group_id)]
+    return list(range(SHARD_COUNT))
+
+
+def sort_key(field):
+    """Merge key for rows ordered by field; NULLs sort as the largest value, as in Postgres"""
+    def key(row):
+        value = row[field]
+        return (value is None, 0 if value is None else value)
+    return key
+
+
+def merge_sorted(results, key, reverse=False):
+    """k-way merge of per-shard row lists that are each sorted on key.
+
+    results is a list of (shard, rows); merged rows are copies with the source
+    shard under '_shard'.
+    """
+    streams = [[dict(row, _shard=shard) for row in rows] for shard, rows in results]
+    return heapq.merge(*streams, key=key, reverse=reverse)
+
+
+def merge_page(results, key, reverse, offset, limit):
+    """Rows offset..offset+limit of the merged order; each shard must return its first offset+limit rows"""
+    return list(islice(merge_sorted(results, key, reverse), offset, offset + limit))
+
+
+def merge_counts(results, key_field, count_field):
+    """Add up per-shard (key, count) rows; returns rows sorted by count, largest first"""
+    totals = {}
+    for _, rows in results:
+        for row in rows:
+            totals[row[key_field]] = totals.get(row[key_field], 0) + (row[count_field] or 0)
+    return sorted(({key_field: key, count_field: count} for key, count in totals.items()),
+                  key=lambda row: -row[count_field])
+
+
+def connect(shards):
+    """One read connection per shard; closes the ones already opened if any fails"""
+    conns = []
+    try:
+        for shard in shards:
+            conns.append(get_db_connection(readonly=True, shard=shard))
+    except Exception:
+        for conn in conns:
+            conn.close()
+        raise
+    return conns
+
+
+def iter_merged(conns, sql, params, key, reverse=False, batch_size=2000):
+    """Stream a query from every shard connection through server-side cursors, k-way merged on key.
+
+    Closes the connections when exhausted (or closed early).
+    """
+    try:
+        cursors = []
+        for index, conn in enumerate(conns):
+            cursor = conn.cursor(name=f'shard_merge_{index}', cursor_factory=RealDictCursor)
+            cursor.itersize = batch_size
+            cursor.execute(sql, params)
+            cursors.append(cursor)
+        yield from heapq.merge(*cursors, key=key, reverse=reverse)
+    finally:
+        for conn in conns:
+            conn.close()
@@ -0,0 +1,285 @@
+"""
+Server-side prepared statements for the fixed query shapes.
+
+The listing, detail and export queries are rebuilt per request, but only a
+handful of distinct texts exist (one per filter/sort combination). execute()
+canonicalizes the SQL text into a statement name, PREPAREs it once per pooled
+connection and runs EXECUTE afterwards, so Postgres can reuse the plan instead
+of parsing and planning the large json_agg/GROUP BY query on every request.
+Each connection keeps at most STATEMENT_CACHE_SIZE statements (least recently
+used are deallocated). Unpooled connections run the SQL ad hoc.
+
+Prepared plans depend on the schema. init_db.sql keeps a version counter in
+app_schema_version that an event trigger bumps on every DDL command; each
+server's version (primary, replicas and post shards are tracked separately) is
+re-read at most every SCHEMA_VERSION_CHECK_INTERVAL seconds and a change
+deallocates the statements of every connection to it on its next use.
+Errors caused by a schema change under a prepared plan are retried once after
+deallocating.
+
+Every STATEMENT_SAMPLE_EVERY executions of a shape, the planning time of the
+prepared and the ad-hoc form are both measured with EXPLAIN (SUMMARY); stats()
+reports the averages and the estimated planning time saved.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+PREPARED_STATEMENTS_ENABLED = os.getenv('PREPARED_STATEMENTS_ENABLED', 'true').lower() == 'true'
+# Prepared statements kept per connection
+STATEMENT_CACHE_SIZE = int(os.getenv('STATEMENT_CACHE_SIZE', '64'))
+SCHEMA_VERSION_CHECK_INTERVAL = float(os.getenv('SCHEMA_VERSION_CHECK_INTERVAL', '30'))
+# Measure planning time on every Nth execution of a shape (0 disables sampling)
+STATEMENT_SAMPLE_EVERY = int(os.getenv('STATEMENT_SAMPLE_EVERY', '100'))
+
+# Raised by Postgres when a prepared plan no longer matches the schema
+_STALE_PLAN_ERRORS = (
+    psycopg2.errors.FeatureNotSupported,     # cached plan must not change result type
+    psycopg2.errors.UndefinedTable,
+    psycopg2.errors.UndefinedColumn,
+    psycopg2.errors.InvalidSqlStatementName,  # statement vanished (e.g. DISCARD ALL)
+)
+
+_PLACEHOLDER_RE = re.compile(r'%%|%s|%\(')
+
+
+def to_positional(sql):
+    """Rewrite psycopg2 %s placeholders as $1..$n; returns (sql, n)"""
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        token = match.group(0)
+        if token == '%%':
+            return '%'
+        if token == '%(':
+            raise ValueError("named placeholders are not supported")
+        count += 1
+        return f"${count}"
+
+    return _PLACEHOLDER_RE.sub(replace, sql), count
+
+
+def statement_name(sql):
+    """Stable name for a query text (whitespace-insensitive)"""
+    canonical = ' '.join(sql.split())
+    return 'fbq_' + hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+class StatementStats:
+    """Per-shape counters, shared by all connections of the process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shapes = {}
+        self.invalidations = 0
+
+    def _shape(self, name, label):
+        shape = self._shapes.get(name)
+        if shape is None:
+            shape = self._shapes[name] = {
+                'label': label or name, 'prepares': 0, 'prepared_executions': 0, 'adhoc_executions': 0,
+                'samples': 0, 'prepared_planning_ms': 0.0, 'adhoc_planning_ms': 0.0,
+            }
+        return shape
+
+    def record(self, name, label, prepared, prepares=0):
+        with self._lock:
+            shape = self._shape(name, label)
+            shape['prepares'] += prepares
+            shape['prepared_executions' if prepared else 'adhoc_executions'] += 1
+            return shape['prepared_executions'] + shape['adhoc_executions']
+
+    def record_sample(self, name, label, prepared_ms, adhoc_ms):
+        with self._lock:
+            shape = self._shape(name, label)
+            shape['samples'] += 1
+            shape['prepared_planning_ms'] += prepared_ms
+            shape['adhoc_planning_ms'] += adhoc_ms
+
+    def snapshot(self):
+        with self._lock:
+            shapes = []
+            saved_total = 0.0
+            for name, shape in self._shapes.items():
+                entry = {
+                    'name': name,
+                    'label': shape['label'],
+                    'prepares': shape['prepares'],
+                    'prepared_executions': shape['prepared_executions'],
+                    'adhoc_executions': shape['adhoc_executions'],
+                    'samples': shape['samples'],
+                }
+                if shape['samples']:
+                    prepared_avg = shape['prepared_planning_ms'] / shape['samples']
+                    adhoc_avg = shape['adhoc_planning_ms'] / shape['samples']
+                    saved = max(0.0, adhoc_avg - prepared_avg) * shape['prepared_executions']
+                    saved_total += saved
+                    entry.update({
+                        'avg_planning_ms_prepared': round(prepared_avg, 3),
+                        'avg_planning_ms_adhoc': round(adhoc_avg, 3),
+                        'est_planning_ms_saved': round(saved, 1),
+                    })
+                shapes.append(entry)
+            shapes.sort(key=lambda s: -(s['prepared_executions'] + s['adhoc_executions']))
+            return {
+                'enabled': PREPARED_STATEMENTS_ENABLED,
+                'invalidations': self.invalidations,
+                'est_planning_ms_saved': round(saved_total, 1),
+                'shapes': shapes,
+            }
+
+
+_stats = StatementStats()
+
+# Schema version per server (connection DSN) as last read from app_schema_version:
+# dsn -> [version or None, checked_at]
+_schema_lock = threading.Lock()
+_schema_versions = {}
+
+
+def _current_schema_version(raw):
+    """Re-read the server's schema version when the check interval has passed"""
+    now = time.monotonic()
+    with _schema_lock:
+        entry = _schema_versions.setdefault(raw.dsn, [None, 0.0])
+        if now - entry[1] < SCHEMA_VERSION_CHECK_INTERVAL:
+            return entry[0]
+        # Only between transactions, so a failed check can be rolled back safely
+        if raw.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return entry[0]
+        entry[1] = now
+    try:
+        cursor = raw.cursor()
+        cursor.execute("SELECT version FROM app_schema_version")
+        row = cursor.fetchone()
+        cursor.close()
+        raw.rollback()
+        version = row[0] if row else None
+    except psycopg2.Error as e:
+        raw.rollback()
+        logger.warning(f"Schema version check failed: {e}")
+        return entry[0]
+    with _schema_lock:
+        if entry[0] is not None and version != entry[0]:
+            _stats.invalidations += 1
+            logger.info(f"Schema version changed ({entry[0]} -> {version}); re-preparing statements")
+        entry[0] = version
+    return version
+
+
+def _state(raw):
+    """Prepared statements of a connection: {'version', 'names' (LRU name -> nparams)}"""
+    state = getattr(raw, 'statements', None)
+    if state is None:
+        state = raw.statements = {'version': None, 'names': OrderedDict()}
+    return state
+
+
+def _deallocate_all(raw, state):
+    cursor = raw.cursor()
+    cursor.execute("DEALLOCATE ALL")
+    cursor.close()
+    state['names'].clear()
+
+
+def _planning_ms(raw, sql, params):
+    cursor = raw.cursor()
+    cursor.execute(f"EXPLAIN (SUMMARY ON, FORMAT JSON) {sql}", params)
+    plan = cursor.fetchone()[0]
+    cursor.close()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return float(plan[0].get('Planning Time', 0.0))
+
+
+def _sample(raw, name, label, sql, params, nparams):
+    """Compare planning time of EXECUTE name vs the ad-hoc text (errors only skip the sample)"""
+    # Only between transactions, so a failed EXPLAIN can be rolled back safely
+    if raw.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return
+    try:
+        prepared_ms = _planning_ms(raw, f"EXECUTE {name}({', '.join(['%s'] * nparams)})" if nparams else
+                                   f"EXECUTE {name}", params)
+        adhoc_ms = _planning_ms(raw, sql, params)
+    except psycopg2.Error as e:
+        raw.rollback()
+        logger.debug(f"Planning sample for {label or name} failed: {e}")
+        return
+    _stats.record_sample(name, label, prepared_ms, adhoc_ms)
+
+
+def execute(cursor, sql, params=None, label=None):
+    """cursor.execute(sql, params) through a named prepared statement where possible.
+
+    Uses a prepared statement only for client-side cursors of pooled
+    connections (see db.ConnectionPool); everything else runs ad hoc. Call it at
+    the start of a transaction: a stale-plan error rolls the transaction back
+    before the retry.
+    """
+    raw = cursor.connection
+    name = statement_name(sql)
+    if not PREPARED_STATEMENTS_ENABLED or cursor.name is not None or not getattr(raw, 'pooled', False):
+        cursor.execute(sql, params)
+        _stats.record(name, label, prepared=False)
+        return
+
+    params = list(params or [])
+    for attempt in (1, 2):
+        state = _state(raw)
+        version = _current_schema_version(raw)
+        try:
+            if state['version'] != version:
+                _deallocate_all(raw, state)
+                state['version'] = version
+
+            prepares = 0
+            nparams = state['names'].get(name)
+            if nparams is None:
+                positional, nparams = to_positional(sql)
+                cursor.execute(f"PREPARE {name} AS {positional}")
+                state['names'][name] = nparams
+                prepares = 1
+                while len(state['names']) > STATEMENT_CACHE_SIZE:
+                    evicted, _ = state['names'].popitem(last=False)
+                    cursor.execute(f"DEALLOCATE {evicted}")
+            else:
+                state['names'].move_to_end(name)
+            if len(params) != nparams:
+                raise ValueError(f"{label or name}: expected {nparams} parameters, got {len(params)}")
+
+            executions = _stats.record(name, label, prepared=True, prepares=prepares)
+            if STATEMENT_SAMPLE_EVERY and executions % STATEMENT_SAMPLE_EVERY == 0:
+                _sample(raw, name, label, sql, params, nparams)
+            if nparams:
+                cursor.execute(f"EXECUTE {name}({', '.join(['%s'] * nparams)})", params)
+            else:
+                cursor.execute(f"EXECUTE {name}")
+            return
+        except _STALE_PLAN_ERRORS:
+            if attempt == 2:
+                raise
+            raw.rollback()
+            try:
+                _deallocate_all(raw, state)
+            except psycopg2.Error:
+                raw.rollback()
+                state['names'].clear()
+            with _schema_lock:
+                _stats.invalidations += 1
+
+
+def stats():
+    return _stats.snapshot()
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from analytics import _growth, _rolling_mean, compute_trends, concat_trend_columns
+
+DAY = 86400
+NOW = 20000 * DAY + 3600
+
+
+def columns(posts):
+    """fetch_trend_columns()-style arrays from (created_at, reactions, comments, shares, group, author) tuples"""
+    created, reactions, comments, shares, groups, authors = zip(*posts) if posts else ((),) * 6
+    return {
+        'created_at': np.asarray(created, dtype=np.int64),
+        'reactions': np.asarray(reactions, dtype=np.int64),
+        'comments': np.asarray(comments, dtype=np.int64),
+        'shares': np.asarray(shares, dtype=np.int64),
+        'group_id': np.asarray(groups, dtype=object),
+        'author': np.asarray(authors, dtype=object),
+    }
+
+
+def test_daily_buckets_count_posts_and_engagement():
+    data = columns([
+        (NOW - 2 * DAY, 1, 2, 3, 'g1', 'ann'),
+        (NOW - 2 * DAY + 60, 4, 0, 0, 'g1', 'bob'),
+        (NOW, 10, 0, 0, 'g2', 'ann'),
+        # Before the window
+        (NOW - 30 * DAY, 100, 0, 0, 'g1', 'ann'),
+    ])
+    trends = compute_trends(data, NOW, days=3, bucket='day', top=10, rolling_window=2)
+
+    assert trends['buckets'] == ['2024-10-02', '2024-10-03', '2024-10-04']
+    assert trends['overall']['posts'] == [2, 0, 1]
+    assert trends['overall']['reactions'] == [5, 0, 10]
+    assert trends['overall']['total_engagement'] == 20
+    by_group = {series['key']: series['posts'] for series in trends['groups']}
+    assert by_group == {'g1': [2, 0, 0], 'g2': [0, 0, 1]}
+
+
+def test_weekly_buckets_start_on_the_epoch_week():
+    data = columns([(NOW, 1, 0, 0, 'g1', 'ann'), (NOW - 7 * DAY, 2, 0, 0, 'g1', 'ann')])
+    trends = compute_trends(data, NOW, days=14, bucket='week', top=10, rolling_window=1)
+
+    assert len(trends['buckets']) == 2
+    assert trends['overall']['reactions'] == [2, 1]
+
+
+def test_top_keeps_most_frequent_keys_and_skips_empty_ones():
+    data = columns([
+        (NOW, 0, 0, 0, 'big', ''),
+        (NOW, 0, 0, 0, 'big', ''),
+        (NOW, 0, 0, 0, 'small', ''),
+        (NOW, 0, 0, 0, '', ''),
+    ])
+    trends = compute_trends(data, NOW, days=1, bucket='day', top=1, rolling_window=1)
+
+    assert [series['key'] for series in trends['groups']] == ['big']
+    assert trends['authors'] == []
+    assert trends['overall']['total_posts'] == 4
+
+
+def test_rolling_mean_averages_what_exists_at_the_start():
+    values = np.array([[2.0, 4.0, 6.0, 8.0]])
+    assert _rolling_mean(values, 2).tolist() == [[2.0, 3.0, 5.0, 7.0]]
+    assert _rolling_mean(values, 3).tolist() == [[2.0, 3.0, 4.0, 6.0]]
+
+
+def test_growth_compares_trailing_windows():
+    growth = _growth(np.array([[1.0, 1.0, 2.0, 2.0, 0.0]]), 2)[0]
+    assert np.isnan(growth[:3]).all()
+    assert growth[3] == pytest.approx(1.0)
+    # Previous window (1, 2) -> current (2, 0)
+    assert growth[4] == pytest.approx(-1 / 3)
+
+
+def test_growth_is_undefined_after_an_empty_window():
+    growth = _growth(np.array([[0.0, 0.0, 3.0]]), 1)[0]
+    assert np.isnan(growth).all()
+
+
+def test_percentiles_per_series():
+    data = columns([(NOW, value, 0, 0, 'g1', 'ann') for value in range(1, 101)])
+    trends = compute_trends(data, NOW, days=1, bucket='day', top=10, rolling_window=1)
+
+    percentiles = trends['groups'][0]['engagement_per_post_percentiles']
+    assert percentiles == {'p50': 50.5, 'p75': 75.25, 'p90': 90.1, 'p99': 99.01}
+
+
+def test_percentiles_of_an_empty_window_are_null():
+    trends = compute_trends(columns([]), NOW, days=2, bucket='day', top=10, rolling_window=1)
+
+    assert trends['overall']['posts'] == [0, 0]
+    assert set(trends['overall']['engagement_per_post_percentiles'].values()) == {None}
+
+
+def test_concat_trend_columns_joins_shards():
+    first = columns([(NOW, 1, 0, 0, 'g1', 'ann')])
+    second = columns([(NOW - DAY, 2, 0, 0, 'g2', 'bob')])
+    joined = concat_trend_columns([first, second])
+
+    assert joined['reactions'].tolist() == [1, 2]
+    assert joined['group_id'].tolist() == ['g1', 'g2']
+    assert concat_trend_columns([first]) is first
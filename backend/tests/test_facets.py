@@ -0,0 +1,88 @@
+from datetime import date
+
+from facets import build_facets, facet_query, merge_facets, normalize_filters
+
+
+def facet_row(facet, count, group_key=None, content_type=None, day=None, author_id=None, author_name=None):
+    return {'facet': facet, 'group_key': group_key, 'content_type': content_type, 'day': day,
+            'author_id': author_id, 'author_name': author_name, 'count': count}
+
+
+SHARD_A = [
+    facet_row(15, 6),
+    facet_row(7, 4, group_key='cars'),
+    facet_row(7, 2, group_key='bikes'),
+    facet_row(7, 3, group_key=None),
+    facet_row(11, 5, content_type='photo'),
+    facet_row(11, 1, content_type='video'),
+    facet_row(13, 2, day=date(2024, 10, 3)),
+    facet_row(13, 4, day=date(2024, 10, 1)),
+    facet_row(14, 4, author_id=1, author_name='Bob'),
+    facet_row(14, 2, author_id=2, author_name='Alice'),
+]
+SHARD_B = [
+    facet_row(15, 3),
+    facet_row(7, 3, group_key='bikes'),
+    facet_row(11, 3, content_type='video'),
+    facet_row(13, 3, day=date(2024, 10, 3)),
+    facet_row(14, 1, author_id=1, author_name='Bob'),
+    facet_row(14, 2, author_id=7, author_name='Carol'),
+]
+
+
+def test_build_facets_shapes_and_sorts():
+    facets = build_facets(SHARD_A)
+
+    assert facets['total'] == 6
+    # Posts without a group are not offered as a group
+    assert facets['groups'] == [{'group_id': 'cars', 'count': 4}, {'group_id': 'bikes', 'count': 2}]
+    assert facets['content_types'] == [{'content_type': 'photo', 'count': 5}, {'content_type': 'video', 'count': 1}]
+    assert facets['days'] == [{'date': '2024-10-01', 'count': 4}, {'date': '2024-10-03', 'count': 2}]
+    assert facets['authors'] == [{'id': 1, 'name': 'Bob', 'count': 4}, {'id': 2, 'name': 'Alice', 'count': 2}]
+
+
+def test_build_facets_without_rows():
+    assert build_facets([]) == {'total': 0, 'groups': [], 'content_types': [], 'days': [], 'authors': []}
+
+
+def test_merge_facets_adds_up_shards():
+    merged = merge_facets([build_facets(SHARD_A), build_facets(SHARD_B)], top_authors=10)
+
+    assert merged['total'] == 9
+    assert merged['groups'] == [{'group_id': 'bikes', 'count': 5}, {'group_id': 'cars', 'count': 4}]
+    assert merged['content_types'] == [{'content_type': 'photo', 'count': 5}, {'content_type': 'video', 'count': 4}]
+    assert merged['days'] == [{'date': '2024-10-01', 'count': 4}, {'date': '2024-10-03', 'count': 5}]
+
+
+def test_merge_facets_matches_authors_by_name():
+    shard_b = [facet_row(14, 6, author_id=9, author_name='Bob')]
+    merged = merge_facets([build_facets(SHARD_A), build_facets(shard_b)], top_authors=10)
+
+    # Bob keeps the id of the shard where he has the most posts
+    assert merged['authors'][0] == {'id': 9, 'name': 'Bob', 'count': 10}
+    assert merge_facets([build_facets(SHARD_A), build_facets(SHARD_B)], top_authors=2)['authors'] == [
+        {'id': 1, 'name': 'Bob', 'count': 5},
+        {'id': 2, 'name': 'Alice', 'count': 2},
+    ]
+
+
+def test_facet_query_params_match_placeholders():
+    excluding = {
+        'groups': ("fp.content_type = %s", ['photo']),
+        'content_types': ("fp.group_id = %s", ['cars']),
+    }
+    sql, params = facet_query("fp.group_id = %s AND fp.content_type = %s", ['cars', 'photo'], 5, excluding)
+
+    assert sql.count('%s') == len(params)
+    assert params == ['cars', 'photo', 'photo', 'cars', 'photo', 'cars', 5]
+
+    sql, params = facet_query("TRUE", [], 5)
+    assert sql.count('%s') == len(params) == 1
+
+
+def test_normalize_filters():
+    args = {'search': '  bike ', 'group_id': '', 'dedupe': 'TRUE', 'author_id': None}
+    assert normalize_filters(args, ['search', 'group_id', 'dedupe', 'author_id']) == {
+        'search': 'bike', 'dedupe': 'true',
+    }
+    assert normalize_filters({'dedupe': 'yes'}, ['dedupe']) == {}
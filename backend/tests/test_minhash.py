@@ -0,0 +1,43 @@
+import numpy as np
+
+from minhash import LSH_BANDS, NUM_PERM, band_hashes, normalize_text, signature, similarity
+
+POST = 'Selling my bike, barely used, great condition! Message me for details.'
+
+
+def test_signature_is_stable():
+    # Stored signatures and band hashes stay comparable only while these do not change
+    sig = signature('The quick brown fox jumps over the lazy dog')
+    assert sig.dtype == np.int32
+    assert len(sig) == NUM_PERM
+    assert sig[:4].tolist() == [29999252, 8144683, 83334831, 14836695]
+    assert band_hashes(sig)[:2] == [4641908761683628369, -2603368582536246573]
+
+
+def test_normalization_ignores_case_punctuation_and_urls():
+    assert normalize_text('Hello,   WORLD!! https://example.com/x?y=1 ok') == 'hello world ok'
+    reposted = 'Selling my bike - barely used, great condition!! message me for details https://x.co/1'
+    assert similarity(signature(POST), signature(reposted)) == 1.0
+
+
+def test_short_text_has_no_signature():
+    assert signature('hi!') is None
+    assert signature('') is None
+    assert signature(None) is None
+
+
+def test_near_duplicates_share_a_band():
+    edited = 'Selling my bike, barely used, good condition! Message me for the details.'
+    unrelated = 'Lost cat near the park on Main street, answers to Whiskers, please call.'
+    a, b, c = signature(POST), signature(edited), signature(unrelated)
+
+    assert similarity(a, b) > 0.7
+    assert similarity(a, c) < 0.2
+    assert set(band_hashes(a)) & set(band_hashes(b))
+    assert not set(band_hashes(a)) & set(band_hashes(c))
+
+
+def test_band_hashes_fit_bigint():
+    hashes = band_hashes(signature(POST))
+    assert len(hashes) == LSH_BANDS
+    assert all(-2 ** 63 <= h < 2 ** 63 for h in hashes)
@@ -0,0 +1,89 @@
+import argparse
+
+import pytest
+
+import shards
+from shards import group_key, merge_counts, merge_page, shard_for_post, sort_key
+
+
+def post(post_id, created_at):
+    return {'id': post_id, 'created_at': created_at}
+
+
+def test_sort_key_puts_nulls_last():
+    rows = [post(1, 30), post(2, None), post(3, 10)]
+    assert [row['id'] for row in sorted(rows, key=sort_key('created_at'))] == [3, 1, 2]
+    # Descending, NULLs come first, as in Postgres ORDER BY ... DESC
+    assert [row['id'] for row in sorted(rows, key=sort_key('created_at'), reverse=True)] == [2, 1, 3]
+
+
+def test_merge_page_interleaves_shards():
+    results = [
+        (0, [post(1, 10), post(2, 30), post(3, 50)]),
+        (1, [post(1, 20), post(2, 40), post(3, None)]),
+    ]
+    page = merge_page(results, sort_key('created_at'), reverse=False, offset=0, limit=10)
+    assert [(row['_shard'], row['created_at']) for row in page] == [
+        (0, 10), (1, 20), (0, 30), (1, 40), (0, 50), (1, None),
+    ]
+
+
+def test_merge_page_offset_and_reverse():
+    # Each shard returns its first offset + limit rows in the requested order
+    results = [
+        (0, [post(1, 50), post(2, 30), post(3, 10)]),
+        (1, [post(4, None), post(5, 40), post(6, 20)]),
+    ]
+    page = merge_page(results, sort_key('created_at'), reverse=True, offset=1, limit=3)
+    assert [(row['_shard'], row['id']) for row in page] == [(0, 1), (1, 5), (0, 2)]
+    # The shard results are not modified
+    assert '_shard' not in results[0][1][0]
+
+
+def test_merge_page_with_empty_shard():
+    results = [(0, []), (1, [post(1, 5)])]
+    assert merge_page(results, sort_key('created_at'), False, 0, 10) == [{'id': 1, 'created_at': 5, '_shard': 1}]
+    assert merge_page(results, sort_key('created_at'), False, 1, 10) == []
+
+
+def test_merge_counts_adds_up_and_sorts():
+    results = [
+        (0, [{'content_type': 'photo', 'count': 3}, {'content_type': 'video', 'count': 1}]),
+        (1, [{'content_type': 'video', 'count': 4}, {'content_type': 'text', 'count': None}]),
+    ]
+    assert merge_counts(results, 'content_type', 'count') == [
+        {'content_type': 'video', 'count': 5},
+        {'content_type': 'photo', 'count': 3},
+        {'content_type': 'text', 'count': 0},
+    ]
+
+
+def test_group_key_and_shard_for_post():
+    assert group_key('https://www.facebook.com/groups/cars/posts/1') == 'cars'
+    assert group_key('https://www.facebook.com/groups/cars/posts/1', group_id='123') == '123'
+    assert group_key('https://www.facebook.com/somepage/posts/1') is None
+    # Posts of a group always land on the same shard
+    assert shard_for_post('https://www.facebook.com/groups/cars/posts/1', count=4) == \
+        shard_for_post('https://www.facebook.com/groups/cars/posts/2', count=4)
+    assert all(0 <= shard_for_post(f'/groups/g{i}/', count=3) < 3 for i in range(20))
+
+
+def test_global_ids_round_trip(monkeypatch):
+    assert shards.global_id(7, None) == 7
+    monkeypatch.setattr(shards, 'SHARD_COUNT', 3)
+    monkeypatch.setattr(shards, 'SHARDING_ENABLED', True)
+    ids = {shards.global_id(row_id, shard) for row_id in range(1, 10) for shard in range(3)}
+    assert len(ids) == 27
+    assert shards.split_global_id(shards.global_id(7, 2)) == (2, 7)
+
+
+def test_shard_argument(monkeypatch):
+    monkeypatch.setattr(shards, 'SHARD_COUNT', 2)
+    monkeypatch.setattr(shards, 'SHARDING_ENABLED', True)
+    parser = argparse.ArgumentParser()
+    shards.add_shard_argument(parser)
+    assert parser.parse_args(['--shard', '1']).shard == 1
+    with pytest.raises(SystemExit):
+        parser.parse_args(['--shard', '2'])
+    with pytest.raises(SystemExit):
+        parser.parse_args([])
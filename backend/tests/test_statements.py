@@ -0,0 +1,32 @@
+import pytest
+
+from statements import statement_name, to_positional
+
+
+def test_placeholders_become_positional():
+    sql, count = to_positional("SELECT * FROM facebook_posts WHERE group_id = %s AND created_at > %s LIMIT %s")
+    assert sql == "SELECT * FROM facebook_posts WHERE group_id = $1 AND created_at > $2 LIMIT $3"
+    assert count == 3
+
+
+def test_escaped_percent_is_a_literal():
+    sql, count = to_positional("SELECT * FROM facebook_posts WHERE post_text ILIKE %s OR post_url LIKE '%%/groups/%%'")
+    assert sql == "SELECT * FROM facebook_posts WHERE post_text ILIKE $1 OR post_url LIKE '%/groups/%'"
+    assert count == 1
+
+    # %%s is a literal '%s', not a placeholder
+    assert to_positional("SELECT '%%s', %s") == ("SELECT '%s', $1", 1)
+
+
+def test_no_placeholders():
+    assert to_positional("SELECT 1") == ("SELECT 1", 0)
+
+
+def test_named_placeholders_are_rejected():
+    with pytest.raises(ValueError):
+        to_positional("SELECT * FROM facebook_posts WHERE group_id = %(group_id)s")
+
+
+def test_statement_name_ignores_whitespace():
+    assert statement_name("SELECT  1\n FROM t") == statement_name("SELECT 1 FROM t")
+    assert statement_name("SELECT 1 FROM t") != statement_name("SELECT 2 FROM t")
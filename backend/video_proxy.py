@@ -0,0 +1,169 @@
+"""
+Streaming helpers for /api/video-proxy.
+
+Video bodies are never buffered: the upstream response is relayed in
+VIDEO_CHUNK_SIZE chunks with the client's Range forwarded, so seeking works and
+memory stays constant. With VIDEO_CACHE_ENABLED, fixed-size aligned segments
+are written to disk as they stream past; a later request whose range is fully
+covered by cached segments is answered without contacting the CDN.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import urllib.request
+
+from image_cache import UPSTREAM_HEADERS
+
+VIDEO_CHUNK_SIZE = 64 * 1024
+VIDEO_CACHE_ENABLED = os.getenv('VIDEO_CACHE_ENABLED', 'false').lower() == 'true'
+VIDEO_CACHE_DIR = os.getenv('VIDEO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'fb_video_cache'))
+VIDEO_SEGMENT_SIZE = int(os.getenv('VIDEO_SEGMENT_SIZE', str(1024 * 1024)))
+VIDEO_CACHE_MAX_AGE = int(os.getenv('VIDEO_CACHE_MAX_AGE', str(7 * 86400)))
+
+# Upstream headers relayed to the client
+PASSTHROUGH_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified')
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single-range header against a known size.
+
+    Returns None when the header is absent, multi-range or unsatisfiable.
+    """
+    match = _RANGE_RE.match((header or '').strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def open_upstream(url, range_header=None, timeout=15):
+    """Open the CDN response (caller closes it); raises urllib errors"""
+    headers = dict(UPSTREAM_HEADERS, Accept='*/*')
+    if range_header:
+        headers['Range'] = range_header
+    return urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout)
+
+
+def upstream_extent(resp):
+    """(first byte offset, total size or None) of an upstream 200/206 response"""
+    match = _CONTENT_RANGE_RE.match(resp.headers.get('Content-Range', ''))
+    if resp.status == 206 and match:
+        total = match.group(3)
+        return int(match.group(1)), (int(total) if total != '*' else None)
+    length = resp.headers.get('Content-Length')
+    return 0, (int(length) if length and length.isdigit() else None)
+
+
+def iter_upstream(resp, chunk_size=VIDEO_CHUNK_SIZE):
+    """Relay an upstream body chunk by chunk, closing it at the end"""
+    try:
+        while True:
+            chunk = resp.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        resp.close()
+
+
+class SegmentCache:
+    """Aligned VIDEO_SEGMENT_SIZE segments per URL: <dir>/<sha256(url)>/{meta.json,<index>}"""
+
+    def __init__(self, directory=VIDEO_CACHE_DIR, segment_size=VIDEO_SEGMENT_SIZE, max_age=VIDEO_CACHE_MAX_AGE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_age = max_age
+
+    def _dir(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def get_meta(self, url):
+        """{'size', 'content_type'} of a cached video, or None"""
+        path = os.path.join(self._dir(url), 'meta.json')
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put_meta(self, url, size, content_type):
+        directory = self._dir(url)
+        os.makedirs(directory, exist_ok=True)
+        self._write(os.path.join(directory, 'meta.json'),
+                    json.dumps({'size': size, 'content_type': content_type}).encode('utf-8'))
+
+    def _write(self, path, data):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def read_range(self, url, start, end):
+        """Chunk iterator for bytes start..end, or None unless every segment is cached"""
+        directory = self._dir(url)
+        first, last = start // self.segment_size, end // self.segment_size
+        paths = [os.path.join(directory, str(i)) for i in range(first, last + 1)]
+        if not all(os.path.exists(p) for p in paths):
+            return None
+
+        def chunks():
+            for index, path in zip(range(first, last + 1), paths):
+                seg_start = index * self.segment_size
+                lo = max(start, seg_start) - seg_start
+                hi = min(end + 1, seg_start + self.segment_size) - seg_start
+                with open(path, 'rb') as f:
+                    f.seek(lo)
+                    remaining = hi - lo
+                    while remaining > 0:
+                        chunk = f.read(min(VIDEO_CHUNK_SIZE, remaining))
+                        if not chunk:
+                            return
+                        remaining -= len(chunk)
+                        yield chunk
+
+        return chunks()
+
+    def tee(self, url, start, total, chunks):
+        """Yield chunks unchanged while saving every complete aligned segment they cover"""
+        directory = self._dir(url)
+        seg = self.segment_size
+        index = -(-start // seg)          # first segment boundary at or after start
+        skip = index * seg - start        # bytes before that boundary are not cached
+        buffer = bytearray()
+        for chunk in chunks:
+            yield chunk
+            if skip >= len(chunk):
+                skip -= len(chunk)
+                continue
+            buffer += chunk[skip:]
+            skip = 0
+            while len(buffer) >= seg:
+                self._save(directory, index, bytes(buffer[:seg]))
+                del buffer[:seg]
+                index += 1
+        # The final, short segment of the file
+        if buffer and total is not None and index * seg + len(buffer) == total:
+            self._save(directory, index, bytes(buffer))
+
+    def _save(self, directory, index, data):
+        try:
+            self._write(os.path.join(directory, str(index)), data)
+        except OSError:
+            pass
@@ -1,5 +1,5 @@
 import { useState } from 'react'
-import { getImageSrc } from '../utils/imageUrl'
+import { getImageSrc, getVideoSrc } from '../utils/imageUrl'
 
 const PostCard = ({ post, onClick }) => {
   const [imageError, setImageError] = useState(false)
@@ -38,7 +38,7 @@ const PostCard = ({ post, onClick }) => {
       {post.content_type === 'video' && post.video_urls && post.video_urls.length > 0 ? (
         <div className="relative h-48 bg-gray-200 dark:bg-gray-700 overflow-hidden">
           <video
-            src={post.video_urls[0]}
+            src={getVideoSrc(post.video_urls[0])}
             className="w-full h-full object-cover"
             controls
             muted
@@ -116,6 +116,11 @@ const PostCard = ({ post, onClick }) => {
         {/* Date and Time */}
         <p className="text-xs text-gray-400 dark:text-gray-500">
           {formatDateTime(post.created_at)}
+          {post.duplicate_count > 0 && (
+            <span className="ml-2 text-gray-500 dark:text-gray-400">
+              · +{post.duplicate_count} similar
+            </span>
+          )}
         </p>
       </div>
     </div>
@@ -1,5 +1,5 @@
 import { useState } from 'react'
-import { getImageSrc } from '../utils/imageUrl'
+import { getImageSrc, getVideoSrc } from '../utils/imageUrl'
 
 const PostDetailModal = ({ post, onClose }) => {
   const [imageError, setImageError] = useState(false)
@@ -46,7 +46,7 @@ const PostDetailModal = ({ post, onClose }) => {
           {post.content_type === 'video' && post.video_urls && post.video_urls.length > 0 ? (
             <div className="mb-6 rounded-lg overflow-hidden bg-gray-100 dark:bg-gray-700">
               <video
-                src={post.video_urls[0]}
+                src={getVideoSrc(post.video_urls[0])}
                 className="w-full h-auto max-h-96 object-contain"
                 controls
                 autoPlay={false}
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { useLocation, useSearchParams } from 'react-router-dom'
 import { useAuth } from '../context/AuthContext'
 import api from '../services/api'
@@ -15,14 +15,18 @@ const Overview = () => {
   const [loading, setLoading] = useState(true)
   const [filters, setFilters] = useState({
     author: '',
+    author_id: '',
     keyword: searchParams.get('search') || location.state?.search || '',
     group_id: '',
     date_from: '',
     date_to: '',
+    content_type: '',
     sort_by: 'created_at',
     order: 'desc',
+    dedupe: '',
   })
   const [groups, setGroups] = useState([])
+  const [facets, setFacets] = useState(null)
   const [exportLoading, setExportLoading] = useState(false)
   const [pagination, setPagination] = useState({
     page: 1,
@@ -32,6 +36,8 @@ const Overview = () => {
   })
   const [selectedPost, setSelectedPost] = useState(null)
   const [filtersOpen, setFiltersOpen] = useState(true)
+  const [authorInput, setAuthorInput] = useState('')
+  const [authorSuggestions, setAuthorSuggestions] = useState([])
 
   useEffect(() => {
     if (isAuthenticated) {
@@ -40,6 +46,73 @@ const Overview = () => {
     }
   }, [isAuthenticated])
 
+  // Author typeahead: suggestions come from /api/authors; posts are only re-fetched on selection
+  useEffect(() => {
+    const prefix = authorInput.trim()
+    if (!isAuthenticated || !prefix || filters.author_id) {
+      setAuthorSuggestions([])
+      return
+    }
+    let cancelled = false
+    const timer = setTimeout(async () => {
+      try {
+        const response = await api.get('/authors', { params: { prefix, limit: 8 } })
+        if (!cancelled) setAuthorSuggestions(response.data.authors)
+      } catch (error) {
+        console.error('Error fetching authors:', error)
+      }
+    }, 150)
+    return () => {
+      cancelled = true
+      clearTimeout(timer)
+    }
+  }, [authorInput, filters.author_id, isAuthenticated])
+
+  // Live updates: re-fetch only when the server reports new posts or engagement changes
+  const filtersRef = useRef(filters)
+  const pageRef = useRef(pagination.page)
+  filtersRef.current = filters
+  pageRef.current = pagination.page
+
+  useEffect(() => {
+    if (!isAuthenticated || typeof EventSource === 'undefined') return
+    const token = localStorage.getItem('token')
+    if (!token) return
+
+    const source = new EventSource(`/api/events?jwt=${encodeURIComponent(token)}`)
+
+    const applyStatsDelta = (delta) => {
+      setStats(prev => prev && {
+        ...prev,
+        total_posts: prev.total_posts + (delta.posts || 0),
+        total_reactions: prev.total_reactions + (delta.reactions || 0),
+        total_comments: prev.total_comments + (delta.comments || 0),
+        total_shares: prev.total_shares + (delta.shares || 0),
+      })
+    }
+
+    source.addEventListener('posts', (e) => {
+      const event = JSON.parse(e.data)
+      applyStatsDelta(event)
+      fetchGroups()
+      fetchFacets()
+      // Only the first page of the current listing can change; don't clobber "load more" results
+      const groupId = filtersRef.current.group_id
+      const affectsListing = !groupId || !event.groups || event.groups[groupId]
+      if (affectsListing && pageRef.current === 1) {
+        fetchPosts()
+      }
+    })
+    source.addEventListener('stats', (e) => applyStatsDelta(JSON.parse(e.data)))
+    source.addEventListener('resync', () => {
+      fetchStats()
+      fetchGroups()
+      fetchFacets()
+    })
+
+    return () => source.close()
+  }, [isAuthenticated])
+
   const fetchGroups = async () => {
     try {
       const response = await api.get('/groups')
@@ -72,13 +145,19 @@ const Overview = () => {
     }
   }, [isAuthenticated, filters, pagination.page])
 
+  useEffect(() => {
+    if (isAuthenticated) {
+      fetchFacets()
+    }
+  }, [isAuthenticated, filters])
+
   const fetchPosts = async () => {
     try {
       setLoading(true)
       const params = {
-        page: pagination.page,
+        page: pageRef.current,
         per_page: pagination.per_page,
-        ...filters,
+        ...filtersRef.current,
       }
       
       Object.keys(params).forEach(key => {
@@ -90,7 +169,7 @@ const Overview = () => {
       const response = await api.get('/posts', { params })
       const { posts: fetchedPosts, pagination: paginationData } = response.data
       
-      if (pagination.page === 1) {
+      if (pageRef.current === 1) {
         setPosts(fetchedPosts)
       } else {
         setPosts(prev => [...prev, ...fetchedPosts])
@@ -108,6 +187,29 @@ const Overview = () => {
     }
   }
 
+  // Counts per group, content type, day and top authors for the current filters
+  const fetchFacets = async () => {
+    try {
+      const { sort_by, order, ...params } = filtersRef.current
+      Object.keys(params).forEach(key => {
+        if (params[key] === '') {
+          delete params[key]
+        }
+      })
+      const response = await api.get('/posts/facets', { params })
+      setFacets(response.data)
+    } catch (error) {
+      console.error('Error fetching facets:', error)
+    }
+  }
+
+  const groupFacetCounts = facets
+    ? Object.fromEntries(facets.groups.map(group => [group.group_id, group.count]))
+    : null
+  const contentTypeFacetCounts = facets
+    ? Object.fromEntries(facets.content_types.map(type => [type.content_type, type.count]))
+    : null
+
   const fetchStats = async () => {
     try {
       const response = await api.get('/stats')
@@ -152,8 +254,17 @@ const Overview = () => {
         }
       })
 
-      const response = await api.get('/posts/export', {
-        params,
+      // Exports run as background jobs; poll until the file is ready
+      let { data: job } = await api.post('/exports', params)
+      while (job.status === 'queued' || job.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, 1000))
+        job = (await api.get(`/exports/${job.id}`)).data
+      }
+      if (job.status !== 'done') {
+        throw new Error(job.error || 'Export failed')
+      }
+
+      const response = await api.get(`/exports/${job.id}/download`, {
         responseType: 'blob',
       })
 
@@ -181,15 +292,34 @@ const Overview = () => {
     handleFilterChange({ ...filters, [key]: value })
   }
 
+  const handleAuthorInput = (value) => {
+    setAuthorInput(value)
+    if (!value) {
+      handleFilterChange({ ...filters, author: '', author_id: '' })
+    } else if (filters.author_id) {
+      handleFilterChange({ ...filters, author_id: '' })
+    }
+  }
+
+  const handleAuthorSelect = (author) => {
+    setAuthorInput(author.name)
+    setAuthorSuggestions([])
+    handleFilterChange({ ...filters, author: '', author_id: String(author.id) })
+  }
+
   const handleClearFilters = () => {
+    setAuthorInput('')
     handleFilterChange({
       author: '',
+      author_id: '',
       keyword: '',
       group_id: '',
       date_from: '',
       date_to: '',
+      content_type: '',
       sort_by: 'created_at',
       order: 'desc',
+      dedupe: '',
     })
   }
 
@@ -303,24 +433,66 @@ const Overview = () => {
                         <option value="">All Groups</option>
                         {groups.map((group) => (
                           <option key={group.group_id} value={group.group_id}>
-                            {group.group_name || `Group ${group.group_id}`} ({group.post_count})
+                            {group.group_name || `Group ${group.group_id}`} ({groupFacetCounts ? (groupFacetCounts[group.group_id] || 0) : group.post_count})
                           </option>
                         ))}
                       </select>
                     </div>
 
-                    {/* Filter by Author */}
+                    {/* Filter by Media */}
                     <div>
+                      <label className="block text-sm font-medium text-gray-700 dark:text-gray-300 mb-2">
+                        Filter by Media
+                      </label>
+                      <select
+                        value={filters.content_type || ''}
+                        onChange={(e) => handleFilterUpdate('content_type', e.target.value)}
+                        className="w-full px-3 py-2 border border-gray-300 dark:border-gray-600 rounded-lg focus:ring-2 focus:ring-primary-500 focus:border-transparent outline-none bg-white dark:bg-gray-700 text-gray-900 dark:text-gray-100 text-sm"
+                      >
+                        <option value="">All Posts</option>
+                        {[['video', 'Videos'], ['image', 'Images'], ['text', 'Text only']].map(([type, label]) => (
+                          <option key={type} value={type}>
+                            {label}{contentTypeFacetCounts ? ` (${contentTypeFacetCounts[type] || 0})` : ''}
+                          </option>
+                        ))}
+                      </select>
+                    </div>
+
+                    {/* Filter by Author */}
+                    <div className="relative">
                       <label className="block text-sm font-medium text-gray-700 dark:text-gray-300 mb-2">
                         Filter by Author
                       </label>
                       <input
                         type="text"
-                        value={filters.author}
-                        onChange={(e) => handleFilterUpdate('author', e.target.value)}
+                        value={authorInput}
+                        onChange={(e) => handleAuthorInput(e.target.value)}
+                        onKeyDown={(e) => {
+                          // Enter without picking a suggestion falls back to a substring match
+                          if (e.key === 'Enter') {
+                            setAuthorSuggestions([])
+                            handleFilterChange({ ...filters, author: authorInput.trim(), author_id: '' })
+                          }
+                        }}
                         placeholder="Author name..."
                         className="w-full px-3 py-2 border border-gray-300 dark:border-gray-600 rounded-lg focus:ring-2 focus:ring-primary-500 focus:border-transparent outline-none bg-white dark:bg-gray-700 text-gray-900 dark:text-gray-100 placeholder-gray-500 dark:placeholder-gray-400 text-sm"
                       />
+                      {authorSuggestions.length > 0 && (
+                        <ul className="absolute z-20 mt-1 w-full max-h-64 overflow-y-auto bg-white dark:bg-gray-700 border border-gray-200 dark:border-gray-600 rounded-lg shadow-lg text-sm">
+                          {authorSuggestions.map((author) => (
+                            <li key={author.id}>
+                              <button
+                                type="button"
+                                onClick={() => handleAuthorSelect(author)}
+                                className="w-full flex items-center justify-between px-3 py-2 text-left text-gray-900 dark:text-gray-100 hover:bg-gray-100 dark:hover:bg-gray-600"
+                              >
+                                <span className="truncate">{author.name}</span>
+                                <span className="ml-2 text-xs text-gray-500 dark:text-gray-400">{author.post_count}</span>
+                              </button>
+                            </li>
+                          ))}
+                        </ul>
+                      )}
                     </div>
 
                     {/* Date From */}
@@ -351,7 +523,16 @@ const Overview = () => {
                   </div>
 
                   {/* Clear Filters Button */}
-                  <div className="flex justify-end">
+                  <div className="flex items-center justify-between">
+                    <label className="flex items-center gap-2 text-sm text-gray-700 dark:text-gray-300">
+                      <input
+                        type="checkbox"
+                        checked={filters.dedupe === 'true'}
+                        onChange={(e) => handleFilterUpdate('dedupe', e.target.checked ? 'true' : '')}
+                        className="rounded border-gray-300 dark:border-gray-600"
+                      />
+                      Hide near-duplicate posts
+                    </label>
                     <button
                       onClick={handleClearFilters}
                       className="px-4 py-2 bg-gray-200 dark:bg-gray-700 hover:bg-gray-300 dark:hover:bg-gray-600 text-gray-800 dark:text-gray-200 rounded-lg transition font-medium text-sm"
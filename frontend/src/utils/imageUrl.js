@@ -22,3 +22,17 @@ export function getImageSrc(url) {
   }
   return url
 }
+
+/**
+ * Returns the URL to use for a video. Facebook CDN videos go through the
+ * streaming proxy, which forwards Range requests so the player can seek.
+ * @param {string} url - Original video URL
+ * @returns {string} - URL to use in video src
+ */
+export function getVideoSrc(url) {
+  if (!url) return url
+  if (isFacebookCdnUrl(url)) {
+    return `/api/video-proxy?url=${encodeURIComponent(url)}`
+  }
+  return url
+}